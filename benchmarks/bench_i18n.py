@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+对比i18n.translated_print与旧实现(每个参数调用一次inspect.stack())的耗时
+
+用法:
+    python -m benchmarks.bench_i18n --number 20000 --depth 10
+"""
+import argparse
+import builtins
+import inspect
+import io
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import i18n  # noqa: E402
+
+
+def legacy_translated_print(*args, **kwargs):
+    for arg in args:
+        if i18n.package_name in inspect.stack()[1].filename:
+            translated_arg = i18n._tr(str(arg))
+        else:
+            translated_arg = str(arg)
+        i18n.original_print(translated_arg, **kwargs)
+
+
+def call_at_depth(func, depth: int, *args) -> None:
+    if depth <= 0:
+        func(*args, end=" | ")
+    else:
+        call_at_depth(func, depth - 1, *args)
+
+
+def run(func, number: int, depth: int) -> float:
+    sink = io.StringIO()
+    i18n.original_print = lambda *args, **kwargs: builtins.print(*args, file=sink, **kwargs)
+    try:
+        return timeit.timeit(lambda: call_at_depth(func, depth, "录制视频质量为: 原画", "当前时间: 12:00:00"),
+                             number=number)
+    finally:
+        i18n.original_print = builtins.print
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="每种实现调用print的次数")
+    parser.add_argument("--depth", type=int, default=10, help="调用print时的额外栈深度")
+    args = parser.parse_args()
+
+    results = {
+        "inspect.stack": run(legacy_translated_print, args.number, args.depth),
+        "sys._getframe": run(i18n.translated_print, args.number, args.depth),
+    }
+    baseline = results["inspect.stack"]
+    print(f"{'实现':<16}{'总耗时(s)':>12}{'单次(us)':>12}{'加速比':>10}")
+    for name, elapsed in results.items():
+        print(f"{name:<16}{elapsed:>12.3f}{elapsed / args.number * 1e6:>12.2f}{baseline / elapsed:>10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+抖音解析与签名的离线基准测试: 不访问线上平台, 所有请求由本地替身服务返回 benchmarks/fixtures/douyin 中的样本
+
+统计每个用例的吞吐量(次/秒)和单次耗时p50/p99, 并与保存的基线对比, p50变慢超过容忍比例时标记为退化
+
+用法:
+    python -m benchmarks.bench_spider --number 200
+    python -m benchmarks.bench_spider --save-baseline
+    python -m benchmarks.bench_spider --cases douyin_html,ab_sign --check
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import spider, room  # noqa: E402
+from src.ab_sign import ab_sign  # noqa: E402
+from benchmarks import douyin_fixtures as fixtures  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "spider_baseline.json"
+LIVE_URL = f"https://live.douyin.com/{fixtures.WEB_RID}"
+SHARE_URL = f"https://v.douyin.com/{fixtures.SHARE_CODE}/"
+WEB_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/116.0.5845.97 Safari/537.36 Core/1.116.567.400 QQBrowser/19.7.6764.400')
+WEB_ENTER_QUERY = ("aid=6383&app_name=douyin_web&live_id=1&device_platform=web&language=zh-CN&browser_language=zh-CN"
+                   f"&browser_platform=Win32&browser_name=Chrome&browser_version=116.0.0.0&web_rid={fixtures.WEB_RID}"
+                   "&msToken=")
+
+
+class Case:
+    def __init__(self, name: str, func: Callable[[], Awaitable | object], requests: int,
+                 check: Callable[[object], bool], scale: float = 1.0) -> None:
+        self.name = name
+        self.func = func
+        # 单次调用应当产生的请求数, 用于发现解析失败后静默切换到其他解析方式的情况
+        self.requests = requests
+        self.check = check
+        self.scale = scale
+
+    async def call(self) -> object:
+        result = self.func()
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+
+def is_live_room(result: dict) -> bool:
+    return (result.get('anchor_name') == fixtures.NICKNAME and result.get('status') == 2
+            and 'ORIGIN' in result['stream_url']['hls_pull_url_map'])
+
+
+def build_cases(skipped: dict[str, str]) -> list[Case]:
+    cases = [
+        Case("douyin_html", lambda: spider.get_douyin_stream_data(LIVE_URL), 1, is_live_room),
+        Case("douyin_web", lambda: spider.get_douyin_web_stream_data(LIVE_URL), 1, is_live_room),
+        Case("douyin_app", lambda: spider.get_douyin_app_stream_data(SHARE_URL), 3, is_live_room),
+        Case("play_url_list",
+             lambda: spider.get_play_url_list(fixtures.stream_urls("m3u8")["FULL_HD1"]), 1,
+             lambda result: len(result) == len(fixtures.QUALITIES)),
+        Case("ab_sign", lambda: ab_sign(WEB_ENTER_QUERY, WEB_USER_AGENT), 0,
+             lambda result: isinstance(result, str) and len(result) > 100),
+    ]
+
+    try:
+        from src import stream
+    except ImportError as e:
+        skipped["stream_url"] = f"src.stream导入失败: {e}"
+    else:
+        room_data = json.loads(fixtures.load_fixtures()["web_enter.json"])["data"]["data"][0]
+        room_data['anchor_name'] = fixtures.NICKNAME
+        cases.append(Case(
+            "stream_url", lambda: stream.get_douyin_stream_url(room_data, "OD", None), 1,
+            lambda result: result.get('is_live') is True and bool(result.get('record_url'))
+        ))
+
+    try:
+        import execjs
+        execjs.get()
+    except Exception as e:
+        skipped["x_bogus"] = f"没有可用的JavaScript运行环境: {e}"
+    else:
+        # 每次签名都要启动一次node进程, 调用次数按比例减少
+        cases.append(Case(
+            "x_bogus", lambda: room.get_xbogus(f"https://webcast.amemv.com/webcast/room/reflow/info/?{WEB_ENTER_QUERY}"),
+            0, lambda result: isinstance(result, str) and len(result) > 10, scale=0.1
+        ))
+    return cases
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_case(case: Case, server: fixtures.FixtureServer, number: int, warmup: int) -> dict:
+    before = server.requests
+    result = await case.call()
+    if server.requests - before != case.requests or not case.check(result):
+        raise RuntimeError(f"{case.name} 的解析结果与样本不符, 请检查样本文件或解析代码")
+
+    for _ in range(warmup):
+        await case.call()
+
+    durations = []
+    started = time.perf_counter()
+    for _ in range(number):
+        call_started = time.perf_counter()
+        await case.call()
+        durations.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    durations.sort()
+    return {
+        "calls": number,
+        "ops": round(number / elapsed, 1),
+        "mean_ms": round(statistics.fmean(durations) * 1000, 3),
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+    }
+
+
+def load_baseline(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(path: Path, results: dict) -> None:
+    baseline = {
+        "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}",
+        "results": results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200, help="每个用例的计时调用次数")
+    parser.add_argument("--warmup", type=int, default=5, help="计时前的预热调用次数")
+    parser.add_argument("--cases", default="", help="只运行指定用例, 以逗号分隔")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入基线文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p50相对基线变慢超过该比例视为退化")
+    parser.add_argument("--check", action="store_true", help="存在退化时以非0状态码退出")
+    args = parser.parse_args()
+
+    skipped = {}
+    cases = build_cases(skipped)
+    if args.cases:
+        selected = {i.strip() for i in args.cases.split(",")}
+        cases = [case for case in cases if case.name in selected]
+
+    server = fixtures.FixtureServer(fixtures.load_fixtures()).start()
+    results = {}
+    try:
+        with fixtures.install_fixture_client(server.port):
+            for case in cases:
+                number = max(5, int(args.number * case.scale))
+                results[case.name] = asyncio.run(run_case(case, server, number, args.warmup))
+    finally:
+        server.stop()
+
+    baseline_path = Path(args.baseline)
+    baseline = load_baseline(baseline_path)
+    regressions = []
+    print(f"{'case':<16}{'calls':>8}{'ops/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'base p50':>10}{'change':>9}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base and base.get("p50_ms"):
+            change = result["p50_ms"] / base["p50_ms"] - 1
+            base_text, change_text = f"{base['p50_ms']:.3f}", f"{change:+.1%}"
+            if change > args.tolerance:
+                regressions.append(name)
+                change_text += " !"
+        else:
+            base_text, change_text = "-", "-"
+        print(f"{name:<16}{result['calls']:>8}{result['ops']:>10}{result['p50_ms']:>10.3f}"
+              f"{result['p99_ms']:>10.3f}{base_text:>10}{change_text:>9}")
+    for name, reason in skipped.items():
+        print(f"{name:<16}已跳过: {reason}")
+
+    if args.save_baseline:
+        save_baseline(baseline_path, {**baseline, **results})
+        print(f"基线已保存: {baseline_path}")
+    if regressions:
+        print(f"p50退化超过{args.tolerance:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
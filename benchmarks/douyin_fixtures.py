@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+抖音解析基准测试使用的离线样本及本地替身服务
+
+样本按线上接口的结构构造(直播间页面HTML、web/enter接口、reflow/info接口、HLS主播放列表),
+保存在 benchmarks/fixtures/douyin 目录, 可以直接用抓包得到的真实响应替换同名文件;
+FixtureServer根据请求的Host头和路径返回对应样本, install_fixture_client把httpx的请求改写到本地服务
+
+重新生成样本:
+    python -m benchmarks.douyin_fixtures
+"""
+import argparse
+import contextlib
+import json
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures" / "douyin"
+
+WEB_RID = "745964462470"
+ROOM_ID = "7421186725318052659"
+SEC_USER_ID = "MS4wLjABAAAAy5jDRnS4e7b7bXk0YqH1kE6vqE2Q9y2oV2bJxY3nXcY"
+SHARE_CODE = "iRNBEy4J"
+NICKNAME = "基准测试主播"
+TITLE = "离线基准测试直播间"
+QUALITIES = (("FULL_HD1", "or4"), ("HD1", "hd"), ("SD1", "ld"), ("SD2", "sd"))
+PULL_HOST = "pull-hls-f11.douyincdn.com"
+STREAM_BASE = f"https://{PULL_HOST}/third"
+
+
+def stream_urls(suffix: str, room_id: str = ROOM_ID, stream_base: str = STREAM_BASE) -> dict:
+    query = "expire=1761650000&sign=4f3b7c2e1d9a8b6c5d4e3f2a1b0c9d8e&major_anchor_level=common&t_id=037-2025"
+    return {
+        name: f"{stream_base}/stream-{room_id}_{code}.{suffix}?{query}"
+        for name, code in QUALITIES
+    }
+
+
+def stream_data(room_id: str = ROOM_ID, stream_base: str = STREAM_BASE) -> dict:
+    """
+    live_core_sdk_data中的stream_data, 线上以JSON字符串形式嵌套在房间数据中
+    """
+    sdk_params = json.dumps({
+        "VCodec": "h264", "vbitrate": 6000000, "resolution": "1920x1080", "gop": 4, "drType": "sdk"
+    }, separators=(',', ':'))
+    data = {
+        "origin": {"main": {
+            "flv": f"{stream_base}/stream-{room_id}.flv?major_anchor_level=common",
+            "hls": f"{stream_base}/stream-{room_id}.m3u8?major_anchor_level=common",
+            "cmaf": "", "dash": "", "lls": "", "tsl": "", "tile": "",
+            "sdk_params": sdk_params,
+        }}
+    }
+    flv_urls = stream_urls("flv", room_id, stream_base)
+    hls_urls = stream_urls("m3u8", room_id, stream_base)
+    for name, code in QUALITIES:
+        data[code] = {"main": {
+            "flv": flv_urls[name], "hls": hls_urls[name], "cmaf": "", "dash": "", "lls": "", "tsl": "", "tile": "",
+            "sdk_params": sdk_params,
+        }}
+    return {"common": {"session_id": "037-20251019-" + room_id, "rule_ids": "{}", "user_count": 0}, "data": data}
+
+
+def room_data(status: int = 2, embed_stream_data: bool = True, room_id: str = ROOM_ID, web_rid: str = WEB_RID,
+              nickname: str = NICKNAME, stream_base: str = STREAM_BASE, create_time: int = 1761045000) -> dict:
+    pull_data = {"options": {"default_quality": {"name": "蓝光", "sdk_key": "or4"}}}
+    if embed_stream_data:
+        pull_data["stream_data"] = json.dumps(stream_data(room_id, stream_base), separators=(',', ':'))
+    return {
+        "id_str": room_id,
+        "status": status,
+        "status_str": str(status),
+        "title": TITLE,
+        "create_time": create_time,
+        "user_count_str": "1.2万",
+        "cover": {"url_list": [f"https://p3-webcast.douyinpic.com/img/webcast/{room_id}~tplv-obj.image"]},
+        "stream_url": {
+            "flv_pull_url": stream_urls("flv", room_id, stream_base),
+            "default_resolution": "FULL_HD1",
+            "hls_pull_url_map": stream_urls("m3u8", room_id, stream_base),
+            "hls_pull_url": stream_urls("m3u8", room_id, stream_base)["FULL_HD1"],
+            "stream_orientation": 1,
+            "live_core_sdk_data": {"pull_data": pull_data},
+            "extra": {"height": 1920, "width": 1080, "fps": 0, "max_bitrate": 0, "min_bitrate": 0},
+            "pull_datas": {},
+        },
+        "owner": {
+            "id_str": "3417282451924855",
+            "sec_uid": SEC_USER_ID,
+            "nickname": nickname,
+            "avatar_thumb": {"url_list": ["https://p3-pc.douyinpic.com/aweme/100x100/aweme-avatar/benchmark.jpeg"]},
+            "follow_info": {"follow_status": 0, "follow_status_str": "0"},
+            "web_rid": web_rid,
+        },
+        "room_auth": {"Chat": True, "Danmaku": False, "Gift": True, "LuckMoney": True, "Digg": True},
+        "has_commerce_goods": False,
+        "linker_map": {},
+        "admin_user_ids_str": [],
+    }
+
+
+def web_enter_json(**room_kwargs) -> str:
+    room = room_data(**room_kwargs)
+    return json.dumps({
+        "data": {
+            "data": [room],
+            "enter_room_id": room["id_str"],
+            "user": {
+                "id_str": "0", "sec_uid": "", "nickname": room["owner"]["nickname"], "avatar_thumb": {"url_list": []}
+            },
+            "qrcode_url": "",
+            "enter_mode": 0,
+            "room_status": 0,
+            "partition_road_map": {},
+            "similar_rooms": [],
+        },
+        "extra": {"now": 1761045455000},
+        "status_code": 0,
+    }, ensure_ascii=False)
+
+
+def app_reflow_json() -> str:
+    return json.dumps({
+        "data": {"room": room_data(), "user": {"id_str": "3417282451924855", "nickname": NICKNAME}},
+        "extra": {"now": 1761045455000},
+        "status_code": 0,
+    }, ensure_ascii=False)
+
+
+def escape_js_string(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def flight_push(payload: str) -> str:
+    return f'<script nonce="bench">self.__pace_f.push([1,"{escape_js_string(payload)}"])</script>'
+
+
+def live_page_html(filler_chunks: int = 60, **room_kwargs) -> str:
+    """
+    模拟直播间页面: RSC数据分块写在self.__pace_f.push中, 其中URL里的&以\\u0026形式出现;
+    页面中的房间数据不含stream_data字符串, 原画地址来自单独的{"common":...}数据块
+    """
+    room = room_data(embed_stream_data=False, **room_kwargs)
+    sdk_stream_data = stream_data(room["id_str"], room_kwargs.get("stream_base", STREAM_BASE))
+    state = {
+        "roomStore": {
+            "roomInfo": {"room": room, "roomId": room["id_str"], "web_rid": room["owner"]["web_rid"], "anchor": {}},
+            "isLoading": False,
+        },
+        "linkmicStore": {"linkmicUsers": []},
+        "userStore": {"odin": {"user_id": "0", "user_type": 12}},
+    }
+    state_json = json.dumps({"state": state}, ensure_ascii=False, separators=(',', ':')).replace('&', '\\u0026')
+    stream_chunks = [
+        json.dumps(
+            {"common": sdk_stream_data["common"], "data": {"origin": sdk_stream_data["data"]["origin"]}},
+            ensure_ascii=False, separators=(',', ':')
+        ).replace('&', '\\u0026')
+        for _ in range(2)
+    ]
+    # 页面中的其他数据块, 用于让正则匹配的扫描长度接近线上页面(约数百KB)
+    filler = json.dumps({
+        "webcastConfig": {f"setting_{i}": {"enable": i % 2 == 0, "value": "x" * 48} for i in range(40)}
+    }, separators=(',', ':'))
+    parts = [
+        '<!DOCTYPE html><html><head><meta charset="UTF-8"><title>抖音直播</title></head><body>',
+        '<div id="root"></div>',
+    ]
+    parts += [flight_push(f"{i:x}:{filler}\n") for i in range(filler_chunks // 2)]
+    parts.append(flight_push(f'a:["$","$L1",null,{state_json}]\n'))
+    parts += [flight_push(chunk) for chunk in stream_chunks]
+    parts += [flight_push(f"{i + filler_chunks:x}:{filler}\n") for i in range(filler_chunks // 2)]
+    parts.append('<div hidden></div></body></html>')
+    return ''.join(parts)
+
+
+def master_playlist() -> str:
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for (name, code), bandwidth in zip(QUALITIES, (8000000, 4000000, 2000000, 1000000)):
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},NAME={name}")
+        lines.append(f"https://{PULL_HOST}/third/stream-{ROOM_ID}_{code}/index.m3u8?major_anchor_level=common")
+    return "\n".join(lines) + "\n"
+
+
+FIXTURE_BUILDERS = {
+    "live_page.html": live_page_html,
+    "web_enter.json": web_enter_json,
+    "app_reflow.json": app_reflow_json,
+    "master.m3u8": master_playlist,
+}
+
+
+def write_fixtures(output_dir: Path = FIXTURE_DIR) -> list[Path]:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, builder in FIXTURE_BUILDERS.items():
+        path = output_dir / name
+        path.write_text(builder(), encoding='utf-8')
+        paths.append(path)
+    return paths
+
+
+def load_fixtures(fixture_dir: Path = FIXTURE_DIR) -> dict[str, bytes]:
+    missing = [name for name in FIXTURE_BUILDERS if not (fixture_dir / name).exists()]
+    if missing:
+        write_fixtures(fixture_dir)
+    return {name: (fixture_dir / name).read_bytes() for name in FIXTURE_BUILDERS}
+
+
+class FixtureServer:
+    """
+    按原始Host头分发请求的本地替身服务, 覆盖抖音解析链路中会访问到的全部地址
+    """
+
+    def __init__(self, fixtures: dict[str, bytes]) -> None:
+        self.fixtures = fixtures
+        self.requests = 0
+        self.unmatched: list[str] = []
+        self.lock = threading.Lock()
+        fixture_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                fixture_server.handle(self, send_body=True)
+
+            def do_HEAD(self) -> None:
+                fixture_server.handle(self, send_body=False)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def route(self, host: str, path: str) -> tuple[int, str, bytes | str]:
+        if host == "live.douyin.com":
+            if path.startswith("/webcast/room/web/enter/"):
+                return 200, "application/json", self.fixtures["web_enter.json"]
+            if re.fullmatch(r"/\d+", path):
+                return 200, "text/html; charset=utf-8", self.fixtures["live_page.html"]
+        elif host == "v.douyin.com":
+            query = urllib.parse.urlencode({"sec_user_id": SEC_USER_ID, "u_code": "0", "did": "0"})
+            return 302, f"https://webcast.amemv.com/douyin/webcast/reflow/{ROOM_ID}?{query}&", b""
+        elif host == "webcast.amemv.com":
+            if path.startswith("/webcast/room/reflow/info/"):
+                return 200, "application/json", self.fixtures["app_reflow.json"]
+            if path.startswith("/douyin/webcast/reflow/"):
+                return 200, "text/html; charset=utf-8", b"<html><body>reflow</body></html>"
+        elif host == PULL_HOST and path.endswith(".m3u8"):
+            return 200, "application/vnd.apple.mpegurl", self.fixtures["master.m3u8"]
+        return 404, "text/plain", b"not found"
+
+    def handle(self, handler: BaseHTTPRequestHandler, send_body: bool) -> None:
+        host = (handler.headers.get("Host") or "").split(":")[0]
+        path = handler.path.split("?", maxsplit=1)[0]
+        status, content_type, body = self.route(host, path)
+        with self.lock:
+            self.requests += 1
+            if status == 404:
+                self.unmatched.append(f"{host}{path}")
+        handler.send_response(status)
+        if status == 302:
+            handler.send_header("Location", content_type)
+            body = b""
+        else:
+            handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if send_body and body:
+            handler.wfile.write(body)
+
+    def start(self) -> 'FixtureServer':
+        threading.Thread(target=self.httpd.serve_forever, name="douyin_fixture_server", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RewriteTransport(httpx.AsyncBaseTransport):
+    """
+    把请求改写到本地替身服务, 保留原始Host头、路径和查询参数, 重定向仍按原始地址跟随
+    """
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+        self.transport = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme="http", host="127.0.0.1", port=self.port)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+@contextlib.contextmanager
+def install_fixture_client(port: int):
+    """
+    在上下文中替换httpx.AsyncClient, 解析代码仍按原样为每个请求新建客户端, 只是连接指向本地端口上的替身服务
+    """
+    original_client = httpx.AsyncClient
+
+    class FixtureClient(original_client):
+        def __init__(self, *args, **kwargs) -> None:
+            kwargs.pop("proxy", None)
+            kwargs["transport"] = RewriteTransport(port)
+            super().__init__(*args, **kwargs)
+
+    httpx.AsyncClient = FixtureClient
+    try:
+        yield
+    finally:
+        httpx.AsyncClient = original_client
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=str(FIXTURE_DIR), help="样本输出目录")
+    args = parser.parse_args()
+    for path in write_fixtures(Path(args.output)):
+        print(f"{path} {path.stat().st_size / 1024:.1f}KB")
+
+
+if __name__ == '__main__':
+    main()
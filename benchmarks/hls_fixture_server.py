@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+本地HLS直播模拟服务, 用于基准测试
+
+以固定分片时长滑动播放列表窗口, 模拟直播HLS源, 可按规律对分片请求注入延迟,
+并记录每个media sequence是否被拉取, 以统计录制端的丢片数量
+"""
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+def generate_segments(output_dir: str | Path, total_seconds: int = 120, segment_time: int = 2) -> list[Path]:
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc=size=640x360:rate=25:duration={total_seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={total_seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", str(25 * segment_time),
+        "-c:a", "aac",
+        "-f", "hls", "-hls_time", str(segment_time), "-hls_list_size", "0",
+        "-hls_segment_filename", str(output_dir / "seg%05d.ts"),
+        str(output_dir / "source.m3u8"),
+    ], check=True)
+    return sorted(output_dir.glob("seg*.ts"))
+
+
+class HlsFixture:
+    def __init__(self, segments: list[Path], segment_time: float = 2, window_size: int = 5,
+                 stall_every: int = 0, stall_seconds: float = 0, latency: float = 0) -> None:
+        self.segments = [Path(i).read_bytes() for i in segments]
+        self.segment_time = segment_time
+        self.window_size = window_size
+        self.stall_every = stall_every
+        self.stall_seconds = stall_seconds
+        self.latency = latency
+        self.start_time = time.monotonic()
+        self.fetched: set[int] = set()
+        self.segment_requests = 0
+        self.lock = threading.Lock()
+
+    def live_edge(self) -> int:
+        elapsed = int((time.monotonic() - self.start_time) / self.segment_time)
+        return min(elapsed + self.window_size, len(self.segments))
+
+    def playlist(self) -> str:
+        end = self.live_edge()
+        start = max(0, end - self.window_size)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{int(self.segment_time)}",
+            f"#EXT-X-MEDIA-SEQUENCE:{start}",
+        ]
+        for sequence in range(start, end):
+            lines.append(f"#EXTINF:{self.segment_time:.3f},")
+            lines.append(f"seg{sequence}.ts")
+        if end >= len(self.segments):
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def segment(self, sequence: int) -> bytes | None:
+        if not 0 <= sequence < len(self.segments):
+            return None
+        with self.lock:
+            self.segment_requests += 1
+            stall = self.stall_every and self.segment_requests % self.stall_every == 0
+        time.sleep(self.latency + (self.stall_seconds if stall else 0))
+        with self.lock:
+            self.fetched.add(sequence)
+        return self.segments[sequence]
+
+    def dropped_segments(self) -> int:
+        if not self.fetched:
+            return self.live_edge()
+        first = min(self.fetched)
+        expired = max(0, self.live_edge() - self.window_size)
+        return len([i for i in range(first, expired) if i not in self.fetched])
+
+    def handler(self):
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path.endswith('.m3u8'):
+                    body = fixture.playlist().encode()
+                    content_type = "application/vnd.apple.mpegurl"
+                elif path.startswith('/seg') and path.endswith('.ts'):
+                    body = fixture.segment(int(path[4:-3]))
+                    content_type = "video/mp2t"
+                else:
+                    body = None
+                    content_type = "text/plain"
+
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def serve(fixture: HlsFixture, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), fixture.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp(prefix="hls_fixture_")
+    hls_fixture = HlsFixture(generate_segments(work_dir))
+    http_server = serve(hls_fixture, port=int(os.environ.get("PORT", 8080)))
+    print(f"serving http://127.0.0.1:{http_server.server_port}/live.m3u8")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        http_server.shutdown()
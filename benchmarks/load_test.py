@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+录制程序端到端压力测试: 启动模拟抖音平台(benchmarks.mock_platform), 在子进程中运行main.py监测上千个模拟直播间,
+定期采集录制进程及其ffmpeg子进程的CPU、内存(RSS)、线程数, 以及状态监控接口中的探测耗时,
+结束时汇总探测耗时、模拟平台观测到的开播到开始拉流的延迟和录制程序统计的启动延迟;
+指定多个--variant时使用同一份测试视频依次运行, 最后对比各个轮询和录制方案
+
+录制程序在临时工作目录中运行(独立的config和downloads), 不会改动仓库中的配置文件;
+子进程中的httpx请求被改写到模拟平台, ffmpeg直接从模拟平台拉流
+
+用法(需要ffmpeg):
+    python -m benchmarks.load_test --rooms 1000 --duration 600 --interval 30 --max-request 10
+    python -m benchmarks.load_test --rooms 200 --duration 300 --output result.json --keep
+    python -m benchmarks.load_test --rooms 200 --seed 1 --variant split --variant "nosplit:分段录制是否开启=否"
+    python -m benchmarks.load_test --rooms 500 --seed 1 --variant "poll10:循环时间(秒)=10" \
+        --variant "poll60:循环时间(秒)=60" --variant "native_hls:是否使用内置HLS下载器(是/否)=是"
+"""
+import argparse
+import configparser
+import json
+import os
+import re
+import runpy
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks import douyin_fixtures as fixtures  # noqa: E402
+from benchmarks.mock_platform import MockPlatform, generate_media  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+PROCESS_ERRORS = (OSError, ValueError, IndexError) + ((psutil.Error,) if psutil else ())
+
+
+def read_process(pid: int) -> tuple[float, int, int]:
+    """
+    返回进程的(CPU时间(秒), RSS(字节), 线程数); 没有安装psutil时读取/proc, 仅支持Linux
+    """
+    if psutil:
+        process = psutil.Process(pid)
+        cpu_times = process.cpu_times()
+        return cpu_times.user + cpu_times.system, process.memory_info().rss, process.num_threads()
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', maxsplit=1)[1].split()
+    rss = 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+                break
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss, int(fields[17])
+
+
+def child_pids(pid: int) -> list[int]:
+    if psutil:
+        return [i.pid for i in psutil.Process(pid).children(recursive=True)]
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', maxsplit=1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+class ProcessSampler:
+    """
+    根据两次采样之间的CPU时间差计算CPU占用, ffmpeg子进程单独汇总
+    """
+
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.last_time = time.monotonic()
+        self.last_cpu = {}
+
+    def sample(self) -> dict:
+        now = time.monotonic()
+        elapsed = max(now - self.last_time, 0.001)
+        self.last_time = now
+        result = {'cpu': 0.0, 'rss_mb': 0.0, 'threads': 0, 'ffmpeg': 0, 'ffmpeg_cpu': 0.0, 'ffmpeg_rss_mb': 0.0}
+        current_cpu = {}
+        for pid in [self.pid] + child_pids(self.pid):
+            try:
+                cpu_seconds, rss, threads = read_process(pid)
+            except PROCESS_ERRORS:
+                continue
+            current_cpu[pid] = cpu_seconds
+            cpu = (cpu_seconds - self.last_cpu.get(pid, cpu_seconds)) / elapsed * 100
+            if pid == self.pid:
+                result.update(cpu=cpu, rss_mb=rss / 1024 / 1024, threads=threads)
+            else:
+                result['ffmpeg'] += 1
+                result['ffmpeg_cpu'] += cpu
+                result['ffmpeg_rss_mb'] += rss / 1024 / 1024
+        self.last_cpu = current_cpu
+        return result
+
+
+def parse_metrics(text: str) -> dict[str, list[tuple[dict, float]]]:
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name_part, _, value = line.rpartition(' ')
+        name, _, label_text = name_part.partition('{')
+        samples.setdefault(name, []).append((dict(LABEL_PATTERN.findall(label_text)), float(value)))
+    return samples
+
+
+def metric_total(samples: dict, name: str) -> float:
+    return sum(value for _, value in samples.get(name, []))
+
+
+def histogram_quantile(samples: dict, name: str, quantile: float) -> float | None:
+    """
+    按Prometheus histogram_quantile的方式在桶内线性插值, 汇总所有标签
+    """
+    buckets = {}
+    for labels, value in samples.get(f'{name}_bucket', []):
+        bound = float(labels['le'].replace('+Inf', 'inf'))
+        buckets[bound] = buckets.get(bound, 0) + value
+    if not buckets:
+        return None
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if not total:
+        return None
+    rank = quantile * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound in bounds:
+        if buckets[bound] >= rank:
+            if bound == float('inf'):
+                return lower_bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / max(buckets[bound] - lower_count, 1)
+        lower_bound, lower_count = bound, buckets[bound]
+    return lower_bound
+
+
+def percentile(values: list[float], percent: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+def prepare_workdir(work_dir: Path, platform: MockPlatform, args: argparse.Namespace,
+                    overrides: dict[str, str] | None = None) -> None:
+    (work_dir / 'config').mkdir(parents=True, exist_ok=True)
+    config = configparser.RawConfigParser()
+    config.optionxform = str
+    config.read(ROOT / 'config' / 'config.ini', encoding='utf-8-sig')
+    settings = {
+        '是否跳过代理检测(是/否)': '是',
+        '直播保存路径(不填则默认)': str(work_dir / 'downloads'),
+        '视频保存格式ts|mkv|flv|mp4|mp3音频|m4a音频': args.save_format,
+        '是否使用代理ip(是/否)': '否',
+        '同一时间访问网络的线程数': str(args.max_request),
+        '循环时间(秒)': str(args.interval),
+        # 与随附的config.ini一致默认分段录制, 不分段的情况用 --variant "nosplit:分段录制是否开启=否" 对比
+        '分段录制是否开启': '是' if args.split_time else '否',
+        '视频分段时间(秒)': str(args.split_time or 1800),
+        '录制完成后自动转为mp4格式': '否',
+        '是否开启状态监控接口(是/否)': '是',
+        '状态监控接口监听地址': '127.0.0.1',
+        '状态监控接口端口': str(args.metrics_port),
+    }
+    for key, value in {**settings, **(overrides or {})}.items():
+        config.set('录制设置', key, value)
+    config.set('推送配置', '直播状态推送渠道', '')
+    with open(work_dir / 'config' / 'config.ini', 'w', encoding='utf-8-sig') as f:
+        config.write(f)
+    with open(work_dir / 'config' / 'URL_config.ini', 'w', encoding='utf-8-sig') as f:
+        f.write(''.join(f"原画,{room.live_url},主播: {room.nickname}\n" for room in platform.rooms))
+
+
+def run_recorder(work_dir: str, mock_port: int) -> None:
+    """
+    子进程入口: 把httpx请求改写到模拟平台后, 以工作目录为脚本目录运行main.py
+
+    runpy.run_path运行期间会把sys.argv[0]改为脚本路径, main.py按它的真实路径确定配置目录,
+    所以先把main.py复制到工作目录中再运行, 包导入仍然指向仓库目录
+    """
+    os.chdir(work_dir)
+    script = Path(work_dir) / 'main.py'
+    shutil.copy(ROOT / 'main.py', script)
+    sys.argv = [str(script)]
+    with fixtures.install_fixture_client(mock_port):
+        runpy.run_path(str(script), run_name='__main__')
+
+
+def signal_process_group(process: subprocess.Popen, sig: int) -> None:
+    # 录制进程在独立的进程组中运行, 连同ffmpeg子进程一起结束, 避免遗留后台录制
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+    else:
+        process.send_signal(sig)
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    signal_process_group(process, signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        signal_process_group(process, signal.SIGKILL if hasattr(signal, 'SIGKILL') else signal.SIGTERM)
+        process.wait()
+
+
+def latency_summary(metrics: dict, name: str) -> dict:
+    count = metric_total(metrics, f'{name}_count')
+    if not count:
+        return {'count': 0, 'avg': None, 'p50': None, 'p99': None}
+    return {
+        'count': int(count),
+        'avg': round(metric_total(metrics, f'{name}_sum') / count, 2),
+        'p50': round(histogram_quantile(metrics, name, 0.5), 2),
+        'p99': round(histogram_quantile(metrics, name, 0.99), 2),
+    }
+
+
+def summarize(samples: list[dict], platform: MockPlatform, metrics: dict, elapsed: float) -> dict:
+    def stat(key: str) -> dict:
+        values = [i[key] for i in samples]
+        return {'avg': round(sum(values) / len(values), 1), 'max': round(max(values), 1)} if values else {}
+
+    probe_latency = latency_summary(metrics, 'recorder_probe_duration_seconds')
+    start_delays = platform.start_delays
+    return {
+        'seconds': round(elapsed, 1),
+        'rooms': len(platform.rooms),
+        'recorder_cpu_percent': stat('cpu'),
+        'recorder_rss_mb': stat('rss_mb'),
+        'recorder_threads': stat('threads'),
+        'ffmpeg_processes': stat('ffmpeg'),
+        'ffmpeg_cpu_percent': stat('ffmpeg_cpu'),
+        'ffmpeg_rss_mb': stat('ffmpeg_rss_mb'),
+        'probes': probe_latency['count'],
+        'probes_per_second': round(probe_latency['count'] / elapsed, 2) if elapsed else 0,
+        'probe_latency_ms': {
+            k: round(v * 1000, 1) if v is not None else None for k, v in probe_latency.items() if k != 'count'
+        },
+        'live_sessions': platform.sessions,
+        'recorded_sessions': len(start_delays),
+        'missed_sessions': platform.missed_sessions,
+        # 模拟平台观测到的从开播到录制端开始拉流的耗时
+        'start_delay_seconds': {
+            'p50': round(percentile(start_delays, 50), 2) if start_delays else None,
+            'p99': round(percentile(start_delays, 99), 2) if start_delays else None,
+            'max': round(max(start_delays), 2) if start_delays else None,
+        },
+        # 录制程序自身统计的从检测到开播(或断流)到写入第一个字节的耗时
+        'recorder_start_latency_seconds': latency_summary(metrics, 'recorder_start_latency_seconds'),
+        'recorder_go_live_latency_seconds': latency_summary(metrics, 'recorder_go_live_latency_seconds'),
+    }
+
+
+def run_load_test(args: argparse.Namespace, segments: list[Path], flv_path: Path, work_dir: Path,
+                  overrides: dict[str, str] | None = None) -> dict:
+    work_dir.mkdir(parents=True, exist_ok=True)
+    platform = MockPlatform(
+        args.rooms, segments, flv_path, live_ratio=args.live_ratio,
+        live_seconds=(args.live_min, args.live_max), seed=args.seed
+    )
+    prepare_workdir(work_dir, platform, args, overrides)
+    platform.start()
+
+    log_file = open(work_dir / 'recorder.log', 'w', encoding='utf-8')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.load_test', '--run-recorder', str(work_dir),
+         '--mock-port', str(platform.port)],
+        cwd=ROOT, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+        start_new_session=os.name != 'nt'
+    )
+    sampler = ProcessSampler(process.pid)
+    samples = []
+    metrics = {}
+    metrics_url = f"http://127.0.0.1:{args.metrics_port}/metrics"
+    started = time.monotonic()
+    print(f"{'time':>6}{'cpu%':>8}{'rss(MB)':>9}{'threads':>9}{'ffmpeg':>8}{'ff cpu%':>9}"
+          f"{'live':>6}{'recording':>11}{'probes':>9}{'start p50':>11}")
+    try:
+        while time.monotonic() - started < args.duration and process.poll() is None:
+            time.sleep(args.sample)
+            sample = sampler.sample()
+            try:
+                metrics = parse_metrics(httpx.get(metrics_url, timeout=5).text)
+            except httpx.HTTPError:
+                pass
+            samples.append(sample)
+            start_p50 = latency_summary(metrics, 'recorder_start_latency_seconds')['p50']
+            print(f"{time.monotonic() - started:>6.0f}{sample['cpu']:>8.1f}{sample['rss_mb']:>9.1f}"
+                  f"{sample['threads']:>9}{sample['ffmpeg']:>8}{sample['ffmpeg_cpu']:>9.1f}"
+                  f"{platform.live_count():>6}{metric_total(metrics, 'recorder_rooms_recording'):>11.0f}"
+                  f"{metric_total(metrics, 'recorder_probe_duration_seconds_count'):>9.0f}"
+                  f"{start_p50 if start_p50 is not None else '-':>11}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.monotonic() - started
+        if process.poll() is not None:
+            print(f"录制程序提前退出, 返回码: {process.returncode}, 日志: {work_dir / 'recorder.log'}")
+        stop_process(process)
+        platform.stop()
+        log_file.close()
+    summary = summarize(samples, platform, metrics, elapsed)
+    summary['split_recording'] = (overrides or {}).get('分段录制是否开启', '是' if args.split_time else '否') == '是'
+    return summary
+
+
+def parse_variant(text: str) -> tuple[str, dict[str, str]]:
+    """
+    名称:配置项=值;配置项=值, 配置项为config.ini中[录制设置]下的键名
+    """
+    name, _, settings = text.partition(':')
+    overrides = {}
+    for item in filter(None, settings.split(';')):
+        key, _, value = item.partition('=')
+        overrides[key.strip()] = value.strip()
+    return name.strip(), overrides
+
+
+def print_comparison(results: dict[str, dict]) -> None:
+    print(f"{'variant':<16}{'probes/s':>10}{'cpu%':>8}{'rss(MB)':>9}{'missed':>8}"
+          f"{'pull p50':>10}{'pull p99':>10}{'start p50':>11}{'start p99':>11}{'go-live p50':>13}")
+    for name, summary in results.items():
+        def fmt(value) -> str:
+            return '-' if value is None else f"{value}"
+        print(f"{name:<16}{summary['probes_per_second']:>10}{fmt(summary['recorder_cpu_percent'].get('avg')):>8}"
+              f"{fmt(summary['recorder_rss_mb'].get('max')):>9}{summary['missed_sessions']:>8}"
+              f"{fmt(summary['start_delay_seconds']['p50']):>10}{fmt(summary['start_delay_seconds']['p99']):>10}"
+              f"{fmt(summary['recorder_start_latency_seconds']['p50']):>11}"
+              f"{fmt(summary['recorder_start_latency_seconds']['p99']):>11}"
+              f"{fmt(summary['recorder_go_live_latency_seconds']['p50']):>13}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=1000, help="模拟直播间数量")
+    parser.add_argument("--duration", type=int, default=600, help="测试时长(秒)")
+    parser.add_argument("--interval", type=int, default=30, help="录制程序的循环时间(秒)")
+    parser.add_argument("--max-request", type=int, default=10, help="同一时间访问网络的线程数")
+    parser.add_argument("--save-format", default="ts", help="录制保存格式")
+    parser.add_argument("--split-time", type=int, default=1800, help="分段录制的分段时间(秒), 0为不分段")
+    parser.add_argument("--live-ratio", type=float, default=0.05, help="同时在线直播间的比例")
+    parser.add_argument("--live-min", type=float, default=60, help="单次开播的最短时长(秒)")
+    parser.add_argument("--live-max", type=float, default=300, help="单次开播的最长时长(秒)")
+    parser.add_argument("--media-duration", type=int, default=600, help="生成的测试视频时长(秒)")
+    parser.add_argument("--sample", type=float, default=5, help="资源采样间隔(秒)")
+    parser.add_argument("--metrics-port", type=int, default=19111, help="录制程序状态监控接口端口")
+    parser.add_argument("--seed", type=int, default=None, help="对比多个方案时建议固定, 使每次运行的开播序列相同")
+    parser.add_argument("--variant", action="append", default=[],
+                        help="依次运行并对比多个配置方案, 可重复指定, 格式: 名称:配置项=值;配置项=值")
+    parser.add_argument("--output", default="", help="把汇总结果写入JSON文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录(录制文件和日志)")
+    parser.add_argument("--run-recorder", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--mock-port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_recorder:
+        run_recorder(args.run_recorder, args.mock_port)
+        return
+
+    work_dir = Path(tempfile.mkdtemp(prefix="recorder_load_"))
+    print(f"工作目录: {work_dir}")
+    segments, flv_path = generate_media(work_dir / 'media', args.media_duration)
+    variants = [parse_variant(i) for i in args.variant] or [('default', {})]
+    results = {}
+    for name, overrides in variants:
+        print(f"运行方案: {name} {overrides}")
+        results[name] = run_load_test(args, segments, flv_path, work_dir / name, overrides)
+        print(json.dumps(results[name], ensure_ascii=False, indent=2))
+
+    if len(results) > 1:
+        print_comparison(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results if len(results) > 1 else next(iter(results.values())), f, ensure_ascii=False, indent=2)
+    if args.keep:
+        print(f"已保留工作目录: {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
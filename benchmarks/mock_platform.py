@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+模拟抖音平台的本地服务, 用于对录制程序做端到端压力测试
+
+为每个模拟直播间提供web/enter接口和直播间页面(结构与benchmarks/douyin_fixtures中的样本一致),
+直播流地址指向本服务: FLV按原始码率匀速发送本地生成的视频, HLS按分片时长滑动播放列表窗口;
+后台线程按随机时长切换直播间的开播/下播状态, 并记录每次开播到录制端首次拉流之间的延迟
+
+单独启动(需要ffmpeg):
+    python -m benchmarks.mock_platform --rooms 1000 --port 18080
+"""
+import argparse
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from benchmarks import douyin_fixtures as fixtures
+
+FLV_CHUNK_SIZE = 64 * 1024
+STREAM_PATH = re.compile(r"/third/stream-(\d+)(?:_\w+)?\.(flv|m3u8)")
+SEGMENT_PATH = re.compile(r"/third/stream-(\d+)/(\d+)\.ts")
+
+
+def generate_media(output_dir: str | Path, duration: int = 600, segment_time: int = 2) -> tuple[list[Path], Path]:
+    """
+    用ffmpeg生成测试视频: HLS分片用于m3u8地址, 同一份内容的FLV文件用于flv地址
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    flv_path = output_dir / "source.flv"
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc=size=640x360:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-b:v", "800k", "-g", str(25 * segment_time),
+        "-c:a", "aac", "-b:a", "64k",
+        "-f", "flv", str(flv_path),
+    ], check=True)
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error", "-i", str(flv_path), "-c", "copy",
+        "-f", "hls", "-hls_time", str(segment_time), "-hls_list_size", "0",
+        "-hls_segment_filename", str(output_dir / "seg%05d.ts"),
+        str(output_dir / "source.m3u8"),
+    ], check=True)
+    return sorted(output_dir.glob("seg*.ts")), flv_path
+
+
+class MockRoom:
+    def __init__(self, index: int, stream_base: str) -> None:
+        self.index = index
+        self.web_rid = str(700000000000 + index)
+        self.room_id = str(7400000000000000000 + index)
+        self.nickname = f"mock_{index:04d}"
+        self.stream_base = stream_base
+        self.live = False
+        self.live_since = 0.0
+        self.live_wall_time = time.time()
+        self.next_toggle = 0.0
+        # 本次开播后录制端是否已开始拉流
+        self.pulled = False
+        self.cache = {}
+
+    @property
+    def live_url(self) -> str:
+        return f"https://live.douyin.com/{self.web_rid}"
+
+    def room_kwargs(self) -> dict:
+        return dict(status=2 if self.live else 4, room_id=self.room_id, web_rid=self.web_rid,
+                    nickname=self.nickname, stream_base=self.stream_base, create_time=int(self.live_wall_time))
+
+    def web_enter(self) -> bytes:
+        status = 2 if self.live else 4
+        if status not in self.cache:
+            self.cache[status] = fixtures.web_enter_json(**self.room_kwargs()).encode('utf-8')
+        return self.cache[status]
+
+    def live_page(self) -> bytes:
+        # 页面有数百KB, 不缓存以免上千个直播间占用过多内存
+        return fixtures.live_page_html(**self.room_kwargs()).encode('utf-8')
+
+
+class MockPlatform:
+    """
+    rooms个直播间中约live_ratio比例同时在线, 每个直播间的开播和下播时长在给定区间内随机
+    """
+
+    def __init__(self, rooms: int, segments: list[Path], flv_path: Path | None, port: int = 0,
+                 segment_time: float = 2, window_size: int = 5, live_ratio: float = 0.1,
+                 live_seconds: tuple[float, float] = (60, 300), seed: int | None = None) -> None:
+        self.segments = [Path(i).read_bytes() for i in segments]
+        self.flv = Path(flv_path).read_bytes() if flv_path else b''
+        self.flv_duration = len(self.segments) * segment_time
+        self.segment_time = segment_time
+        self.window_size = window_size
+        self.live_seconds = live_seconds
+        # 按平均开播时长和目标在线比例推算平均下播时长
+        average_live = sum(live_seconds) / 2
+        average_offline = average_live * (1 - live_ratio) / max(live_ratio, 0.001)
+        self.offline_seconds = (average_offline * 0.5, average_offline * 1.5)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.probes = 0
+        self.sessions = 0
+        self.start_delays: list[float] = []
+        self.missed_sessions = 0
+
+        platform = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                platform.handle(self, send_body=True)
+
+            def do_HEAD(self) -> None:
+                platform.handle(self, send_body=False)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 1024
+        stream_base = f"http://127.0.0.1:{self.port}/third"
+
+        now = time.monotonic()
+        self.rooms = [MockRoom(i, stream_base) for i in range(rooms)]
+        self.by_web_rid = {room.web_rid: room for room in self.rooms}
+        self.by_room_id = {room.room_id: room for room in self.rooms}
+        for room in self.rooms:
+            room.live = self.random.random() < live_ratio
+            room.live_since = now
+            room.next_toggle = now + self.random.uniform(*(live_seconds if room.live else self.offline_seconds))
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def live_count(self) -> int:
+        return sum(1 for room in self.rooms if room.live)
+
+    def toggle_rooms(self) -> None:
+        while not self.stopped.wait(0.5):
+            now = time.monotonic()
+            with self.lock:
+                for room in self.rooms:
+                    if now < room.next_toggle:
+                        continue
+                    if room.live and not room.pulled:
+                        self.missed_sessions += 1
+                    room.live = not room.live
+                    room.live_since = now
+                    room.live_wall_time = time.time()
+                    room.pulled = False
+                    room.cache.clear()
+                    if room.live:
+                        self.sessions += 1
+                    room.next_toggle = now + self.random.uniform(
+                        *(self.live_seconds if room.live else self.offline_seconds))
+
+    def count_probe(self) -> None:
+        with self.lock:
+            self.probes += 1
+
+    def mark_pulled(self, room: MockRoom) -> None:
+        with self.lock:
+            if room.live and not room.pulled:
+                room.pulled = True
+                # 启动时已在直播的直播间不计入, 它们的开播时间早于录制程序启动
+                if room.live_since > self.started_at:
+                    self.start_delays.append(time.monotonic() - room.live_since)
+
+    def route(self, host: str, path: str, query: dict) -> tuple[int, str, bytes | None, MockRoom | None]:
+        if host == "live.douyin.com":
+            if path.startswith("/webcast/room/web/enter/"):
+                room = self.by_web_rid.get(query.get("web_rid", [""])[0])
+                if room:
+                    self.count_probe()
+                    return 200, "application/json", room.web_enter(), None
+            elif room := self.by_web_rid.get(path.strip("/")):
+                self.count_probe()
+                return 200, "text/html; charset=utf-8", room.live_page(), None
+            return 404, "text/plain", b"not found", None
+
+        if match := SEGMENT_PATH.fullmatch(path):
+            room = self.by_room_id.get(match.group(1))
+            if room and room.live and self.segments:
+                return 200, "video/mp2t", self.segments[int(match.group(2)) % len(self.segments)], None
+        elif match := STREAM_PATH.fullmatch(path):
+            room = self.by_room_id.get(match.group(1))
+            if room and room.live:
+                if match.group(2) == "m3u8":
+                    return 200, "application/vnd.apple.mpegurl", self.playlist(room).encode(), room
+                return 200, "video/x-flv", None, room
+        return 404, "text/plain", b"not found", None
+
+    def playlist(self, room: MockRoom) -> str:
+        end = int((time.monotonic() - room.live_since) / self.segment_time) + 1
+        start = max(0, end - self.window_size)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{int(self.segment_time)}",
+            f"#EXT-X-MEDIA-SEQUENCE:{start}",
+        ]
+        for sequence in range(start, end):
+            if sequence and sequence % len(self.segments) == 0:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{self.segment_time:.3f},")
+            lines.append(f"stream-{room.room_id}/{sequence}.ts")
+        return "\n".join(lines) + "\n"
+
+    def handle(self, handler: BaseHTTPRequestHandler, send_body: bool) -> None:
+        host = (handler.headers.get("Host") or "").split(":")[0]
+        path, _, query = handler.path.partition("?")
+        status, content_type, body, room = self.route(host, path, urllib.parse.parse_qs(query))
+        if room and send_body:
+            self.mark_pulled(room)
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        if body is None:
+            handler.send_header("Connection", "close")
+            handler.end_headers()
+            if send_body:
+                self.send_flv(handler, room)
+            return
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if send_body:
+            handler.wfile.write(body)
+
+    def send_flv(self, handler: BaseHTTPRequestHandler, room: MockRoom) -> None:
+        """
+        先突发发送约2秒的数据(模拟CDN的GOP缓存), 之后按原始码率发送, 直播间下播或文件发送完毕时断开连接
+        """
+        byte_rate = len(self.flv) / max(self.flv_duration, 1)
+        started = time.monotonic() - 2
+        sent = 0
+        try:
+            while sent < len(self.flv) and room.live and not self.stopped.is_set():
+                chunk = self.flv[sent:sent + FLV_CHUNK_SIZE]
+                handler.wfile.write(chunk)
+                sent += len(chunk)
+                wait = sent / byte_rate - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        handler.close_connection = True
+
+    def start(self) -> 'MockPlatform':
+        self.started_at = time.monotonic()
+        threading.Thread(target=self.httpd.serve_forever, name="mock_platform", daemon=True).start()
+        threading.Thread(target=self.toggle_rooms, name="mock_platform_toggle", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--live-ratio", type=float, default=0.1, help="同时在线直播间的比例")
+    parser.add_argument("--live-min", type=float, default=60, help="单次开播的最短时长(秒)")
+    parser.add_argument("--live-max", type=float, default=300, help="单次开播的最长时长(秒)")
+    parser.add_argument("--media-duration", type=int, default=600, help="生成的测试视频时长(秒)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="mock_platform_") as work_dir:
+        segments, flv_path = generate_media(work_dir, args.media_duration)
+        platform = MockPlatform(
+            args.rooms, segments, flv_path, port=args.port, live_ratio=args.live_ratio,
+            live_seconds=(args.live_min, args.live_max), seed=args.seed
+        ).start()
+        print(f"模拟平台已启动: 127.0.0.1:{platform.port} 直播间数: {args.rooms}")
+        print("客户端需要通过douyin_fixtures.install_fixture_client把live.douyin.com的请求改写到该端口")
+        try:
+            while True:
+                time.sleep(10)
+                print(f"在线: {platform.live_count()} 探测请求: {platform.probes} 开播次数: {platform.sessions} "
+                      f"已拉流: {len(platform.start_delays)} 未拉流即下播: {platform.missed_sessions}")
+        except KeyboardInterrupt:
+            platform.stop()
+
+
+if __name__ == '__main__':
+    main()
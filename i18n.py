@@ -1,7 +1,6 @@
 import os
 import sys
 import gettext
-import inspect
 import builtins
 from pathlib import Path
 
@@ -23,10 +22,26 @@ original_print = builtins.print
 package_name = 'src'
 
 
+# 按代码对象缓存调用方是否位于src包中, 避免每次print都遍历调用栈
+_from_package_cache = {}
+# 翻译结果缓存, 状态输出中含有时间等动态文本, 限制缓存条数
+_translation_cache = {}
+_translation_cache_size = 4096
+
+
+def _translate(text: str) -> str:
+    translated = _translation_cache.get(text)
+    if translated is None:
+        translated = _tr(text)
+        if len(_translation_cache) < _translation_cache_size:
+            _translation_cache[text] = translated
+    return translated
+
+
 def translated_print(*args, **kwargs):
+    code = sys._getframe(1).f_code
+    from_package = _from_package_cache.get(code)
+    if from_package is None:
+        from_package = _from_package_cache[code] = package_name in code.co_filename
     for arg in args:
-        if package_name in inspect.stack()[1].filename:
-            translated_arg = _tr(str(arg))
-        else:
-            translated_arg = str(arg)
-        original_print(translated_arg, **kwargs)
+        original_print(_translate(str(arg)) if from_package else str(arg), **kwargs)
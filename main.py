@@ -24,15 +24,28 @@ import uuid
 from pathlib import Path
 import urllib.request
 from urllib.error import URLError, HTTPError
-from typing import Any
+from typing import Any, Callable
 import configparser
-import httpx
 from src import spider, stream
 from src.proxy import ProxyDetector
+from src.hls_downloader import HlsDownloader, HlsUnsupportedError
+from src.http_clients.pool import get_client
+from src import direct_downloader
+from src.postprocess import PostProcessQueue, PRIORITY_REMUX, PRIORITY_ENCODE
+from src.job_journal import temp_output_path
+from src.subtitles import SrtTimeline
+from src import segment_manifest
+from src.progress import ProgressReader, RecordingStats, progress_args
+from src.start_latency import StartLatencyTracker
+from src.status_renderer import StatusRenderer
+from src import metrics
+from src import tracing
+from src import sharding
+from src import cluster
 from src.utils import logger
 from src import utils
 from msg_push import (
-    dingtalk, xizhi, tg_bot, send_email, bark, ntfy, pushplus
+    dingtalk, xizhi, tg_bot, send_email, bark, ntfy, pushplus, PushDispatcher
 )
 from ffmpeg_install import (
     check_ffmpeg, ffmpeg_path, current_env_path
@@ -65,7 +78,21 @@ not_record_list = []
 start_display_time = datetime.datetime.now()
 global_proxy = False
 recording_time_list = {}
+recording_stats = {}
+room_status = {}
+stalled_recordings = set()
+record_stop_events = {}
+push_dispatcher = PushDispatcher()
+start_latency = StartLatencyTracker()
+probe_counter = metrics.registry.counter(
+    'recorder_probes_total', 'Live status probes by platform and result', ('platform', 'result'))
+probe_latency = metrics.registry.histogram(
+    'recorder_probe_duration_seconds', 'Time spent resolving live status and stream url', ('platform',))
+recorded_bytes_counter = metrics.registry.counter(
+    'recorder_recorded_bytes_total', 'Bytes written by recordings')
 script_path = os.path.split(os.path.realpath(sys.argv[0]))[0]
+shard = sharding.shard_from_env()
+cluster_member = None
 config_file = f'{script_path}/config/config.ini'
 url_config_file = f'{script_path}/config/URL_config.ini'
 backup_dir = f'{script_path}/backup_config'
@@ -73,11 +100,15 @@ text_encoding = 'utf-8-sig'
 rstr = r"[\/\\\:\*\？?\"\<\>\|&#.。,， ~！· ]"
 default_path = f'{script_path}/downloads'
 os.makedirs(default_path, exist_ok=True)
-file_update_lock = threading.Lock()
+# 多进程模式下各工作进程会同时修改URL_config.ini和config.ini, 需要跨进程加锁
+file_update_lock = sharding.FileLock(f'{script_path}/config/.file_update.lock') if shard else threading.Lock()
 os_type = os.name
-clear_command = "cls" if os_type == 'nt' else "clear"
 color_obj = utils.Color()
 os.environ['PATH'] = ffmpeg_path + os.pathsep + current_env_path
+record_user_agent = ("Mozilla/5.0 (Linux; Android 11; SAMSUNG SM-G973U) AppleWebKit/537.36 ("
+                     "KHTML, like Gecko) SamsungBrowser/14.2 Chrome/87.0.4280.141 Mobile Safari/537.36")
+# 每个关键帧一个分片, 进程异常退出时已写入的分片仍可正常播放
+live_fmp4_movflags = "+frag_keyframe+empty_moov+default_base_moof"
 
 
 def signal_handler(_signal, _frame):
@@ -90,46 +121,57 @@ signal.signal(signal.SIGTERM, signal_handler)
 def display_info() -> None:
     global start_display_time
     time.sleep(5)
+    renderer = StatusRenderer()
     while True:
         try:
-            sys.stdout.flush()
             time.sleep(5)
-            if Path(sys.executable).name != 'pythonw.exe':
-                os.system(clear_command)
-            print(f"\r共监测{monitoring}个直播中", end=" | ")
-            print(f"同一时间访问网络的线程数: {max_request}", end=" | ")
-            print(f"是否开启代理录制: {'是' if use_proxy else '否'}", end=" | ")
-            if split_video_by_time:
-                print(f"录制分段开启: {split_time}秒", end=" | ")
-            else:
-                print("录制分段开启: 否", end=" | ")
+            if renderer.headless:
+                continue
+            status = [
+                f"共监测{monitoring}个直播中",
+                f"同一时间访问网络的线程数: {max_request}",
+                f"是否开启代理录制: {'是' if use_proxy else '否'}",
+                f"录制分段开启: {split_time}秒" if split_video_by_time else "录制分段开启: 否",
+            ]
             if create_time_file:
-                print("是否生成时间文件: 是", end=" | ")
-            print(f"录制视频质量为: {video_record_quality}", end=" | ")
-            print(f"录制视频格式为: {video_save_type}", end=" | ")
-            print(f"目前瞬时错误数为: {error_count}", end=" | ")
-            now = time.strftime("%H:%M:%S", time.localtime())
-            print(f"当前时间: {now}")
+                status.append("是否生成时间文件: 是")
+            if cluster_member:
+                cluster_status = cluster_member.status()
+                status.append(f"集群节点: {cluster_status['node_id']}(共{len(cluster_status['nodes'])}个) "
+                              f"持有{cluster_status['leases_held']}个直播间")
+            status += [
+                f"录制视频质量为: {video_record_quality}",
+                f"录制视频格式为: {video_save_type}",
+                f"目前瞬时错误数为: {error_count}",
+                f"当前时间: {time.strftime('%H:%M:%S', time.localtime())}",
+            ]
+            lines = [" | ".join(status)]
 
             if len(recording) == 0:
-                time.sleep(5)
                 if monitoring == 0:
-                    print("\r没有正在监测和录制的直播")
+                    lines.append("没有正在监测和录制的直播")
                 else:
-                    print(f"\r没有正在录制的直播 循环监测间隔时间：{delay_default}秒")
+                    lines.append(f"没有正在录制的直播 循环监测间隔时间：{delay_default}秒")
             else:
                 now_time = datetime.datetime.now()
-                print("x" * 60)
                 no_repeat_recording = list(set(recording))
-                print(f"正在录制{len(no_repeat_recording)}个直播: ")
+                start_latency_info = {
+                    room_status[url]['record_name']: info for url, info in start_latency.snapshot().items()
+                    if url in room_status
+                }
+                lines += ["x" * 60, f"正在录制{len(no_repeat_recording)}个直播: "]
                 for recording_live in no_repeat_recording:
                     rt, qa = recording_time_list[recording_live]
                     have_record_time = now_time - rt
-                    print(f"{recording_live}[{qa}] 正在录制中 {str(have_record_time).split('.')[0]}")
-
-                # print('\n本软件已运行：'+str(now_time - start_display_time).split('.')[0])
-                print("x" * 60)
+                    stats = recording_stats.get(recording_live)
+                    stats_info = f" | {stats.summary()}" if stats else ""
+                    latency = start_latency_info.get(recording_live)
+                    if latency:
+                        stats_info += f" | 启动延迟: {latency['detect_to_first_byte']:.1f}秒"
+                    lines.append(f"{recording_live}[{qa}] 正在录制中 {str(have_record_time).split('.')[0]}{stats_info}")
+                lines.append("x" * 60)
                 start_display_time = now_time
+            renderer.render(lines)
         except Exception as e:
             logger.error(f"错误信息: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
 
@@ -186,113 +228,102 @@ def get_startup_info(system_type: str):
     return startup_info
 
 
-def segment_video(converts_file_path: str, segment_save_file_path: str, segment_format: str, segment_time: str,
-                  is_original_delete: bool = True) -> None:
-    try:
-        if os.path.exists(converts_file_path) and os.path.getsize(converts_file_path) > 0:
+def segment_video(converts_file_path: str, segment_save_file_path: str, segment_format: str, segment_time: str) -> None:
+    if os.path.exists(converts_file_path) and os.path.getsize(converts_file_path) > 0:
+        ffmpeg_command = [
+            "ffmpeg",
+            "-i", converts_file_path,
+            "-c:v", "copy",
+            "-c:a", "copy",
+            "-map", "0",
+            "-f", "segment",
+            "-segment_time", segment_time,
+            "-segment_format", segment_format,
+            "-reset_timestamps", "1",
+            "-movflags", "+frag_keyframe+empty_moov",
+            *segment_manifest.segment_list_args(
+                temp_output_path(segment_manifest.segment_list_path(segment_save_file_path))),
+            temp_output_path(segment_save_file_path),
+        ]
+        _output = subprocess.check_output(
+            ffmpeg_command, stderr=subprocess.STDOUT, startupinfo=get_startup_info(os_type)
+        )
+        segment_manifest.build_manifest(segment_save_file_path, temp=True)
+
+
+def converts_mp4(converts_file_path: str, save_file_path: str) -> None:
+    if os.path.exists(converts_file_path) and os.path.getsize(converts_file_path) > 0:
+        if converts_to_h264:
+            color_obj.print_colored("正在转码为MP4格式并重新编码为h264\n", color_obj.YELLOW)
+            ffmpeg_command = [
+                "ffmpeg", "-i", converts_file_path,
+                "-c:v", "libx264",
+                "-preset", "veryfast",
+                "-crf", "23",
+                "-vf", "format=yuv420p",
+                "-c:a", "copy",
+                "-f", "mp4", temp_output_path(save_file_path),
+            ]
+        else:
+            color_obj.print_colored("正在转码为MP4格式\n", color_obj.YELLOW)
             ffmpeg_command = [
-                "ffmpeg",
-                "-i", converts_file_path,
+                "ffmpeg", "-i", converts_file_path,
                 "-c:v", "copy",
                 "-c:a", "copy",
-                "-map", "0",
-                "-f", "segment",
-                "-segment_time", segment_time,
-                "-segment_format", segment_format,
-                "-reset_timestamps", "1",
-                "-movflags", "+frag_keyframe+empty_moov",
-                segment_save_file_path,
+                "-f", "mp4", temp_output_path(save_file_path),
             ]
-            _output = subprocess.check_output(
-                ffmpeg_command, stderr=subprocess.STDOUT, startupinfo=get_startup_info(os_type)
-            )
-            if is_original_delete:
-                time.sleep(1)
-                if os.path.exists(converts_file_path):
-                    os.remove(converts_file_path)
-    except subprocess.CalledProcessError as e:
-        logger.error(f'Error occurred during conversion: {e}')
-    except Exception as e:
-        logger.error(f'An unknown error occurred: {e}')
-
-
-def converts_mp4(converts_file_path: str, is_original_delete: bool = True) -> None:
-    try:
-        if os.path.exists(converts_file_path) and os.path.getsize(converts_file_path) > 0:
-            if converts_to_h264:
-                color_obj.print_colored("正在转码为MP4格式并重新编码为h264\n", color_obj.YELLOW)
-                ffmpeg_command = [
-                    "ffmpeg", "-i", converts_file_path,
-                    "-c:v", "libx264",
-                    "-preset", "veryfast",
-                    "-crf", "23",
-                    "-vf", "format=yuv420p",
-                    "-c:a", "copy",
-                    "-f", "mp4", converts_file_path.rsplit('.', maxsplit=1)[0] + ".mp4",
-                ]
-            else:
-                color_obj.print_colored("正在转码为MP4格式\n", color_obj.YELLOW)
-                ffmpeg_command = [
-                    "ffmpeg", "-i", converts_file_path,
-                    "-c:v", "copy",
-                    "-c:a", "copy",
-                    "-f", "mp4", converts_file_path.rsplit('.', maxsplit=1)[0] + ".mp4",
-                ]
-            _output = subprocess.check_output(
-                ffmpeg_command, stderr=subprocess.STDOUT, startupinfo=get_startup_info(os_type)
-            )
-            if is_original_delete:
-                time.sleep(1)
-                if os.path.exists(converts_file_path):
-                    os.remove(converts_file_path)
-    except subprocess.CalledProcessError as e:
-        logger.error(f'Error occurred during conversion: {e}')
-    except Exception as e:
-        logger.error(f'An unknown error occurred: {e}')
+        _output = subprocess.check_output(
+            ffmpeg_command, stderr=subprocess.STDOUT, startupinfo=get_startup_info(os_type)
+        )
 
 
-def converts_m4a(converts_file_path: str, is_original_delete: bool = True) -> None:
-    try:
-        if os.path.exists(converts_file_path) and os.path.getsize(converts_file_path) > 0:
-            _output = subprocess.check_output([
-                "ffmpeg", "-i", converts_file_path,
-                "-n", "-vn",
-                "-c:a", "aac", "-bsf:a", "aac_adtstoasc", "-ab", "320k",
-                converts_file_path.rsplit('.', maxsplit=1)[0] + ".m4a",
-            ], stderr=subprocess.STDOUT, startupinfo=get_startup_info(os_type))
-            if is_original_delete:
-                time.sleep(1)
-                if os.path.exists(converts_file_path):
-                    os.remove(converts_file_path)
-    except subprocess.CalledProcessError as e:
-        logger.error(f'Error occurred during conversion: {e}')
-    except Exception as e:
-        logger.error(f'An unknown error occurred: {e}')
+def converts_m4a(converts_file_path: str, save_file_path: str) -> None:
+    if os.path.exists(converts_file_path) and os.path.getsize(converts_file_path) > 0:
+        _output = subprocess.check_output([
+            "ffmpeg", "-i", converts_file_path,
+            "-n", "-vn",
+            "-c:a", "aac", "-bsf:a", "aac_adtstoasc", "-ab", "320k",
+            "-f", "mp4", temp_output_path(save_file_path),
+        ], stderr=subprocess.STDOUT, startupinfo=get_startup_info(os_type))
 
 
-def generate_subtitles(record_name: str, ass_filename: str, sub_format: str = 'srt') -> None:
-    index_time = 0
-    today = datetime.datetime.now()
-    re_datatime = today.strftime('%Y-%m-%d %H:%M:%S')
+def submit_converts_mp4(converts_file_path: str) -> None:
+    save_file_path = converts_file_path.rsplit('.', maxsplit=1)[0] + ".mp4"
+    postprocess_queue.submit(
+        'mp4', converts_file_path, save_file_path,
+        inputs=[converts_file_path], outputs=[save_file_path], delete_inputs=delete_origin_file,
+        priority=PRIORITY_ENCODE if converts_to_h264 else PRIORITY_REMUX
+    )
 
-    def transform_int_to_time(seconds: int) -> str:
-        m, s = divmod(seconds, 60)
-        h, m = divmod(m, 60)
-        return f"{h:02d}:{m:02d}:{s:02d}"
 
-    while True:
-        index_time += 1
-        txt = str(index_time) + "\n" + transform_int_to_time(index_time) + ',000 --> ' + transform_int_to_time(
-            index_time + 1) + ',000' + "\n" + str(re_datatime) + "\n\n"
+def submit_segment_video(converts_file_path: str, segment_save_file_path: str, segment_format: str) -> None:
+    postprocess_queue.submit(
+        'segment', converts_file_path, segment_save_file_path, segment_format, split_time,
+        inputs=[converts_file_path],
+        outputs=[segment_save_file_path, segment_manifest.manifest_path(segment_save_file_path),
+                 segment_manifest.segment_list_path(segment_save_file_path)],
+        delete_inputs=delete_origin_file
+    )
 
-        with open(f"{ass_filename}.{sub_format.lower()}", 'a', encoding=text_encoding) as f:
-            f.write(txt)
 
-        if record_name not in recording:
-            return
-        time.sleep(1)
-        today = datetime.datetime.now()
-        re_datatime = today.strftime('%Y-%m-%d %H:%M:%S')
+def generate_subtitles(record_name: str, ass_filename: str, sub_format: str = 'srt') -> None:
+    timeline = SrtTimeline(f"{ass_filename}.{sub_format.lower()}", encoding=text_encoding)
+    media_progress = {}
+    try:
+        while record_name in recording:
+            timeline.update()
+            stats = recording_stats.get(record_name)
+            if stats and stats.out_time:
+                # ffmpeg最近一次报告的输出时长及其报告时间, 结束时据此让字幕与画面的PTS对齐
+                media_progress = {
+                    'stop_wall_time': datetime.datetime.now() - datetime.timedelta(
+                        seconds=time.monotonic() - stats.updated_at),
+                    'media_duration': stats.out_time,
+                }
+            timeline.sleep_to_next_entry()
+        timeline.regenerate(**media_progress)
+    finally:
+        timeline.close()
 
 
 def adjust_max_request() -> None:
@@ -324,33 +355,42 @@ def adjust_max_request() -> None:
         error_count = 0
 
 
-def push_message(record_name: str, live_url: str, content: str) -> None:
+def push_message(record_name: str, live_url: str, content: str, urgent: bool = False) -> None:
     msg_title = push_message_title.strip() or "直播间状态更新通知"
     push_functions = {
-        '微信': lambda: xizhi(xizhi_api_url, msg_title, content),
-        '钉钉': lambda: dingtalk(dingtalk_api_url, content, dingtalk_phone_num, dingtalk_is_atall),
-        '邮箱': lambda: send_email(
+        '微信': lambda text: xizhi(xizhi_api_url, msg_title, text),
+        '钉钉': lambda text: dingtalk(dingtalk_api_url, text, dingtalk_phone_num, dingtalk_is_atall),
+        '邮箱': lambda text: send_email(
             email_host, login_email, email_password, sender_email, sender_name,
-            to_email, msg_title, content, smtp_port, open_smtp_ssl
+            to_email, msg_title, text, smtp_port, open_smtp_ssl
         ),
-        'TG': lambda: tg_bot(tg_chat_id, tg_token, content),
-        'BARK': lambda: bark(
-            bark_msg_api, title=msg_title, content=content, level=bark_msg_level, sound=bark_msg_ring
+        'TG': lambda text: tg_bot(tg_chat_id, tg_token, text),
+        'BARK': lambda text: bark(
+            bark_msg_api, title=msg_title, content=text, level=bark_msg_level, sound=bark_msg_ring
         ),
-        'NTFY': lambda: ntfy(
-            ntfy_api, title=msg_title, content=content, tags=ntfy_tags, action_url=live_url, email=ntfy_email
+        'NTFY': lambda text: ntfy(
+            ntfy_api, title=msg_title, content=text, tags=ntfy_tags, action_url=live_url, email=ntfy_email
         ),
-        'PUSHPLUS': lambda: pushplus(pushplus_token, msg_title, content),
+        'PUSHPLUS': lambda text: pushplus(pushplus_token, msg_title, text),
+    }
+    # 合并发送的摘要包含多个直播间, 不附带单个直播间的链接
+    digest_functions = {
+        'NTFY': lambda text: ntfy(ntfy_api, title=msg_title, content=text, tags=ntfy_tags, email=ntfy_email),
     }
 
     for platform, func in push_functions.items():
         if platform in live_status_push.upper():
-            try:
-                result = func()
-                print(f'提示信息：已经将[{record_name}]直播状态消息推送至你的{platform},'
-                      f' 成功{len(result["success"])}, 失败{len(result["error"])}')
-            except Exception as e:
-                color_obj.print_colored(f"直播消息推送到{platform}失败: {e}", color_obj.RED)
+            def report(result: dict | None, error: Exception | None, merged: int, platform: str = platform) -> None:
+                merged_info = f"(与其他{merged - 1}条消息合并发送)" if merged > 1 else ""
+                if error:
+                    color_obj.print_colored(f"直播消息推送到{platform}失败{merged_info}: {error}", color_obj.RED)
+                else:
+                    print(f'提示信息：已经将[{record_name}]直播状态消息推送至你的{platform}{merged_info},'
+                          f' 成功{len(result["success"])}, 失败{len(result["error"])}')
+
+            if not push_dispatcher.submit(platform, func, content, report, urgent=urgent,
+                                          digest_send=digest_functions.get(platform)):
+                color_obj.print_colored(f"{platform}推送队列已满, 本条消息已丢弃", color_obj.RED)
 
 
 def run_script(command: str) -> None:
@@ -373,56 +413,234 @@ def run_script(command: str) -> None:
         logger.error('Please add `#!/bin/bash` at the beginning of your bash script file.')
 
 
+def count_recorded_bytes(stats: RecordingStats) -> None:
+    size = stats.total_size - stats.counted_size
+    if size > 0:
+        recorded_bytes_counter.inc(amount=size)
+        stats.counted_size = stats.total_size
+
+
+def release_recording_stats(record_name: str) -> None:
+    stats = recording_stats.pop(record_name, None)
+    if stats:
+        count_recorded_bytes(stats)
+
+
+def track_download(record_name: str, live_url: str) -> tuple[RecordingStats, Callable[[int], None]]:
+    """
+    内置下载器没有ffmpeg进度输出, 每次写入时更新录制统计、已录制字节数和启动延迟
+    """
+    stats = recording_stats[record_name] = RecordingStats()
+
+    def on_write(size: int) -> None:
+        stats.add_bytes(size)
+        count_recorded_bytes(stats)
+        start_latency.first_byte(live_url, stats.first_output_at)
+
+    return stats, on_write
+
+
+def collect_metrics() -> None:
+    gauges = {
+        'recorder_rooms_monitored': ('Rooms being monitored', monitoring),
+        'recorder_rooms_live': ('Rooms that were live at their last probe',
+                                sum(1 for i in list(room_status.values()) if i['is_live'])),
+        'recorder_rooms_recording': ('Rooms currently recording', len(recording)),
+        'recorder_max_request': ('Current concurrent probe limit', max_request),
+        'recorder_error_count': ('Recent error count used to adjust max_request', error_count),
+        'recorder_postprocess_queue_depth': ('Unfinished post-processing jobs', postprocess_queue.qsize()),
+    }
+    for name, (documentation, value) in gauges.items():
+        metrics.registry.gauge(name, documentation).set(value)
+    metrics.registry.gauge(
+        'recorder_recording_bytes', 'Bytes written by the active recording', ('room',)
+    ).replace({(name,): stats.total_size for name, stats in list(recording_stats.items())})
+    metrics.registry.gauge(
+        'recorder_room_start_latency_seconds', 'Detection to first recorded byte of the latest recording',
+        ('room', 'platform')
+    ).replace({
+        (room_status[url]['record_name'], info['platform']): info['detect_to_first_byte']
+        for url, info in start_latency.snapshot().items() if url in room_status
+    })
+
+
+def collect_status() -> dict:
+    rooms = []
+    latency_snapshot = start_latency.snapshot()
+    for url, info in list(room_status.items()):
+        record_name = info['record_name']
+        room = dict(info, url=url, recording=record_name in recording)
+        if record_name in recording_time_list and room['recording']:
+            room['record_start_time'] = recording_time_list[record_name][0]
+        stats = recording_stats.get(record_name)
+        if stats:
+            room['progress'] = {
+                'total_size': stats.total_size, 'out_time': stats.out_time, 'bitrate_kbps': stats.bitrate_kbps,
+                'speed': stats.speed, 'drop_frames': stats.drop_frames, 'stalled_for': round(stats.stalled_for(), 1)
+            }
+        if url in latency_snapshot:
+            room['start_latency'] = latency_snapshot[url]
+        rooms.append(room)
+    return {
+        'version': version,
+        'monitoring': monitoring,
+        'recording': len(recording),
+        'max_request': max_request,
+        'error_count': error_count,
+        'postprocess_queue_depth': postprocess_queue.qsize(),
+        'cluster': cluster_member.status() if cluster_member else None,
+        'shard_version': shard.applied_version if shard and not cluster_member else None,
+        'rooms': rooms,
+    }
+
+
 def clear_record_info(record_name: str, record_url: str) -> None:
     global monitoring
     recording.discard(record_name)
+    release_recording_stats(record_name)
     if record_url in url_comments and record_url in running_list:
         running_list.remove(record_url)
+        record_stop_events.pop(record_url, None)
+        room_status.pop(record_url, None)
         monitoring -= 1
         color_obj.print_colored(f"[{record_name}]已经从录制列表中移除\n", color_obj.YELLOW)
 
 
-def direct_download_stream(source_url: str, save_path: str, record_name: str, live_url: str, platform: str) -> bool:
+def release_cluster_room(record_url: str) -> None:
+    # 失去租约时立即按注释处理并通知录制线程停止, 不等下一轮读取配置
+    if record_url not in url_comments:
+        url_comments.append(record_url)
+    stop_event = record_stop_events.get(record_url)
+    if stop_event:
+        stop_event.set()
+
+
+def is_recording_url(record_url: str) -> bool:
+    info = room_status.get(record_url)
+    return bool(info) and info['record_name'] in recording
+
+
+def new_stop_event(record_url: str) -> threading.Event:
+    # 每次开始录制时换一个新的停止事件: 直播间被注释后又取消注释(或失去租约后又重新获得)时,
+    # 上一次录制留下的已触发事件不会让之后的录制立即退出
+    stop_event = record_stop_events[record_url] = threading.Event()
+    if record_url in url_comments or exit_recording:
+        stop_event.set()
+    return stop_event
+
+
+def direct_download_stream(source_url: str, save_path: str, record_name: str, live_url: str, platform: str,
+                           split_time: int | str = 0) -> bool:
     try:
-        with open(save_path, 'wb') as f:
-            client = httpx.Client(timeout=None)
-
-            headers = {}
-            header_params = get_record_headers(platform, live_url)
-            if header_params:
-                key, value = header_params.split(":", 1)
-                headers[key] = value
-
-            with client.stream('GET', source_url, headers=headers, follow_redirects=True) as response:
-                if response.status_code != 200:
-                    logger.error(f"请求直播流失败，状态码: {response.status_code}")
-                    return False
-
-                downloaded = 0
-                chunk_size = 1024 * 16
-
-                for chunk in response.iter_bytes(chunk_size):
-                    if live_url in url_comments or exit_recording:
-                        color_obj.print_colored(f"[{record_name}]录制时已被注释或请求停止,下载中断", color_obj.YELLOW)
-                        clear_record_info(record_name, live_url)
-                        return False
-
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                print()
-                return True
+        headers = {}
+        header_params = get_record_headers(platform, live_url)
+        if header_params:
+            key, value = header_params.split(":", 1)
+            headers[key] = value
+
+        _stats, on_write = track_download(record_name, live_url)
+        download_success = direct_downloader.download_stream(
+            get_client(), source_url, save_path, headers=headers, stop_event=new_stop_event(live_url),
+            parse_flv=True, split_time=split_time, on_write=on_write
+        )
+        if download_success is None:
+            color_obj.print_colored(f"[{record_name}]录制时已被注释或请求停止,下载中断", color_obj.YELLOW)
+            clear_record_info(record_name, live_url)
+            return False
+        if download_success:
+            print()
+        return download_success
     except Exception as e:
         logger.error(f"FLV下载错误: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
         return False
+    finally:
+        release_recording_stats(record_name)
+
+
+def hls_download_stream(source_url: str, save_path: str, record_name: str, live_url: str, platform: str,
+                        proxy_address: str | None = None, timeout: int = 15) -> bool | None:
+    headers = {'User-Agent': record_user_agent}
+    header_params = get_record_headers(platform, live_url)
+    if header_params:
+        key, value = header_params.split(":", 1)
+        headers[key] = value
+
+    stop_event = new_stop_event(live_url)
+    stats, on_write = track_download(record_name, live_url)
+
+    def is_stalled() -> bool:
+        return bool(stall_timeout and stats.first_output_at and stats.stalled_for() > stall_timeout)
+
+    downloader = HlsDownloader(
+        source_url, save_path, headers=headers, proxy_addr=proxy_address, timeout=timeout,
+        should_stop=lambda: stop_event.is_set() or exit_recording or is_stalled(), on_write=on_write
+    )
+    try:
+        download_success = downloader.run()
+    except HlsUnsupportedError as e:
+        logger.debug(f"内置HLS下载器不支持该直播流, 改用ffmpeg录制: {e}")
+        release_recording_stats(record_name)
+        if os.path.exists(save_path) and os.path.getsize(save_path) == 0:
+            os.remove(save_path)
+        return None
+    except Exception as e:
+        release_recording_stats(record_name)
+        logger.error(f"HLS下载错误: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
+        return False
+
+    if downloader.dropped_segments:
+        logger.warning(f"[{record_name}]HLS录制共丢弃{downloader.dropped_segments}个分片")
+    if is_stalled() and not stop_event.is_set():
+        # 与ffmpeg录制相同: 已录制的部分按正常结束处理, 录制线程跳过缓存立即重新获取直播流
+        color_obj.print_colored(
+            f"[{record_name}]录制已停滞{int(stats.stalled_for())}秒, 结束当前录制并重新获取直播流", color_obj.YELLOW)
+        logger.warning(f"Recording stalled, restarting: {live_url}")
+        stalled_recordings.add(live_url)
+        download_success = True
+    elif not download_success and (stop_event.is_set() or exit_recording):
+        color_obj.print_colored(f"[{record_name}]录制时已被注释或请求停止,下载中断", color_obj.YELLOW)
+        clear_record_info(record_name, live_url)
+    release_recording_stats(record_name)
+    return download_success
+
+
+def stop_ffmpeg(process: subprocess.Popen, timeout: float = 10) -> None:
+    # 正常退出ffmpeg以便写入文件尾, 不能直接terminate; 卡住的ffmpeg可能不响应, 超时后再强制结束
+    try:
+        if os.name == 'nt':
+            if process.stdin:
+                process.stdin.write(b'q')
+                process.stdin.close()
+        else:
+            process.send_signal(signal.SIGINT)
+    except OSError:
+        pass
+    try:
+        process.wait(timeout)
+        return
+    except subprocess.TimeoutExpired:
+        logger.warning(f"ffmpeg未在{timeout}秒内退出, 强制结束: pid={process.pid}")
+    process.terminate()
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
 
 
 def check_subprocess(record_name: str, record_url: str, ffmpeg_command: list, save_type: str,
                      script_command: str | None = None) -> bool:
     save_file_path = ffmpeg_command[-1]
+    is_segment = '%03d' in save_file_path
+    if is_segment:
+        ffmpeg_command[-1:-1] = segment_manifest.segment_list_args(segment_manifest.segment_list_path(save_file_path))
+    ffmpeg_command[1:1] = progress_args()
     process = subprocess.Popen(
-        ffmpeg_command, stdin=subprocess.PIPE, stderr=subprocess.STDOUT, startupinfo=get_startup_info(os_type)
+        ffmpeg_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        startupinfo=get_startup_info(os_type)
     )
+    recording_stats[record_name] = RecordingStats()
+    ProgressReader(process.stdout, recording_stats[record_name]).start()
 
     subs_file_path = save_file_path.rsplit('.', maxsplit=1)[0]
     subs_thread_name = f'subs_{Path(subs_file_path).name}'
@@ -433,64 +651,88 @@ def check_subprocess(record_name: str, record_url: str, ffmpeg_command: list, sa
         create_var[subs_thread_name].daemon = True
         create_var[subs_thread_name].start()
 
+    # 录制文件(分段录制时为第一个分段), ffmpeg没有报告输出时长时以文件写入数据作为开始输出的时间
+    first_output_path = save_file_path.replace('%03d', '000')
+    stalled = False
     while process.poll() is None:
         if record_url in url_comments or exit_recording:
             color_obj.print_colored(f"[{record_name}]录制时已被注释,本条线程将会退出", color_obj.YELLOW)
             clear_record_info(record_name, record_url)
-            # process.terminate()
-            if os.name == 'nt':
-                if process.stdin:
-                    process.stdin.write(b'q')
-                    process.stdin.close()
-            else:
-                process.send_signal(signal.SIGINT)
-            process.wait()
+            stop_ffmpeg(process)
+            if is_segment:
+                segment_manifest.build_manifest(save_file_path)
             return True
+
+        stats = recording_stats.get(record_name)
+        if stats and not stats.first_output_at and os.path.isfile(first_output_path) \
+                and os.path.getsize(first_output_path) > 0:
+            stats.first_output_at = time.monotonic()
+        if stats and stats.first_output_at:
+            start_latency.first_byte(record_url, stats.first_output_at)
+        if stats:
+            count_recorded_bytes(stats)
+        # 开始输出前ffmpeg可能仍在探测流信息(海外平台analyzeduration长达40秒), 写入第一个字节后才开始计算停滞时间
+        if stall_timeout and stats and stats.first_output_at and stats.stalled_for() > stall_timeout:
+            # CDN节点卡住但不断开时ffmpeg要等到rw_timeout甚至更久才退出, 这里提前结束并让录制线程立即重新获取直播流
+            color_obj.print_colored(
+                f"[{record_name}]录制已停滞{int(stats.stalled_for())}秒, 结束当前录制并重新获取直播流", color_obj.YELLOW)
+            logger.warning(f"Recording stalled, restarting: {record_url}")
+            stop_ffmpeg(process)
+            stalled_recordings.add(record_url)
+            stalled = True
+            break
         time.sleep(1)
 
+    if is_segment:
+        segment_manifest.build_manifest(save_file_path)
+    stats = recording_stats.get(record_name)
+    if stats and stats.first_output_at:
+        start_latency.first_byte(record_url, stats.first_output_at)
     return_code = process.returncode
     stop_time = time.strftime('%Y-%m-%d %H:%M:%S')
-    if return_code == 0:
-        if converts_to_mp4 and save_type == 'TS':
-            if split_video_by_time:
-                file_paths = utils.get_file_paths(os.path.dirname(save_file_path))
-                prefix = os.path.basename(save_file_path).rsplit('_', maxsplit=1)[0]
-                for path in file_paths:
-                    if prefix in path:
-                        threading.Thread(target=converts_mp4, args=(path, delete_origin_file)).start()
-            else:
-                threading.Thread(target=converts_mp4, args=(save_file_path, delete_origin_file)).start()
-        print(f"\n{record_name} {stop_time} 直播录制完成\n")
-
-        if script_command:
-            logger.debug("开始执行脚本命令!")
-            if "python" in script_command:
-                params = [
-                    f'--record_name "{record_name}"',
-                    f'--save_file_path "{save_file_path}"',
-                    f'--save_type {save_type}',
-                    f'--split_video_by_time {split_video_by_time}',
-                    f'--converts_to_mp4 {converts_to_mp4}',
-                ]
-            else:
-                params = [
-                    f'"{record_name.split(" ", maxsplit=1)[-1]}"',
-                    f'"{save_file_path}"',
-                    save_type,
-                    f'split_video_by_time:{split_video_by_time}',
-                    f'converts_to_mp4:{converts_to_mp4}'
-                ]
-            script_command = script_command.strip() + ' ' + ' '.join(params)
-            run_script(script_command)
-            logger.debug("脚本命令执行结束!")
-
+    if return_code == 0 or stalled:
+        finish_record(record_name, save_file_path, save_type, script_command)
     else:
         color_obj.print_colored(f"\n{record_name} {stop_time} 直播录制出错,返回码: {return_code}\n", color_obj.RED)
 
     recording.discard(record_name)
+    release_recording_stats(record_name)
     return False
 
 
+def finish_record(record_name: str, save_file_path: str, save_type: str, script_command: str | None = None) -> None:
+    stop_time = time.strftime('%Y-%m-%d %H:%M:%S')
+    if converts_to_mp4 and save_type == 'TS':
+        if split_video_by_time:
+            for path in segment_manifest.manifest_segment_paths(save_file_path):
+                submit_converts_mp4(path)
+        else:
+            submit_converts_mp4(save_file_path)
+    print(f"\n{record_name} {stop_time} 直播录制完成\n")
+
+    if script_command:
+        logger.debug("开始执行脚本命令!")
+        if "python" in script_command:
+            params = [
+                f'--record_name "{record_name}"',
+                f'--save_file_path "{save_file_path}"',
+                f'--save_type {save_type}',
+                f'--split_video_by_time {split_video_by_time}',
+                f'--converts_to_mp4 {converts_to_mp4}',
+            ]
+        else:
+            params = [
+                f'"{record_name.split(" ", maxsplit=1)[-1]}"',
+                f'"{save_file_path}"',
+                save_type,
+                f'split_video_by_time:{split_video_by_time}',
+                f'converts_to_mp4:{converts_to_mp4}'
+            ]
+        script_command = script_command.strip() + ' ' + ' '.join(params)
+        run_script(script_command)
+        logger.debug("脚本命令执行结束!")
+
+
 def clean_name(input_text):
     cleaned_name = re.sub(rstr, "_", input_text.strip()).strip('_')
     cleaned_name = cleaned_name.replace("（", "(").replace("）", ")")
@@ -511,6 +753,48 @@ def get_quality_code(qn):
     return QUALITY_MAPPING.get(qn)
 
 
+def add_extra_outputs(ffmpeg_command: list, save_file_path: str, save_type: str) -> None:
+    """
+    在同一个ffmpeg进程中追加音频和完整文件输出, 所有产物共用一次网络读取和解封装
+    """
+    extra_outputs = []
+    is_segment = '%03d' in save_file_path
+    file_stem = save_file_path.rsplit('.', maxsplit=1)[0]
+
+    if extra_audio_format in ('mp3', 'm4a'):
+        if extra_audio_format == 'mp3':
+            audio_command = ["-map", "0:a", "-vn", "-c:a", "libmp3lame", "-ab", "320k"]
+        else:
+            audio_command = ["-map", "0:a", "-vn", "-c:a", "copy", "-bsf:a", "aac_adtstoasc"]
+        if is_segment:
+            audio_command += ["-f", "segment", "-segment_time", split_time, "-reset_timestamps", "1"]
+            if extra_audio_format == 'm4a':
+                audio_command += ["-segment_format", "mp4", "-movflags", "+frag_keyframe+empty_moov"]
+        elif extra_audio_format == 'm4a':
+            audio_command += ["-f", "mp4", "-movflags", "+frag_keyframe+empty_moov"]
+        extra_outputs.append(audio_command + [f"{file_stem}.{extra_audio_format}"])
+
+    if is_segment and keep_full_file:
+        format_mapping = {'FLV': 'flv', 'MKV': 'matroska', 'MP4': 'mp4', 'TS': 'mpegts'}
+        full_command = ["-map", "0", "-c:v", "copy", "-c:a", "copy", "-f", format_mapping.get(save_type, 'mpegts')]
+        if save_type == 'MP4':
+            full_command += ["-movflags", "+frag_keyframe+empty_moov"]
+        elif save_type == 'FLV':
+            full_command += ["-bsf:a", "aac_adtstoasc"]
+        extra_outputs.append(full_command + [save_file_path.replace('_%03d', '')])
+
+    if not extra_outputs:
+        return
+
+    # -i之后的参数都是输出参数, 只对紧随其后的输出文件生效, 需要为每个输出重复一遍
+    output_options = ffmpeg_command[ffmpeg_command.index('-i') + 2:]
+    for index, output in enumerate(extra_outputs):
+        if index:
+            ffmpeg_command.extend(output_options)
+        ffmpeg_command.extend(output)
+    ffmpeg_command.extend(output_options)
+
+
 def get_record_headers(platform, live_url):
     live_domain = '/'.join(live_url.split('/')[0:3])
     record_headers = {
@@ -553,6 +837,10 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
             new_record_url = ''
             count_time = time.time()
             retry = 0
+            cached_port_info = None
+            last_port_info = None
+            reconnect_deadline = 0
+            reconnect_attempt = 0
             record_quality_zh, record_url, anchor_name = url_data
             record_quality = get_quality_code(record_quality_zh)
             proxy_address = proxy_addr
@@ -577,7 +865,14 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
             while True:
                 try:
                     port_info = []
-                    if record_url.find("douyin.com/") > -1:
+                    probe_start = time.monotonic()
+                    probe_from_cache = bool(cached_port_info)
+                    if cached_port_info:
+                        # 断流后先直接用上次解析到的直播流地址重连, 不再走一遍完整的解析流程
+                        port_info, cached_port_info = cached_port_info, None
+                        logger.debug(f"Fast reconnect with cached stream url: {record_url}")
+
+                    elif record_url.find("douyin.com/") > -1:
                         platform = '抖音直播'
                         with semaphore:
                             if 'v.douyin.com' not in record_url and '/user/' not in record_url:
@@ -1039,6 +1334,13 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                         logger.error(f'{record_url} {platform}直播地址')
                         return
 
+                    if not probe_from_cache:
+                        probe_result = 'error' if not port_info.get("anchor_name", '') else (
+                            'live' if port_info.get('is_live') else 'offline')
+                        probe_counter.inc(platform, probe_result)
+                        probe_latency.observe(time.monotonic() - probe_start, platform)
+                        tracing.record('start_record.probe', probe_start, platform=platform, result=probe_result)
+
                     if anchor_name:
                         if '主播:' in anchor_name:
                             anchor_split: list = anchor_name.split('主播:')
@@ -1057,6 +1359,10 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                     else:
                         anchor_name = clean_name(anchor_name)
                         record_name = f'序号{count_variable} {anchor_name}'
+                        room_status[record_url] = {
+                            'record_name': record_name, 'platform': platform, 'quality': record_quality_zh,
+                            'is_live': bool(port_info.get('is_live')), 'last_probe_time': time.time()
+                        }
 
                         if record_url in url_comments:
                             print(f"[{anchor_name}]已被注释,本条线程将会退出")
@@ -1075,6 +1381,7 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                         push_at = datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S')
                         if port_info['is_live'] is False:
                             print(f"\r{record_name} 等待直播... ")
+                            start_latency.went_offline(record_url)
 
                             if start_pushed:
                                 if over_show_push:
@@ -1084,11 +1391,7 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
 
                                     push_content = (push_content.replace('[直播间名称]', record_name).
                                                     replace('[时间]', push_at))
-                                    threading.Thread(
-                                        target=push_message,
-                                        args=(record_name, record_url, push_content.replace(r'\n', '\n')),
-                                        daemon=True
-                                    ).start()
+                                    push_message(record_name, record_url, push_content.replace(r'\n', '\n'))
                                 start_pushed = False
 
                         else:
@@ -1103,20 +1406,21 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
 
                                     push_content = (push_content.replace('[直播间名称]', record_name).
                                                     replace('[时间]', push_at))
-                                    threading.Thread(
-                                        target=push_message,
-                                        args=(record_name, record_url, push_content.replace(r'\n', '\n')),
-                                        daemon=True
-                                    ).start()
+                                    push_message(record_name, record_url, push_content.replace(r'\n', '\n'),
+                                                 urgent=begin_push_urgent)
                                 start_pushed = True
 
                             if disable_record:
                                 time.sleep(push_check_seconds)
                                 continue
 
+                            start_latency.live_detected(record_url, platform, port_info.get('live_start_time'))
                             real_url = select_source_url(record_url, port_info)
                             full_path = f'{default_path}/{platform}'
                             if real_url:
+                                record_start_time = time.time()
+                                from_cache = port_info is last_port_info
+                                last_port_info = port_info
                                 now = datetime.datetime.today().strftime("%Y-%m-%d_%H-%M-%S")
                                 live_title = port_info.get('title')
                                 title_in_name = ''
@@ -1154,9 +1458,7 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                     if platform in http_record_list:
                                         real_url = real_url.replace("https://", "http://")
 
-                                user_agent = ("Mozilla/5.0 (Linux; Android 11; SAMSUNG SM-G973U) AppleWebKit/537.36 ("
-                                              "KHTML, like Gecko) SamsungBrowser/14.2 Chrome/87.0.4280.141 Mobile "
-                                              "Safari/537.36")
+                                user_agent = record_user_agent
 
                                 rw_timeout = "15000000"
                                 analyzeduration = "20000000"
@@ -1184,7 +1486,8 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                     "-analyzeduration", analyzeduration,
                                     "-probesize", probesize,
                                     "-fflags", "+discardcorrupt",
-                                    "-re", "-i", real_url,
+                                    *utils.get_input_pacing_args(input_pacing_mode),
+                                    "-i", real_url,
                                     "-bufsize", bufsize,
                                     "-sn", "-dn",
                                     "-reconnect_delay_max", "60",
@@ -1310,8 +1613,11 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                     filename = anchor_name + f'_{title_in_name}' + now + '.flv'
                                     save_file_path = f'{full_path}/{filename}'
                                     print(f'{rec_info}/{filename}')
+                                    if split_video_by_time:
+                                        save_file_path = f'{full_path}/{anchor_name}_{title_in_name}{now}_%03d.flv'
 
-                                    subs_file_path = save_file_path.rsplit('.', maxsplit=1)[0]
+                                    # 分段录制时为整场录制生成一个字幕文件, 文件名去掉分段序号
+                                    subs_file_path = save_file_path.replace('_%03d', '').rsplit('.', maxsplit=1)[0]
                                     subs_thread_name = f'subs_{Path(subs_file_path).name}'
                                     if create_time_file:
                                         create_var[subs_thread_name] = threading.Thread(
@@ -1328,7 +1634,8 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                             recording_time_list[record_name] = [start_record_time, record_quality_zh]
 
                                             download_success = direct_download_stream(
-                                                flv_url, save_file_path, record_name, record_url, platform
+                                                flv_url, save_file_path, record_name, record_url, platform,
+                                                split_time=split_time if split_video_by_time else 0
                                             )
 
                                             if download_success:
@@ -1379,6 +1686,7 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                                 "-f", "flv",
                                                 "{path}".format(path=save_file_path),
                                             ]
+                                        add_extra_outputs(ffmpeg_command, save_file_path, record_save_type)
                                         ffmpeg_command.extend(command)
 
                                         comment_end = check_subprocess(
@@ -1401,25 +1709,14 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                         if converts_to_mp4:
                                             seg_file_path = f"{full_path}/{anchor_name}_{title_in_name}{now}_%03d.mp4"
                                             if split_video_by_time:
-                                                segment_video(
-                                                    save_file_path, seg_file_path,
-                                                    segment_format='mp4', segment_time=split_time,
-                                                    is_original_delete=delete_origin_file
-                                                )
+                                                submit_segment_video(save_file_path, seg_file_path, 'mp4')
                                             else:
-                                                threading.Thread(
-                                                    target=converts_mp4,
-                                                    args=(save_file_path, delete_origin_file)
-                                                ).start()
+                                                submit_converts_mp4(save_file_path)
 
                                         else:
                                             seg_file_path = f"{full_path}/{anchor_name}_{title_in_name}{now}_%03d.flv"
                                             if split_video_by_time:
-                                                segment_video(
-                                                    save_file_path, seg_file_path,
-                                                    segment_format='flv', segment_time=split_time,
-                                                    is_original_delete=delete_origin_file
-                                                )
+                                                submit_segment_video(save_file_path, seg_file_path, 'flv')
                                     except Exception as e:
                                         logger.error(f"转码失败: {e} ")
 
@@ -1453,6 +1750,7 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                                 "-f", "matroska",
                                                 "{path}".format(path=save_file_path),
                                             ]
+                                        add_extra_outputs(ffmpeg_command, save_file_path, record_save_type)
                                         ffmpeg_command.extend(command)
 
                                         comment_end = check_subprocess(
@@ -1501,6 +1799,7 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                                 save_file_path,
                                             ]
 
+                                        add_extra_outputs(ffmpeg_command, save_file_path, record_save_type)
                                         ffmpeg_command.extend(command)
                                         comment_end = check_subprocess(
                                             record_name,
@@ -1519,45 +1818,44 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                             error_window.append(1)
 
                                 else:
+                                    # 录制完成后需要转为MP4且不重新编码时, 直接录制为分片MP4, 省去录制后的转封装
+                                    live_fmp4 = live_fmp4_record and converts_to_mp4 and not converts_to_h264
+                                    output_save_type = "MP4" if live_fmp4 else record_save_type
                                     if split_video_by_time:
                                         now = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
-                                        filename = anchor_name + f'_{title_in_name}' + now + ".ts"
+                                        extension = "mp4" if live_fmp4 else "ts"
+                                        filename = anchor_name + f'_{title_in_name}' + now + f".{extension}"
                                         print(f'{rec_info}/{filename}')
 
                                         try:
-                                            save_file_path = f"{full_path}/{anchor_name}_{title_in_name}{now}_%03d.ts"
+                                            save_file_path = (f"{full_path}/{anchor_name}_{title_in_name}{now}"
+                                                              f"_%03d.{extension}")
                                             command = [
                                                 "-c:v", "copy",
                                                 "-c:a", "copy",
                                                 "-map", "0",
                                                 "-f", "segment",
                                                 "-segment_time", split_time,
-                                                "-segment_format", 'mpegts',
+                                                "-segment_format", 'mp4' if live_fmp4 else 'mpegts',
                                                 "-reset_timestamps", "1",
-                                                save_file_path,
                                             ]
+                                            if live_fmp4:
+                                                command += ["-movflags", live_fmp4_movflags]
+                                            command.append(save_file_path)
 
+                                            add_extra_outputs(ffmpeg_command, save_file_path, output_save_type)
                                             ffmpeg_command.extend(command)
                                             comment_end = check_subprocess(
                                                 record_name,
                                                 record_url,
                                                 ffmpeg_command,
-                                                record_save_type,
+                                                output_save_type,
                                                 custom_script
                                             )
                                             if comment_end:
-                                                if converts_to_mp4:
-                                                    file_paths = utils.get_file_paths(os.path.dirname(save_file_path))
-                                                    prefix = os.path.basename(save_file_path).rsplit('_', maxsplit=1)[0]
-                                                    for path in file_paths:
-                                                        if prefix in path:
-                                                            try:
-                                                                threading.Thread(
-                                                                    target=converts_mp4,
-                                                                    args=(path, delete_origin_file)
-                                                                ).start()
-                                                            except subprocess.CalledProcessError as e:
-                                                                logger.error(f"转码失败: {e} ")
+                                                if converts_to_mp4 and not live_fmp4:
+                                                    for path in segment_manifest.manifest_segment_paths(save_file_path):
+                                                        submit_converts_mp4(path)
                                                 return
 
                                         except subprocess.CalledProcessError as e:
@@ -1572,36 +1870,75 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                                         print(f'{rec_info}/{filename}')
                                         save_file_path = full_path + '/' + filename
 
-                                        try:
-                                            command = [
-                                                "-c:v", "copy",
-                                                "-c:a", "copy",
-                                                "-map", "0",
-                                                "-f", "mpegts",
-                                                save_file_path,
-                                            ]
-
-                                            ffmpeg_command.extend(command)
-                                            comment_end = check_subprocess(
-                                                record_name,
-                                                record_url,
-                                                ffmpeg_command,
-                                                record_save_type,
-                                                custom_script
+                                        download_success = None
+                                        # 内置HLS下载器只写单个TS文件, 需要时间字幕或同时输出音频时仍由ffmpeg录制
+                                        if (native_hls_record and '.m3u8' in real_url and not create_time_file
+                                                and extra_audio_format not in ('mp3', 'm4a')):
+                                            logger.info(f"Use Native HLS Downloader to Download Stream: {record_url}")
+                                            download_success = hls_download_stream(
+                                                real_url, save_file_path, record_name, record_url, platform,
+                                                proxy_address=proxy_address, timeout=int(rw_timeout) // 1000000
                                             )
-                                            if comment_end:
-                                                threading.Thread(
-                                                    target=converts_mp4, args=(save_file_path, delete_origin_file)
-                                                ).start()
-                                                return
 
-                                        except subprocess.CalledProcessError as e:
-                                            logger.error(f"错误信息: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
-                                            with max_request_lock:
-                                                error_count += 1
-                                                error_window.append(1)
+                                        if download_success is not None:
+                                            if download_success:
+                                                record_finished = True
+                                                finish_record(record_name, save_file_path, record_save_type,
+                                                              custom_script)
+                                            recording.discard(record_name)
+
+                                        else:
+                                            try:
+                                                if live_fmp4:
+                                                    save_file_path = save_file_path.rsplit('.', maxsplit=1)[0] + ".mp4"
+                                                    command = [
+                                                        "-map", "0",
+                                                        "-c:v", "copy",
+                                                        "-c:a", "copy",
+                                                        "-f", "mp4",
+                                                        "-movflags", live_fmp4_movflags,
+                                                        save_file_path,
+                                                    ]
+                                                else:
+                                                    command = [
+                                                        "-c:v", "copy",
+                                                        "-c:a", "copy",
+                                                        "-map", "0",
+                                                        "-f", "mpegts",
+                                                        save_file_path,
+                                                    ]
+
+                                                add_extra_outputs(ffmpeg_command, save_file_path, output_save_type)
+                                                ffmpeg_command.extend(command)
+                                                comment_end = check_subprocess(
+                                                    record_name,
+                                                    record_url,
+                                                    ffmpeg_command,
+                                                    output_save_type,
+                                                    custom_script
+                                                )
+                                                if comment_end:
+                                                    if not live_fmp4:
+                                                        submit_converts_mp4(save_file_path)
+                                                    return
+
+                                            except subprocess.CalledProcessError as e:
+                                                logger.error(
+                                                    f"错误信息: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
+                                                with max_request_lock:
+                                                    error_count += 1
+                                                    error_window.append(1)
 
                                 count_time = time.time()
+                                start_latency.recording_ended(record_url, platform)
+                                if fast_reconnect_grace:
+                                    # 录制时长超过1分钟说明上次重连已经恢复, 重新开始一个快速重连窗口
+                                    if (not reconnect_deadline or time.monotonic() > reconnect_deadline
+                                            or count_time - record_start_time > 60):
+                                        reconnect_deadline = time.monotonic() + fast_reconnect_grace
+                                        reconnect_attempt = 0
+                                    if not from_cache and reconnect_attempt == 0:
+                                        cached_port_info = last_port_info
 
                 except Exception as e:
                     logger.error(f"错误信息: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
@@ -1629,6 +1966,21 @@ def start_record(url_data: tuple, count_variable: int = -1) -> None:
                 else:
                     x = num
 
+                if reconnect_deadline:
+                    remaining = reconnect_deadline - time.monotonic()
+                    if remaining > 0:
+                        x = 0 if cached_port_info else min(2 ** reconnect_attempt, int(remaining) + 1)
+                        reconnect_attempt += 0 if cached_port_info else 1
+                    else:
+                        reconnect_deadline = 0
+                        reconnect_attempt = 0
+
+                if record_url in stalled_recordings:
+                    # 停滞的地址大概率已失效, 跳过缓存直接重新解析
+                    stalled_recordings.discard(record_url)
+                    cached_port_info = None
+                    x = 0
+
                 # 这里是正常循环
                 while x:
                     x = x - 1
@@ -1723,9 +2075,10 @@ if not check_ffmpeg_existence():
     logger.error("缺少ffmpeg无法进行录制，程序退出")
     sys.exit(1)
 os.makedirs(os.path.dirname(config_file), exist_ok=True)
-t3 = threading.Thread(target=backup_file_start, args=(), daemon=True)
-t3.start()
-utils.remove_duplicate_lines(url_config_file)
+if not shard:
+    t3 = threading.Thread(target=backup_file_start, args=(), daemon=True)
+    t3.start()
+    utils.remove_duplicate_lines(url_config_file)
 
 
 def read_config_value(config_parser: configparser.RawConfigParser, section: str, option: str, default_value: Any) \
@@ -1746,8 +2099,9 @@ def read_config_value(config_parser: configparser.RawConfigParser, section: str,
         return config_parser.get(section, option)
     except (configparser.NoSectionError, configparser.NoOptionError):
         config_parser.set(section, option, str(default_value))
-        with open(config_file, 'w', encoding=text_encoding) as f:
-            config_parser.write(f)
+        with file_update_lock:
+            with open(config_file, 'w', encoding=text_encoding) as f:
+                config_parser.write(f)
         return default_value
 
 
@@ -1780,6 +2134,71 @@ except URLError:
 except Exception as err:
     print("An unexpected error occurred:", err)
 
+shard_workers = int(read_config_value(config, '录制设置', '多进程录制工作进程数(0为关闭)', 0))
+if shard_workers > 1 and not shard:
+    ini_URL_content = ''
+    if os.path.isfile(url_config_file):
+        with open(url_config_file, 'r', encoding=text_encoding) as file:
+            ini_URL_content = file.read().strip()
+    if not ini_URL_content:
+        input_url = input('请输入要录制的主播直播间网址（尽量使用PC网页端的直播间地址）:\n')
+        with open(url_config_file, 'w', encoding=text_encoding) as file:
+            file.write(input_url)
+
+    metrics_port = int(read_config_value(config, '录制设置', '状态监控接口端口', 9111))
+    supervisor = sharding.ShardSupervisor(
+        sharding.worker_command(), shard_workers, f'{script_path}/config/shards.json', f'{script_path}/logs',
+        metrics_port, version=version
+    )
+    print(f"多进程录制已开启: {shard_workers}个工作进程, 各进程输出见 {script_path}/logs/worker_*.log")
+    if options.get(read_config_value(config, '录制设置', '是否开启状态监控接口(是/否)', "否"), False):
+        metrics_host = read_config_value(config, '录制设置', '状态监控接口监听地址', "127.0.0.1").strip() or "127.0.0.1"
+        try:
+            metrics_server = metrics.MetricsServer(
+                metrics_host, metrics_port, metrics_registry=sharding.AggregatedRegistry(supervisor),
+                status_provider=supervisor.status).start()
+            print(f"状态监控接口已开启: http://{metrics_host}:{metrics_port}/metrics")
+        except OSError as e:
+            logger.error(f"状态监控接口启动失败: {e}")
+    supervisor.run()
+
+# 监督进程不录制也不做后处理, 任务日志由各工作进程自己恢复
+postprocess_queue = PostProcessQueue(
+    handlers={'mp4': converts_mp4, 'm4a': converts_m4a, 'segment': segment_video},
+    journal_path=f'{script_path}/config/postprocess_jobs.db' if not shard or shard.index == 0
+    else f'{script_path}/config/postprocess_jobs_{shard.index}.db'
+)
+if not shard or shard.index == 0:
+    # 减少工作进程数或关闭多进程模式后, 多出来的工作进程留下的任务日志由0号进程(或单进程)接管
+    for journal_file in Path(f'{script_path}/config').glob('postprocess_jobs_*.db'):
+        journal_index = re.fullmatch(r'postprocess_jobs_(\d+)\.db', journal_file.name)
+        if journal_index and (not shard or int(journal_index.group(1)) >= shard.count):
+            postprocess_queue.adopt(str(journal_file))
+
+cluster_store = read_config_value(config, '录制设置', '集群协调存储路径(留空为关闭)', "").strip()
+shared_url_config = ""
+if cluster_store:
+    shared_url_config = read_config_value(config, '录制设置', '集群共享直播间配置文件(留空则使用本机配置)', "").strip()
+    if shared_url_config:
+        url_config_file = shared_url_config
+        file_update_lock = sharding.FileLock(f'{shared_url_config}.lock')
+    node_name = read_config_value(config, '录制设置', '集群节点名称(留空则自动生成)', "").strip()
+    if node_name and shard:
+        node_name = f'{node_name}-{shard.index}'
+    try:
+        cluster_member = cluster.ClusterMember(
+            cluster.open_store(cluster_store), node_name or None,
+            ttl=int(read_config_value(config, '录制设置', '集群租约时长(秒)', 30)),
+            on_lost=release_cluster_room, is_running=lambda url: url in running_list, is_recording=is_recording_url
+        ).start()
+        print(f"集群模式已开启: 节点{cluster_member.node_id}, 协调存储 {cluster_store}")
+    except Exception as err:
+        logger.error(f"集群协调存储打开失败, 程序退出: {err}")
+        sys.exit(1)
+room_owner = cluster_member or shard
+# 删除重复行等整理由共用同一个配置文件的进程之一执行: 集群共享配置文件时为集群主节点, 否则为本机编号最小的工作进程
+url_config_manager = cluster_member if shared_url_config else shard
+
 while True:
 
     try:
@@ -1792,7 +2211,7 @@ while True:
             with open(url_config_file, 'r', encoding=text_encoding) as file:
                 ini_URL_content = file.read().strip()
 
-        if not ini_URL_content.strip():
+        if not ini_URL_content.strip() and not shard:
             input_url = input('请输入要录制的主播直播间网址（尽量使用PC网页端的直播间地址）:\n')
             with open(url_config_file, 'w', encoding=text_encoding) as file:
                 file.write(input_url)
@@ -1812,12 +2231,31 @@ while True:
     proxy_addr = None if not use_proxy else proxy_addr_bak
     max_request = int(read_config_value(config, '录制设置', '同一时间访问网络的线程数', 3))
     semaphore = threading.Semaphore(max_request)
+    enable_tracing = options.get(read_config_value(config, '录制设置', '是否开启耗时追踪(是/否)', "否"), False)
+    trace_export_file = read_config_value(config, '录制设置', '耗时追踪输出文件', "").strip()
+    if enable_tracing:
+        semaphore = tracing.TimedLock(semaphore, 'start_record.semaphore_wait')
     delay_default = int(read_config_value(config, '录制设置', '循环时间(秒)', 120))
     local_delay_default = int(read_config_value(config, '录制设置', '排队读取网址时间(秒)', 0))
     loop_time = options.get(read_config_value(config, '录制设置', '是否显示循环秒数', "否"), False)
     show_url = options.get(read_config_value(config, '录制设置', '是否显示直播源地址', "否"), False)
     split_video_by_time = options.get(read_config_value(config, '录制设置', '分段录制是否开启', "否"), False)
     enable_https_recording = options.get(read_config_value(config, '录制设置', '是否强制启用https录制', "否"), False)
+    extra_audio_format = read_config_value(config, '录制设置', '录制时同时输出音频文件(否/mp3/m4a)', "否").strip().lower()
+    keep_full_file = options.get(read_config_value(config, '录制设置', '分段录制时同时保留完整文件', "否"), False)
+    live_fmp4_record = options.get(read_config_value(config, '录制设置', 'ts转mp4时直接录制为分片mp4', "否"), False)
+    postprocess_workers = int(read_config_value(config, '录制设置', '后处理转码并发数(0为自动)', 0))
+    input_pacing_mode = read_config_value(config, '录制设置', '录制输入读取模式(native/unthrottled/adaptive)',
+                                          "unthrottled").strip().lower()
+    enable_metrics_server = options.get(read_config_value(config, '录制设置', '是否开启状态监控接口(是/否)', "否"), False)
+    metrics_host = read_config_value(config, '录制设置', '状态监控接口监听地址', "127.0.0.1").strip() or "127.0.0.1"
+    metrics_port = int(read_config_value(config, '录制设置', '状态监控接口端口', 9111))
+    if shard:
+        # 工作进程的状态接口只供监督进程汇总, 固定开启并只监听本机
+        enable_metrics_server, metrics_host, metrics_port = True, "127.0.0.1", shard.metrics_port
+    fast_reconnect_grace = int(read_config_value(config, '录制设置', '断流快速重连时长(秒,0为关闭)', 120))
+    stall_timeout = int(read_config_value(config, '录制设置', '录制停滞检测时间(秒,0为关闭)', 30))
+    native_hls_record = options.get(read_config_value(config, '录制设置', '是否使用内置HLS下载器(是/否)', "否"), False)
     disk_space_limit = float(read_config_value(config, '录制设置', '录制空间剩余阈值(gb)', 1.0))
     split_time = str(read_config_value(config, '录制设置', '视频分段时间(秒)', 1800))
     converts_to_mp4 = options.get(read_config_value(config, '录制设置', '录制完成后自动转为mp4格式', "否"), False)
@@ -1862,6 +2300,9 @@ while True:
     push_check_seconds = int(read_config_value(config, '推送配置', '直播推送检测频率(秒)', 1800))
     begin_show_push = options.get(read_config_value(config, '推送配置', '开播推送开启(是/否)', "是"), True)
     over_show_push = options.get(read_config_value(config, '推送配置', '关播推送开启(是/否)', "否"), False)
+    push_coalesce_window = float(read_config_value(config, '推送配置', '推送合并时间窗口(秒,0为关闭)', 10))
+    begin_push_urgent = options.get(read_config_value(config, '推送配置', '开播推送不参与合并(是/否)', "否"), False)
+    push_dispatcher.coalesce_window = push_coalesce_window
     sooplive_username = read_config_value(config, '账号密码', 'sooplive账号', '')
     sooplive_password = read_config_value(config, '账号密码', 'sooplive密码', '')
     flextv_username = read_config_value(config, '账号密码', 'flextv账号', '')
@@ -1945,10 +2386,14 @@ while True:
 
 
     try:
-        url_comments, line_list, url_line_list = [[] for _ in range(3)]
+        if shard and shard.refresh() and not cluster_member:
+            print(f"\r可用工作进程变化, 重新分配直播间: {shard.workers}")
+        # 多个进程共用配置文件时删除重复行只由一个进程执行, 否则多个进程会把重复的两行都删掉
+        manage_url_config = not url_config_manager or url_config_manager.is_leader
+        url_comments, line_list, url_line_list, cluster_rooms = [[] for _ in range(4)]
         with (open(url_config_file, "r", encoding=text_encoding, errors='ignore') as file):
             for origin_line in file:
-                if origin_line in line_list:
+                if origin_line in line_list and manage_url_config:
                     delete_line(url_config_file, origin_line)
                 line_list.append(origin_line)
                 line = origin_line.strip()
@@ -1986,12 +2431,20 @@ while True:
 
                 if url not in url_line_list:
                     url_line_list.append(url)
-                else:
+                elif manage_url_config:
                     delete_line(url_config_file, origin_line)
 
                 url = 'https://' + url if '://' not in url else url
                 url_host = url.split('/')[2]
 
+                if cluster_member and not is_comment_line:
+                    cluster_rooms.append(url)
+                if room_owner and not room_owner.owns(url):
+                    # 不属于本进程的直播间按注释行处理, 正在录制的会停止并交给所属进程
+                    url_comments = [i for i in url_comments if url not in i]
+                    url_comments.append(url)
+                    continue
+
                 platform_host = [
                     'live.douyin.com',
                     'v.douyin.com',
@@ -2109,6 +2562,9 @@ while True:
                         color_obj.print_colored(f"\r{origin_line.strip()} 本行包含未知链接.此条跳过", color_obj.YELLOW)
                         update_file(url_config_file, old_str=origin_line, new_str=origin_line, start_str='#')
 
+        if cluster_member:
+            cluster_member.set_rooms(cluster_rooms)
+
         while len(need_update_line_list):
             a = need_update_line_list.pop()
             replace_words = a.split('|')
@@ -2121,6 +2577,15 @@ while True:
                     new_word = replace_words[1]
                 update_file(url_config_file, old_str=replace_words[0], new_str=new_word, start_str=start_with)
 
+        for running_url in running_list:
+            if running_url in url_comments or exit_recording:
+                stop_event = record_stop_events.get(running_url)
+                if stop_event:
+                    stop_event.set()
+        if shard:
+            # 已按本轮读取的状态停止不再属于本进程的直播间, 监督进程据此结束交接
+            shard.applied_version = shard.version
+
         text_no_repeat_url = list(set(url_tuples_list))
 
         if len(text_no_repeat_url) > 0:
@@ -2150,6 +2615,22 @@ while True:
         t.start()
         t2 = threading.Thread(target=adjust_max_request, args=(), daemon=True)
         t2.start()
+        postprocess_queue.start(postprocess_workers)
+        if enable_tracing:
+            tracing.enable(trace_export_file or None)
+            tracing.instrument_module(spider, 'spider')
+            tracing.instrument_module(stream, 'stream')
+            tracing.instrument_module(spider, 'async_http', ['async_req'])
+            tracing.instrument_module(spider, 'ab_sign', ['ab_sign'])
+            tracing.instrument_module(stream, 'async_http', ['get_response_status'])
+        if enable_metrics_server:
+            try:
+                metrics.registry.add_collector(collect_metrics)
+                metrics_server = metrics.MetricsServer(
+                    metrics_host, metrics_port, status_provider=collect_status).start()
+                print(f"状态监控接口已开启: http://{metrics_host}:{metrics_port}/metrics")
+            except OSError as e:
+                logger.error(f"状态监控接口启动失败: {e}")
         first_run = False
 
     time.sleep(3)
\ No newline at end of file
@@ -7,19 +7,253 @@ Date: 2023-09-03 19:18:36
 Update: 2025-01-23 17:16:12
 Copyright (c) 2023-2024 by Hmily, All Rights Reserved.
 """
-from typing import Dict, Any
+from typing import Dict, Any, Callable
 import json
 import base64
-import urllib.request
-import urllib.error
+import queue
 import smtplib
+import threading
+import time
 from email.header import Header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+import httpx
 
-no_proxy_handler = urllib.request.ProxyHandler({})
-opener = urllib.request.build_opener(no_proxy_handler)
 headers: Dict[str, str] = {'Content-Type': 'application/json'}
+http_clients: Dict[bool, httpx.Client] = {}
+http_clients_lock = threading.Lock()
+
+
+def get_http_client(trust_env: bool = False) -> httpx.Client:
+    """
+    获取复用连接的HTTP客户端, 默认不走系统代理; trust_env为True时使用环境变量中的代理(用于Telegram)
+    """
+    with http_clients_lock:
+        client = http_clients.get(trust_env)
+        if client is None:
+            client = httpx.Client(
+                trust_env=trust_env,
+                timeout=httpx.Timeout(10, connect=5),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            )
+            http_clients[trust_env] = client
+        return client
+
+
+def post_json(url: str, json_data: dict, timeout: float = 10, trust_env: bool = False,
+              ensure_ascii: bool = True, raise_for_status: bool = True) -> dict:
+    data = json.dumps(json_data, ensure_ascii=ensure_ascii).encode('utf-8')
+    response = get_http_client(trust_env).post(url, content=data, headers=headers, timeout=timeout)
+    if raise_for_status:
+        response.raise_for_status()
+    return response.json()
+
+
+class SmtpSession:
+    """
+    复用SMTP连接, 连接被服务器关闭后自动重连一次
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.conn = None
+        self.conn_key = None
+
+    def _connect(self, host: str, port: int, open_ssl: bool, login_email: str, email_pass: str) -> smtplib.SMTP:
+        key = (host, port, open_ssl, login_email, email_pass)
+        if self.conn is not None and self.conn_key == key:
+            return self.conn
+        self.close()
+        conn = smtplib.SMTP_SSL(host, port, timeout=15) if open_ssl else smtplib.SMTP(host, port, timeout=15)
+        conn.login(login_email, email_pass)
+        self.conn, self.conn_key = conn, key
+        return conn
+
+    def send(self, host: str, port: int, open_ssl: bool, login_email: str, email_pass: str, sender_email: str,
+             receivers: list, message: str) -> None:
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    conn = self._connect(host, port, open_ssl, login_email, email_pass)
+                    conn.sendmail(sender_email, receivers, message)
+                    return
+                except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                    self.close()
+                    if attempt:
+                        raise
+
+    def close(self) -> None:
+        if self.conn is not None:
+            try:
+                self.conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.conn = None
+        self.conn_key = None
+
+
+smtp_session = SmtpSession()
+
+
+# 各渠道的限流(次数, 秒), 钉钉机器人每分钟最多20条, Telegram群组每分钟约20条
+CHANNEL_RATE_LIMITS: Dict[str, tuple] = {
+    '钉钉': (20, 60),
+    'TG': (20, 60),
+}
+DEFAULT_RATE_LIMIT = (30, 60)
+
+# 各渠道单条消息的最大字符数, Telegram为4096, 钉钉机器人文本消息按字节计上限, 按中文保守取4000字;
+# Bark经APNs推送, 负载上限4KB
+CHANNEL_MESSAGE_LIMITS: Dict[str, int] = {
+    'TG': 4096,
+    '钉钉': 4000,
+    'BARK': 1000,
+}
+DEFAULT_MESSAGE_LIMIT = 4000
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, period: float) -> None:
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class PushDispatcher:
+    """
+    推送任务分发: 每个推送渠道一个有界队列和工作线程, 慢的渠道不会拖慢其他渠道, 也不会堆积线程
+
+    同一渠道在coalesce_window秒内的多条消息合并为一条摘要发送: 窗口内的第一条立即发送, 其余的在窗口结束时合并,
+    同时按渠道令牌桶限流, 没有令牌时继续累积到下一次摘要; urgent消息不参与合并和限流等待.
+    摘要按渠道的单条消息长度上限拆分, 超出的部分留到下一次发送; 积压超过max_queue_size条时丢弃最早的消息.
+    推送全部失败或抛出异常时按指数退避重试max_retries次
+    """
+
+    def __init__(self, max_retries: int = 2, retry_delay: float = 2.0, max_queue_size: int = 100,
+                 coalesce_window: float = 0) -> None:
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_queue_size = max_queue_size
+        self.coalesce_window = coalesce_window
+        self.queues: Dict[str, queue.Queue] = {}
+        self.lock = threading.Lock()
+
+    def _get_queue(self, channel: str) -> queue.Queue:
+        with self.lock:
+            channel_queue = self.queues.get(channel)
+            if channel_queue is None:
+                channel_queue = queue.Queue(self.max_queue_size)
+                self.queues[channel] = channel_queue
+                threading.Thread(target=self._worker, args=(channel, channel_queue), name=f'push_{channel}',
+                                 daemon=True).start()
+            return channel_queue
+
+    def submit(self, channel: str, send: Callable[[str], Dict[str, Any]], content: str,
+               callback: Callable[[Dict[str, Any] | None, Exception | None, int], None] | None = None,
+               urgent: bool = False, digest_send: Callable[[str], Dict[str, Any]] | None = None) -> bool:
+        """
+        send接收最终要发送的文本, callback的第三个参数是本次发送合并的消息数.
+        合并发送时使用第一条消息的digest_send(缺省为send), 不能带有单个直播间的链接等字段
+        """
+        try:
+            self._get_queue(channel).put_nowait((send, content, callback, urgent, digest_send or send))
+            return True
+        except queue.Full:
+            return False
+
+    @staticmethod
+    def make_digest(contents: list[str]) -> str:
+        if len(contents) == 1:
+            return contents[0]
+        return f"共{len(contents)}条直播间状态更新:\n\n" + "\n\n".join(contents)
+
+    def take_batch(self, pending: list, limit: int) -> int:
+        """返回合并后不超过limit个字符的最多消息条数, 至少为1"""
+        count = 1
+        while count < len(pending) and len(self.make_digest([i[1] for i in pending[:count + 1]])) <= limit:
+            count += 1
+        return count
+
+    @staticmethod
+    def drop(item: tuple) -> None:
+        if item[2]:
+            try:
+                item[2](None, Exception('推送消息积压过多, 已丢弃'), 1)
+            except Exception as e:
+                print(f'推送结果处理失败: {e}')
+
+    def _worker(self, channel: str, channel_queue: queue.Queue) -> None:
+        bucket = TokenBucket(*CHANNEL_RATE_LIMITS.get(channel, DEFAULT_RATE_LIMIT))
+        limit = CHANNEL_MESSAGE_LIMITS.get(channel, DEFAULT_MESSAGE_LIMIT)
+        pending = []
+        window_end = 0.0
+        while True:
+            timeout = max(0.0, window_end - time.monotonic()) if pending else None
+            try:
+                item = channel_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item:
+                now = time.monotonic()
+                if item[3]:
+                    bucket.try_acquire()
+                    self._deliver([item], limit)
+                elif not pending and now >= window_end and bucket.try_acquire():
+                    self._deliver([item], limit)
+                    window_end = time.monotonic() + self.coalesce_window
+                else:
+                    pending.append(item)
+                    if len(pending) > self.max_queue_size:
+                        self.drop(pending.pop(0))
+                channel_queue.task_done()
+
+            if pending and time.monotonic() >= window_end:
+                if bucket.try_acquire():
+                    count = self.take_batch(pending, limit)
+                    self._deliver(pending[:count], limit)
+                    pending = pending[count:]
+                    window_end = time.monotonic() + self.coalesce_window
+                else:
+                    window_end = time.monotonic() + bucket.wait_time()
+
+    def _deliver(self, items: list, limit: int = DEFAULT_MESSAGE_LIMIT) -> None:
+        send = items[0][0] if len(items) == 1 else items[0][4]
+        content = self.make_digest([i[1] for i in items])
+        if len(content) > limit:
+            content = content[:limit - 3] + '...'
+        result, error = None, None
+        for attempt in range(self.max_retries + 1):
+            try:
+                result, error = send(content), None
+                if result['success'] or not result['error']:
+                    break
+            except Exception as e:
+                error = e
+            if attempt < self.max_retries:
+                time.sleep(self.retry_delay * 2 ** attempt)
+        for callback in {i[2] for i in items if i[2]}:
+            try:
+                callback(result, error, len(items))
+            except Exception as e:
+                print(f'推送结果处理失败: {e}')
 
 
 def dingtalk(url: str, content: str, number: str = None, is_atall: bool = False) -> Dict[str, Any]:
@@ -40,11 +274,7 @@ def dingtalk(url: str, content: str, number: str = None, is_atall: bool = False)
             },
         }
         try:
-            data = json.dumps(json_data).encode('utf-8')
-            req = urllib.request.Request(api, data=data, headers=headers)
-            response = opener.open(req, timeout=10)
-            json_str = response.read().decode('utf-8')
-            json_data = json.loads(json_str)
+            json_data = post_json(api, json_data)
             if json_data['errcode'] == 0:
                 success.append(api)
             else:
@@ -66,11 +296,7 @@ def xizhi(url: str, title: str, content: str) -> Dict[str, Any]:
             'content': content
         }
         try:
-            data = json.dumps(json_data).encode('utf-8')
-            req = urllib.request.Request(api, data=data, headers=headers)
-            response = opener.open(req, timeout=10)
-            json_str = response.read().decode('utf-8')
-            json_data = json.loads(json_str)
+            json_data = post_json(api, json_data)
             if json_data['code'] == 200:
                 success.append(api)
             else:
@@ -97,14 +323,9 @@ def send_email(email_host: str, login_email: str, email_pass: str, sender_email:
         t_apart = MIMEText(content, 'plain', 'utf-8')
         message.attach(t_apart)
 
-        if open_ssl:
-            smtp_port = int(smtp_port) or 465
-            smtp_obj = smtplib.SMTP_SSL(email_host, smtp_port)
-        else:
-            smtp_port = int(smtp_port) or 25
-            smtp_obj = smtplib.SMTP(email_host, smtp_port)
-        smtp_obj.login(login_email, email_pass)
-        smtp_obj.sendmail(sender_email, receivers, message.as_string())
+        smtp_port = int(smtp_port or 0) or (465 if open_ssl else 25)
+        smtp_session.send(email_host, smtp_port, open_ssl, login_email, email_pass, sender_email, receivers,
+                          message.as_string())
         return {"success": receivers, "error": []}
     except smtplib.SMTPException as e:
         print(f'邮件推送失败, 推送邮箱：{to_email}, 错误信息:{e}')
@@ -118,11 +339,7 @@ def tg_bot(chat_id: int, token: str, content: str) -> Dict[str, Any]:
             'text': content
         }
         url = f'https://api.telegram.org/bot{token}/sendMessage'
-        data = json.dumps(json_data).encode('utf-8')
-        req = urllib.request.Request(url, data=data, headers=headers)
-        response = urllib.request.urlopen(req, timeout=15)
-        json_str = response.read().decode('utf-8')
-        _json_data = json.loads(json_str)
+        _json_data = post_json(url, json_data, timeout=15, trust_env=True)
         return {"success": [1], "error": []}
     except Exception as e:
         print(f'tg推送失败, 聊天ID：{chat_id}, 错误信息:{e}')
@@ -149,11 +366,7 @@ def bark(api: str, title: str = "message", content: str = 'test', level: str = "
             "url": url
         }
         try:
-            data = json.dumps(json_data).encode('utf-8')
-            req = urllib.request.Request(_api, data=data, headers=headers)
-            response = opener.open(req, timeout=10)
-            json_str = response.read().decode("utf-8")
-            json_data = json.loads(json_str)
+            json_data = post_json(_api, json_data)
             if json_data['code'] == 200:
                 success.append(_api)
             else:
@@ -193,20 +406,12 @@ def ntfy(api: str, title: str = "message", content: str = 'test', tags: str = 't
         }
 
         try:
-            data = json.dumps(json_data, ensure_ascii=False).encode('utf-8')
-            req = urllib.request.Request(server, data=data, headers=headers)
-            response = opener.open(req, timeout=10)
-            json_str = response.read().decode("utf-8")
-            json_data = json.loads(json_str)
+            json_data = post_json(server, json_data, ensure_ascii=False, raise_for_status=False)
             if "error" not in json_data:
                 success.append(_api)
             else:
                 error.append(_api)
                 print(f'ntfy推送失败, 推送地址：{_api}, 失败信息：{json_data["error"]}')
-        except urllib.error.HTTPError as e:
-            error.append(_api)
-            error_msg = e.read().decode("utf-8")
-            print(f'ntfy推送失败, 推送地址：{_api}, 错误信息:{json.loads(error_msg)["error"]}')
         except Exception as e:
             error.append(api)
             print(f'ntfy推送失败, 推送地址：{_api}, 错误信息:{e}')
@@ -231,11 +436,7 @@ def pushplus(token: str, title: str, content: str) -> Dict[str, Any]:
         
         try:
             url = 'https://www.pushplus.plus/send'
-            data = json.dumps(json_data).encode('utf-8')
-            req = urllib.request.Request(url, data=data, headers=headers)
-            response = opener.open(req, timeout=10)
-            json_str = response.read().decode('utf-8')
-            json_data = json.loads(json_str)
+            json_data = post_json(url, json_data)
             
             if json_data.get('code') == 200:
                 success.append(_token)
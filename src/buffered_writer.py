@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import BinaryIO
+
+
+class BufferedStreamWriter:
+    """
+    将网络数据拷贝到预分配的缓冲区, 缓冲区写满后一次性落盘
+
+    缓冲区大小按实测码率自适应调整, 目标是约每flush_interval秒写一次盘
+    """
+
+    def __init__(self, output: BinaryIO, min_buffer_size: int = 256 * 1024, max_buffer_size: int = 4 * 1024 * 1024,
+                 flush_interval: float = 1.0, close_output: bool = False) -> None:
+        self.output = output
+        self.close_output = close_output
+        self.min_buffer_size = min_buffer_size
+        self.max_buffer_size = max_buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = bytearray(min_buffer_size)
+        self.view = memoryview(self.buffer)
+        self.position = 0
+        self.written = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, data: bytes | memoryview) -> None:
+        data = memoryview(data)
+        while data:
+            size = min(len(data), len(self.buffer) - self.position)
+            self.view[self.position:self.position + size] = data[:size]
+            self.position += size
+            data = data[size:]
+            if self.position == len(self.buffer):
+                self.flush()
+        if self.position and time.monotonic() - self.last_flush > self.flush_interval * 2:
+            self.flush()
+
+    def tell(self) -> int:
+        return self.written + self.position
+
+    def flush(self) -> None:
+        now = time.monotonic()
+        if self.position:
+            # 无缓冲的FileIO.write可能只写入一部分, 需要循环直到全部落盘
+            pending = self.view[:self.position]
+            while pending:
+                pending = pending[self.output.write(pending):]
+            pending.release()
+            self.written += self.position
+            self._resize(self.position / max(now - self.last_flush, 0.001))
+            self.position = 0
+        self.last_flush = now
+
+    def _resize(self, bytes_per_second: float) -> None:
+        target = int(bytes_per_second * self.flush_interval)
+        target = max(self.min_buffer_size, min(self.max_buffer_size, target))
+        if target > len(self.buffer) * 2 or target < len(self.buffer) // 4:
+            self.view.release()
+            self.buffer = bytearray(target)
+            self.view = memoryview(self.buffer)
+
+    def close(self) -> None:
+        self.flush()
+        self.view.release()
+        if self.close_output:
+            self.output.close()
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+import abc
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable
+from . import metrics
+from .logger import logger
+from .sharding import FileLock, HashRing, write_json_atomic
+
+cluster_nodes_gauge = metrics.registry.gauge('recorder_cluster_nodes', 'Live nodes in the recorder cluster')
+cluster_leases_gauge = metrics.registry.gauge('recorder_cluster_leases_held', 'Room leases held by this node')
+cluster_sync_failures = metrics.registry.counter(
+    'recorder_cluster_sync_failures_total', 'Failed lease store synchronisations')
+
+
+class LeaseStore(abc.ABC):
+    """
+    直播间租约存储. 每次sync在一个事务内完成: 节点心跳、释放租约、续约本节点持有的租约、
+    抢占空闲或已过期的租约, 返回存活节点及其上报的info, 和本节点当前持有的直播间
+
+    过期时间使用各节点的系统时间, 集群内各主机需要开启时间同步, 时钟偏差应远小于租约时长的三分之一
+    """
+
+    @abc.abstractmethod
+    def sync(self, node_id: str, ttl: float, claim: set[str], release: set[str], info: dict | None = None) \
+            -> tuple[dict[str, dict], set[str]]:
+        ...
+
+    @abc.abstractmethod
+    def snapshot(self) -> dict:
+        ...
+
+    @staticmethod
+    def apply(state: dict, node_id: str, ttl: float, claim: set[str], release: set[str], info: dict | None) \
+            -> tuple[dict[str, dict], set[str]]:
+        now = time.time()
+        nodes, leases = state.setdefault('nodes', {}), state.setdefault('leases', {})
+        nodes[node_id] = {'expires_at': now + ttl, 'info': info or {}}
+        for node in [i for i, v in nodes.items() if v['expires_at'] < now - 3600]:
+            del nodes[node]
+        for room, lease in list(leases.items()):
+            if lease['node_id'] == node_id:
+                if room in release:
+                    del leases[room]
+                else:
+                    lease['expires_at'] = now + ttl
+            elif lease['expires_at'] < now - 3600:
+                del leases[room]
+        for room in claim:
+            lease = leases.get(room)
+            if lease is None or lease['expires_at'] < now:
+                leases[room] = {'node_id': node_id, 'expires_at': now + ttl}
+        live_nodes = {i: v['info'] for i, v in nodes.items() if v['expires_at'] >= now}
+        held = {room for room, lease in leases.items() if lease['node_id'] == node_id}
+        return live_nodes, held
+
+
+class FileLeaseStore(LeaseStore):
+    """
+    基于单个JSON文件和文件锁的存储, 用于单机多进程测试或没有可靠SQLite锁的共享目录
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = FileLock(f'{path}.lock')
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def sync(self, node_id: str, ttl: float, claim: set[str], release: set[str], info: dict | None = None) \
+            -> tuple[dict[str, dict], set[str]]:
+        with self.lock:
+            state = self.load()
+            result = self.apply(state, node_id, ttl, claim, release, info)
+            write_json_atomic(self.path, state)
+        return result
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return self.load()
+
+
+class SqliteLeaseStore(LeaseStore):
+    """
+    SQLite存储, 数据库文件放在各节点都能访问的共享卷上, 依靠SQLite的文件锁保证抢占租约的原子性.
+    NFS等网络文件系统需要支持POSIX文件锁
+    """
+
+    def __init__(self, path: str, timeout: float = 10) -> None:
+        self.path = path
+        self.timeout = timeout
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self.connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, "
+                         "info TEXT NOT NULL DEFAULT '{}')")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (room TEXT PRIMARY KEY, node_id TEXT NOT NULL, "
+                         "expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS leases_node ON leases (node_id)")
+        finally:
+            conn.close()
+
+    def connect(self) -> sqlite3.Connection:
+        # 共享卷上不使用WAL, WAL依赖共享内存, 不能跨主机使用
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    def sync(self, node_id: str, ttl: float, claim: set[str], release: set[str], info: dict | None = None) \
+            -> tuple[dict[str, dict], set[str]]:
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute("INSERT INTO nodes (node_id, expires_at, info) VALUES (?, ?, ?) ON CONFLICT(node_id) "
+                         "DO UPDATE SET expires_at = excluded.expires_at, info = excluded.info",
+                         (node_id, now + ttl, json.dumps(info or {}, ensure_ascii=False)))
+            conn.execute("DELETE FROM nodes WHERE expires_at < ?", (now - 3600,))
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (now - 3600,))
+            conn.executemany("DELETE FROM leases WHERE room = ? AND node_id = ?", [(i, node_id) for i in release])
+            conn.execute("UPDATE leases SET expires_at = ? WHERE node_id = ?", (now + ttl, node_id))
+            conn.executemany(
+                "INSERT INTO leases (room, node_id, expires_at) VALUES (?, ?, ?) ON CONFLICT(room) DO UPDATE SET "
+                "node_id = excluded.node_id, expires_at = excluded.expires_at WHERE leases.expires_at < ?",
+                [(room, node_id, now + ttl, now) for room in claim]
+            )
+            live_nodes = {i[0]: json.loads(i[1]) for i in conn.execute(
+                "SELECT node_id, info FROM nodes WHERE expires_at >= ?", (now,))}
+            held = {i[0] for i in conn.execute("SELECT room FROM leases WHERE node_id = ?", (node_id,))}
+            conn.execute("COMMIT")
+            return live_nodes, held
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def snapshot(self) -> dict:
+        conn = self.connect()
+        try:
+            return {
+                'nodes': {i[0]: {'expires_at': i[1], 'info': json.loads(i[2])}
+                          for i in conn.execute("SELECT node_id, expires_at, info FROM nodes")},
+                'leases': {i[0]: {'node_id': i[1], 'expires_at': i[2]}
+                           for i in conn.execute("SELECT room, node_id, expires_at FROM leases")},
+            }
+        finally:
+            conn.close()
+
+
+STORE_BACKENDS: dict[str, Callable[[str], LeaseStore]] = {
+    'sqlite': SqliteLeaseStore,
+    'file': FileLeaseStore,
+}
+
+
+def open_store(location: str) -> LeaseStore:
+    """
+    location格式为 backend:路径, 如 sqlite:/mnt/shared/leases.db 或 file:/mnt/shared/leases.json;
+    不带前缀时按扩展名判断, .json为文件存储, 其余为SQLite. 其他存储可注册到STORE_BACKENDS
+    """
+    backend, sep, path = location.partition(':')
+    if sep and backend in STORE_BACKENDS:
+        return STORE_BACKENDS[backend](path)
+    return (FileLeaseStore if location.endswith('.json') else SqliteLeaseStore)(location)
+
+
+def default_node_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class ClusterMember:
+    """
+    集群节点: 按存活节点列表对直播间做一致性哈希, 抢占分给自己的直播间的租约, 只录制持有有效租约的直播间
+
+    各节点可以使用不同的直播间配置, 节点在心跳中上报自己配置的直播间(URL哈希), 每个直播间只在
+    配置了它的存活节点之间哈希, 不会分给没有配置该直播间的节点
+
+    - 节点宕机后心跳和租约在ttl内过期, 其余节点重新计算归属并接管
+    - 新节点加入后, 原节点先停止录制分出去的直播间, 录制线程退出后才释放租约, 新节点随后才能抢到
+    - 存储不可用时无法续约, 距上次续约成功超过 ttl - fence_margin 即视为失去租约并停止录制,
+      保证在租约过期、其他节点接管之前本节点已经停止, 同一个直播间不会被两个节点同时录制
+    """
+
+    def __init__(self, store: LeaseStore, node_id: str | None = None, ttl: float = 30,
+                 on_lost: Callable[[str], None] | None = None, is_running: Callable[[str], bool] | None = None,
+                 is_recording: Callable[[str], bool] | None = None) -> None:
+        self.store = store
+        self.node_id = node_id or default_node_id()
+        self.ttl = ttl
+        self.fence_margin = ttl / 3
+        self.interval = ttl / 6
+        self.on_lost = on_lost
+        self.is_running = is_running or (lambda url: False)
+        self.is_recording = is_recording or (lambda url: False)
+        self.lock = threading.Lock()
+        self.rooms: set[str] = set()
+        self.valid_until: dict[str, float] = {}
+        self.draining: dict[str, float] = {}
+        self.nodes: list[str] = []
+        self.node_rooms: dict[str, set[str]] = {}
+        self.synced = False
+        self.last_error = None
+
+    def set_rooms(self, rooms: list[str]) -> None:
+        with self.lock:
+            self.rooms = set(rooms)
+
+    def owns(self, url: str) -> bool:
+        with self.lock:
+            return url not in self.draining and self.valid_until.get(url, 0) > time.monotonic()
+
+    @property
+    def is_leader(self) -> bool:
+        return bool(self.nodes) and self.nodes[0] == self.node_id
+
+    @staticmethod
+    def room_key(url: str) -> str:
+        return format(HashRing.hash(url), 'x')
+
+    def assign(self, rooms: set[str]) -> set[str]:
+        """
+        返回分给本节点的直播间: 每个直播间只在配置了它的节点之间做一致性哈希, 本节点按当前配置计算
+        """
+        rings = {}
+        desired = set()
+        for room in rooms:
+            key = self.room_key(room)
+            nodes = tuple(i for i in self.nodes if i == self.node_id or key in self.node_rooms.get(i, ()))
+            ring = rings.get(nodes)
+            if ring is None:
+                ring = rings[nodes] = HashRing(nodes)
+            if ring.owner(room) == self.node_id:
+                desired.add(room)
+        return desired
+
+    def lose(self, rooms: set[str]) -> None:
+        for room in rooms:
+            logger.warning(f"集群节点{self.node_id}失去直播间租约, 停止录制: {room}")
+            if self.on_lost:
+                self.on_lost(room)
+
+    def tick(self) -> None:
+        started = time.monotonic()
+        with self.lock:
+            rooms = set(self.rooms)
+            held = set(self.valid_until)
+            desired = self.assign(rooms) if self.synced else set()
+            to_drain = held - desired - set(self.draining)
+            for room in to_drain:
+                self.draining[room] = started
+        self.lose(to_drain)
+
+        release = set()
+        with self.lock:
+            for room, since in self.draining.items():
+                # 录制线程退出后释放; 线程一直在重试获取直播间信息时, 等待一个ttl后只要没有在录制也释放
+                if not self.is_running(room) or (started - since > self.ttl and not self.is_recording(room)):
+                    release.add(room)
+
+        try:
+            live_nodes, held_now = self.store.sync(
+                self.node_id, self.ttl, desired - held, release,
+                {'rooms': len(held - release), 'room_keys': sorted(self.room_key(i) for i in rooms),
+                 'updated_at': time.time()}
+            )
+        except Exception as e:
+            cluster_sync_failures.inc()
+            self.last_error = str(e)
+            logger.error(f"集群租约同步失败: {e}")
+            with self.lock:
+                expired = {i for i, until in self.valid_until.items() if until <= time.monotonic()}
+                for room in expired:
+                    del self.valid_until[room]
+                    self.draining.pop(room, None)
+            self.lose(expired - set(to_drain))
+            return
+
+        self.last_error = None
+        nodes = sorted(set(live_nodes) | {self.node_id})
+        with self.lock:
+            lost = set(self.valid_until) - held_now - release - set(self.draining)
+            for room in release | lost:
+                self.draining.pop(room, None)
+            self.valid_until = {room: started + self.ttl - self.fence_margin for room in held_now}
+            if nodes != self.nodes:
+                logger.debug(f"集群节点变化: {nodes}")
+                self.nodes = nodes
+            self.node_rooms = {i: set(v.get('room_keys', [])) for i, v in live_nodes.items()}
+            self.synced = True
+        cluster_nodes_gauge.set(len(nodes))
+        cluster_leases_gauge.set(len(held_now))
+        self.lose(lost)
+
+    def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"错误信息: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
+            time.sleep(max(0.1, self.interval - (time.monotonic() - started)))
+
+    def start(self) -> 'ClusterMember':
+        threading.Thread(target=self.run, name='cluster_member', daemon=True).start()
+        return self
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                'node_id': self.node_id,
+                'nodes': list(self.nodes),
+                'leader': self.is_leader,
+                'leases_held': len(self.valid_until),
+                'draining': sorted(self.draining),
+                'last_error': self.last_error,
+            }
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import threading
+from typing import Callable
+import httpx
+from .buffered_writer import BufferedStreamWriter
+from .flv import FlvSegmentWriter
+from .logger import logger
+
+OptionalDict = dict | None
+
+
+def download_stream(client: httpx.Client, url: str, save_path: str, headers: OptionalDict = None,
+                    stop_event: threading.Event | None = None, timeout: float = 30,
+                    parse_flv: bool = False, split_time: int | str = 0,
+                    on_write: Callable[[int], None] | None = None) -> bool | None:
+    """
+    下载直播流到文件, 正常结束返回True, 请求失败返回False, 被stop_event中断返回None
+
+    parse_flv为True时经FlvSegmentWriter解析修复后写入, split_time大于0时按关键帧直接分段;
+    timeout为读取超时, CDN连接不断开也不再发送数据时抛出httpx.ReadTimeout, 避免录制线程永久阻塞;
+    每写入一块数据以其字节数调用on_write
+    """
+    stop_event = stop_event or threading.Event()
+    request_timeout = httpx.Timeout(timeout, connect=10)
+    with client.stream('GET', url, headers=headers, timeout=request_timeout) as response:
+        if response.status_code != 200:
+            logger.error(f"请求直播流失败，状态码: {response.status_code}")
+            return False
+
+        if parse_flv:
+            writer = FlvSegmentWriter(save_path, split_time=split_time)
+        else:
+            writer = BufferedStreamWriter(open(save_path, 'wb', buffering=0), close_output=True)
+        try:
+            # 直播流一般不压缩, iter_raw可以省去iter_bytes的解码和重新分块拷贝
+            chunks = response.iter_bytes() if response.headers.get('content-encoding') else response.iter_raw()
+            for chunk in chunks:
+                if stop_event.is_set():
+                    return None
+                writer.write(chunk)
+                if on_write:
+                    on_write(len(chunk))
+        finally:
+            writer.close()
+    return True
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from .buffered_writer import BufferedStreamWriter
+from .logger import logger
+from .segment_manifest import write_manifest
+
+FLV_HEADER_SIZE = 9
+TAG_HEADER_SIZE = 11
+AUDIO_TAG = 8
+VIDEO_TAG = 9
+SCRIPT_TAG = 18
+MAX_TAG_DATA_SIZE = 16 * 1024 * 1024
+
+
+class FlvSegmentWriter:
+    """
+    边下载边解析FLV tag: 校验tag边界并重新同步, 修正时间戳跳变, 按关键帧切分文件并生成关键帧索引
+
+    save_path在分段时需包含%03d等序号占位符, 每个分段都会重新写入FLV头、onMetaData和音视频序列头,
+    时间戳从0开始, 与ffmpeg segment的-reset_timestamps 1效果一致
+    """
+
+    def __init__(self, save_path: str, split_time: int | str = 0, write_index: bool = True,
+                 max_gap_ms: int = 3000) -> None:
+        self.save_path = save_path
+        self.split_ms = int(float(split_time) * 1000)
+        self.write_index = write_index
+        self.max_gap_ms = max_gap_ms
+        self.buffer = bytearray()
+        self.header = None
+        self.metadata_tag = None
+        self.video_header_tag = None
+        self.audio_header_tag = None
+        self.has_video = False
+        self.writer = None
+        self.segment_path = None
+        self.segment_start_ts = 0
+        self.last_ts = None
+        self.ts_offset = 0
+        self.keyframes = []
+        self.segments = []
+        self.segment_info = []
+        self.resync_count = 0
+        self.timestamp_fix_count = 0
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        buf = self.buffer
+        pos = 0
+        if self.header is None:
+            pos = self._parse_header()
+            if pos is None:
+                return
+
+        while len(buf) - pos >= TAG_HEADER_SIZE:
+            tag_type = buf[pos] & 0x1f
+            data_size = int.from_bytes(buf[pos + 1:pos + 4], 'big')
+            if not self._is_tag_header(pos):
+                pos = self._resync(pos + 1)
+                continue
+
+            end = pos + TAG_HEADER_SIZE + data_size
+            if len(buf) < end + 4:
+                break
+            if int.from_bytes(buf[end:end + 4], 'big') != TAG_HEADER_SIZE + data_size:
+                pos = self._resync(pos + 1)
+                continue
+
+            timestamp = int.from_bytes(buf[pos + 4:pos + 7], 'big') | (buf[pos + 7] << 24)
+            self._handle_tag(tag_type, timestamp, bytes(buf[pos:end]))
+            pos = end + 4
+        del buf[:pos]
+
+    def _parse_header(self) -> int | None:
+        buf = self.buffer
+        start = buf.find(b'FLV')
+        if start < 0 or len(buf) - start < FLV_HEADER_SIZE + 4:
+            return None
+        data_offset = int.from_bytes(buf[start + 5:start + 9], 'big')
+        self.header = bytes(buf[start:start + 5]) + FLV_HEADER_SIZE.to_bytes(4, 'big')
+        return start + data_offset + 4
+
+    def _is_tag_header(self, pos: int) -> bool:
+        buf = self.buffer
+        return (buf[pos] & 0x1f in (AUDIO_TAG, VIDEO_TAG, SCRIPT_TAG)
+                and buf[pos + 8:pos + 11] == b'\x00\x00\x00'
+                and int.from_bytes(buf[pos + 1:pos + 4], 'big') <= MAX_TAG_DATA_SIZE)
+
+    def _resync(self, pos: int) -> int:
+        buf = self.buffer
+        self.resync_count += 1
+        while len(buf) - pos >= TAG_HEADER_SIZE:
+            if self._is_tag_header(pos):
+                end = pos + TAG_HEADER_SIZE + int.from_bytes(buf[pos + 1:pos + 4], 'big')
+                if len(buf) < end + 4:
+                    return pos
+                if int.from_bytes(buf[end:end + 4], 'big') == end - pos:
+                    logger.debug(f"FLV tag边界异常, 已重新同步: {self.segment_path}")
+                    return pos
+            pos += 1
+        return pos
+
+    def _fix_timestamp(self, timestamp: int) -> int:
+        out_ts = timestamp + self.ts_offset
+        if self.last_ts is not None and abs(out_ts - self.last_ts) > self.max_gap_ms:
+            self.timestamp_fix_count += 1
+            self.ts_offset += self.last_ts - out_ts
+            out_ts = self.last_ts
+        if self.last_ts is None or out_ts > self.last_ts:
+            self.last_ts = out_ts
+        return out_ts
+
+    def _handle_tag(self, tag_type: int, timestamp: int, tag: bytes) -> None:
+        flags = tag[TAG_HEADER_SIZE] if len(tag) > TAG_HEADER_SIZE else 0
+        packet_type = tag[TAG_HEADER_SIZE + 1] if len(tag) > TAG_HEADER_SIZE + 1 else -1
+        is_keyframe = False
+        is_sequence_header = False
+
+        if tag_type == SCRIPT_TAG:
+            if self.metadata_tag is None:
+                self.metadata_tag = tag
+            return
+        elif tag_type == VIDEO_TAG:
+            self.has_video = True
+            if flags & 0x80:
+                # Enhanced RTMP (HEVC/AV1): 低4位是packet type
+                is_keyframe = (flags >> 4) & 0x07 == 1
+                is_sequence_header = flags & 0x0f == 0
+            else:
+                is_keyframe = flags >> 4 == 1
+                is_sequence_header = flags & 0x0f in (7, 12) and packet_type == 0
+            if is_sequence_header:
+                self.video_header_tag = tag
+        elif (flags >> 4) == 10 and packet_type == 0:
+            is_sequence_header = True
+            self.audio_header_tag = tag
+
+        if is_sequence_header:
+            if self.writer:
+                self._write_tag(tag, self.last_ts - self.segment_start_ts if self.last_ts else 0)
+            return
+
+        out_ts = self._fix_timestamp(timestamp)
+        can_split = is_keyframe if self.has_video else tag_type == AUDIO_TAG
+        if self.writer is None or (self.split_ms and can_split and out_ts - self.segment_start_ts >= self.split_ms):
+            self._open_segment(out_ts)
+
+        relative_ts = max(0, out_ts - self.segment_start_ts)
+        if is_keyframe:
+            self.keyframes.append((relative_ts / 1000, self.writer.tell()))
+        self._write_tag(tag, relative_ts)
+
+    def _write_tag(self, tag: bytes, timestamp: int) -> None:
+        view = memoryview(tag)
+        self.writer.write(view[:4])
+        self.writer.write((timestamp & 0xffffff).to_bytes(3, 'big') + bytes([(timestamp >> 24) & 0xff]))
+        self.writer.write(view[8:])
+        self.writer.write(len(tag).to_bytes(4, 'big'))
+
+    def _open_segment(self, start_ts: int) -> None:
+        self._close_segment()
+        self.segment_path = self.save_path % len(self.segments) if self.split_ms else self.save_path
+        self.segments.append(self.segment_path)
+        self.writer = BufferedStreamWriter(open(self.segment_path, 'wb', buffering=0), close_output=True)
+        self.segment_start_ts = start_ts
+        self.keyframes = []
+        self.writer.write(self.header + b'\x00\x00\x00\x00')
+        for tag in (self.metadata_tag, self.video_header_tag, self.audio_header_tag):
+            if tag:
+                self._write_tag(tag, 0)
+
+    def _close_segment(self) -> None:
+        if self.writer is None:
+            return
+        size = self.writer.tell()
+        self.writer.close()
+        self.writer = None
+        start = self.segment_start_ts / 1000
+        end = max(self.last_ts or 0, self.segment_start_ts) / 1000
+        self.segment_info.append({
+            "index": len(self.segment_info),
+            "file": os.path.basename(self.segment_path),
+            "start": start,
+            "end": end,
+            "duration": round(end - start, 3),
+            "size": size,
+            "first_keyframe_time": self.keyframes[0][0] if self.keyframes else None,
+            "first_keyframe_position": self.keyframes[0][1] if self.keyframes else None,
+        })
+        if self.write_index and self.keyframes:
+            index_path = self.segment_path.rsplit('.', maxsplit=1)[0] + '.keyframes.json'
+            with open(index_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "times": [i[0] for i in self.keyframes],
+                    "filepositions": [i[1] for i in self.keyframes]
+                }, f)
+
+    def close(self) -> None:
+        self._close_segment()
+        if self.split_ms and self.segment_info:
+            write_manifest(self.save_path, self.segment_info, keyframe_aligned=self.has_video)
+        if self.resync_count or self.timestamp_fix_count:
+            logger.debug(f"FLV修复: 重新同步{self.resync_count}次, 时间戳修正{self.timestamp_fix_count}次, "
+                         f"文件: {os.path.basename(self.save_path)}")
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import time
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from typing import Callable
+from urllib.parse import urljoin
+import httpx
+from .http_clients.pool import get_client
+from .logger import logger
+
+OptionalStr = str | None
+OptionalDict = dict | None
+
+
+class HlsUnsupportedError(Exception):
+    pass
+
+
+@dataclass
+class HlsSegment:
+    sequence: int
+    url: str
+    duration: float
+
+
+@dataclass
+class MediaPlaylist:
+    media_sequence: int
+    target_duration: float
+    segments: list[HlsSegment]
+    end_list: bool
+
+
+def select_variant(playlist_text: str, base_url: str) -> OptionalStr:
+    best_url = None
+    best_bandwidth = -1
+    lines = playlist_text.splitlines()
+    for index, line in enumerate(lines):
+        if not line.startswith('#EXT-X-STREAM-INF'):
+            continue
+        bandwidth = re.search(r'BANDWIDTH=(\d+)', line)
+        bandwidth = int(bandwidth.group(1)) if bandwidth else 0
+        for uri in lines[index + 1:]:
+            uri = uri.strip()
+            if uri and not uri.startswith('#'):
+                if bandwidth > best_bandwidth:
+                    best_url, best_bandwidth = urljoin(base_url, uri), bandwidth
+                break
+    return best_url
+
+
+def parse_media_playlist(playlist_text: str, base_url: str) -> MediaPlaylist:
+    if not playlist_text.lstrip().startswith('#EXTM3U'):
+        raise ValueError("Invalid m3u8 playlist")
+
+    media_sequence = 0
+    target_duration = 2.0
+    end_list = False
+    segments = []
+    duration = 0.0
+    for line in playlist_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            media_sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            target_duration = float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0] or 0)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            end_list = True
+        elif line.startswith('#EXT-X-KEY') and 'METHOD=NONE' not in line:
+            raise HlsUnsupportedError("Encrypted HLS stream")
+        elif line.startswith('#EXT-X-MAP'):
+            raise HlsUnsupportedError("fMP4 HLS stream")
+        elif not line.startswith('#'):
+            sequence = media_sequence + len(segments)
+            segments.append(HlsSegment(sequence, urljoin(base_url, line), duration))
+            duration = 0.0
+    return MediaPlaylist(media_sequence, target_duration, segments, end_list)
+
+
+class HlsDownloader:
+    """
+    轮询媒体播放列表, 并发下载新分片, 按media sequence去重后顺序追加写入输出文件;
+    每写入一个分片以写入的字节数调用on_write
+    """
+
+    def __init__(self, url: str, save_path: str, headers: OptionalDict = None, proxy_addr: OptionalStr = None,
+                 should_stop: Callable[[], bool] | None = None, max_workers: int = 4, retries: int = 3,
+                 timeout: float = 15, max_playlist_errors: int = 5,
+                 on_write: Callable[[int], None] | None = None) -> None:
+        self.url = url
+        self.save_path = save_path
+        self.headers = headers or {}
+        self.should_stop = should_stop or (lambda: False)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.timeout = timeout
+        self.max_playlist_errors = max_playlist_errors
+        self.on_write = on_write
+        self.client = get_client(proxy_addr)
+        self.next_sequence = None
+        self.recent_urls = deque(maxlen=64)
+        self.pending: dict[int, Future] = {}
+        self.output = None
+        self.downloaded_bytes = 0
+        self.dropped_segments = 0
+
+    def _get(self, url: str) -> httpx.Response:
+        last_error = None
+        for attempt in range(self.retries):
+            try:
+                response = self.client.get(url, headers=self.headers, timeout=self.timeout)
+                if response.status_code == 200:
+                    return response
+                last_error = httpx.HTTPStatusError(
+                    f"status code: {response.status_code}", request=response.request, response=response)
+                if response.status_code in (403, 404, 410):
+                    break
+            except httpx.HTTPError as e:
+                last_error = e
+            if attempt < self.retries - 1:
+                time.sleep(min(0.5 * 2 ** attempt, 4))
+        raise last_error
+
+    def _fetch_playlist(self) -> MediaPlaylist:
+        response = self._get(self.url)
+        text = response.text
+        if '#EXT-X-STREAM-INF' in text:
+            variant_url = select_variant(text, str(response.url))
+            if not variant_url:
+                raise ValueError("No variant found in master playlist")
+            self.url = variant_url
+            response = self._get(self.url)
+            text = response.text
+        return parse_media_playlist(text, str(response.url))
+
+    def _fetch_segment(self, segment: HlsSegment) -> bytes:
+        return self._get(segment.url).content
+
+    def _queue_segments(self, executor: ThreadPoolExecutor, playlist: MediaPlaylist) -> None:
+        segments = playlist.segments
+        if not segments:
+            return
+
+        if self.next_sequence is None:
+            # 首次只从倒数第3个分片开始, 与ffmpeg的直播起播位置一致
+            self.next_sequence = segments[max(0, len(segments) - 3)].sequence
+        elif segments[-1].sequence < self.next_sequence - 1 and segments[-1].url not in self.recent_urls:
+            logger.debug(f"HLS media sequence reset: {self.next_sequence} -> {playlist.media_sequence}")
+            self._flush_pending(wait=True)
+            self.next_sequence = playlist.media_sequence
+
+        queued = max(self.pending) + 1 if self.pending else self.next_sequence
+        for segment in segments:
+            if segment.sequence < queued or segment.url in self.recent_urls:
+                continue
+            self.recent_urls.append(segment.url)
+            self.pending[segment.sequence] = executor.submit(self._fetch_segment, segment)
+            queued = segment.sequence + 1
+
+    def _flush_pending(self, wait: bool = False) -> None:
+        while self.pending:
+            sequence = min(self.pending)
+            future = self.pending[sequence]
+            if not wait and not future.done():
+                break
+            del self.pending[sequence]
+            try:
+                data = future.result()
+            except Exception as e:
+                self.dropped_segments += 1
+                logger.warning(f"HLS分片下载失败, 已跳过: {sequence} {e}")
+                data = None
+            if data:
+                self.output.write(data)
+                self.downloaded_bytes += len(data)
+                if self.on_write:
+                    self.on_write(len(data))
+            self.next_sequence = sequence + 1
+
+    def run(self) -> bool:
+        playlist_errors = 0
+        with open(self.save_path, 'wb') as output, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            self.output = output
+            try:
+                while True:
+                    if self.should_stop():
+                        # 已下载完成且按顺序连续的分片先写入, 其余未完成的分片在finally中取消
+                        self._flush_pending()
+                        return False
+
+                    try:
+                        playlist = self._fetch_playlist()
+                        playlist_errors = 0
+                    except HlsUnsupportedError:
+                        if self.downloaded_bytes == 0:
+                            raise
+                        return True
+                    except Exception as e:
+                        playlist_errors += 1
+                        logger.debug(f"HLS播放列表获取失败({playlist_errors}/{self.max_playlist_errors}): {e}")
+                        if playlist_errors >= self.max_playlist_errors:
+                            self._flush_pending(wait=True)
+                            return self.downloaded_bytes > 0
+                        time.sleep(1)
+                        continue
+
+                    self._queue_segments(executor, playlist)
+                    self._flush_pending()
+                    if playlist.end_list:
+                        self._flush_pending(wait=True)
+                        return self.downloaded_bytes > 0
+
+                    deadline = time.monotonic() + max(playlist.target_duration / 2, 0.5)
+                    while time.monotonic() < deadline and not self.should_stop():
+                        time.sleep(0.2)
+                        self._flush_pending()
+            finally:
+                for future in self.pending.values():
+                    future.cancel()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import threading
+import httpx
+from .. import utils
+
+OptionalStr = str | None
+
+_clients: dict[tuple, httpx.Client] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(proxy_addr: OptionalStr = None, http2: bool = True, verify: bool = False) -> httpx.Client:
+    """
+    返回按代理地址复用的httpx.Client, 同一代理下的所有录制共享连接池
+    """
+    proxy_addr = utils.handle_proxy_addr(proxy_addr)
+    key = (proxy_addr, http2, verify)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.Client(
+                proxy=proxy_addr,
+                http2=http2,
+                verify=verify,
+                timeout=httpx.Timeout(20, connect=10),
+                limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+                follow_redirects=True
+            )
+            _clients[key] = client
+    return client
+
+
+def close_all() -> None:
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
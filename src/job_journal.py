@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_CONVERTED = 'converted'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def temp_output_path(path: str) -> str:
+    return path + '.part'
+
+
+class JobJournal:
+    """
+    基于SQLite的后处理任务日志, 记录每个任务的输入、输出和状态
+
+    任务状态: pending -> running -> converted(输出已就绪) -> done(按需删除原文件后)
+    """
+
+    def __init__(self, db_path: str, keep_days: int = 7) -> None:
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                args TEXT NOT NULL,
+                inputs TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                delete_inputs INTEGER NOT NULL DEFAULT 0,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+        with self.lock:
+            self.conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                              (STATUS_DONE, STATUS_FAILED, time.time() - keep_days * 86400))
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        for key in ('args', 'inputs', 'outputs'):
+            job[key] = json.loads(job[key])
+        job['delete_inputs'] = bool(job['delete_inputs'])
+        return job
+
+    def add(self, kind: str, args: list, inputs: list[str], outputs: list[str], delete_inputs: bool = False,
+            priority: int = 0) -> int | None:
+        now = time.time()
+        args_text = json.dumps(args, ensure_ascii=False)
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND args = ? AND status IN (?, ?, ?)",
+                (kind, args_text, STATUS_PENDING, STATUS_RUNNING, STATUS_CONVERTED)
+            ).fetchone()
+            if exists:
+                return None
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (kind, args, inputs, outputs, delete_inputs, priority, status, created_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, args_text, json.dumps(inputs, ensure_ascii=False), json.dumps(outputs, ensure_ascii=False),
+                 int(delete_inputs), priority, STATUS_PENDING, now, now)
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id: int) -> dict | None:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def update(self, job_id: int, status: str, outputs: list[str] | None = None, error: str | None = None) -> None:
+        with self.lock:
+            if outputs is None:
+                self.conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                                  (status, error, time.time(), job_id))
+            else:
+                self.conn.execute("UPDATE jobs SET status = ?, outputs = ?, error = ?, updated_at = ? WHERE id = ?",
+                                  (status, json.dumps(outputs, ensure_ascii=False), error, time.time(), job_id))
+
+    def unfinished(self) -> list[dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?, ?) ORDER BY priority, id",
+                (STATUS_PENDING, STATUS_RUNNING, STATUS_CONVERTED)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def count(self, *statuses: str) -> int:
+        statuses = statuses or (STATUS_PENDING, STATUS_RUNNING, STATUS_CONVERTED)
+        with self.lock:
+            return self.conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE status IN ({','.join('?' * len(statuses))})", statuses
+            ).fetchone()[0]
+
+
+def rollback_outputs(outputs: list[str]) -> list[str]:
+    """
+    删除任务中断时残留的临时输出文件, 输出路径可以是ffmpeg的%03d分段模板
+    """
+    removed = []
+    for output in outputs:
+        pattern = glob.escape(temp_output_path(output)).replace('%03d', '[0-9]*')
+        for path in glob.glob(pattern):
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def finalize_outputs(outputs: list[str]) -> list[str]:
+    """
+    将临时输出文件重命名为正式文件, 返回最终的文件列表
+    """
+    finished = []
+    for output in outputs:
+        pattern = glob.escape(temp_output_path(output)).replace('%03d', '[0-9]*')
+        for path in sorted(glob.glob(pattern)):
+            final_path = path[:-len('.part')]
+            os.replace(path, final_path)
+            finished.append(final_path)
+    return finished
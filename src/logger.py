@@ -8,8 +8,9 @@ logger.remove()
 
 custom_format = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> - <level>{message}</level>"
 
+# 写入时再取sys.stderr, 状态面板替换sys.stderr后日志输出也能被记录到
 logger.add(
-    sink=sys.stderr,
+    sink=lambda message: sys.stderr.write(message),
     format=custom_format,
     level="DEBUG",
     colorize=True,
@@ -17,9 +18,11 @@ logger.add(
 )
 
 script_path = os.path.split(os.path.realpath(sys.argv[0]))[0]
+# 多进程模式下每个工作进程写入独立的日志文件, 避免多个进程同时轮转同一个文件
+log_suffix = f"_worker{os.environ['DLR_SHARD_INDEX']}" if os.environ.get('DLR_SHARD_INDEX') else ""
 
 logger.add(
-    f"{script_path}/logs/streamget.log",
+    f"{script_path}/logs/streamget{log_suffix}.log",
     level="DEBUG",
     format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} - {message}",
     filter=lambda i: i["level"].name != "INFO",
@@ -31,7 +34,7 @@ logger.add(
 )
 
 logger.add(
-    f"{script_path}/logs/PlayURL.log",
+    f"{script_path}/logs/PlayURL{log_suffix}.log",
     level="INFO",
     format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {message}",
     filter=lambda i: i["level"].name == "INFO",
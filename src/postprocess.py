@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+import time
+from typing import Callable
+from .job_journal import (
+    JobJournal, rollback_outputs, finalize_outputs,
+    STATUS_PENDING, STATUS_RUNNING, STATUS_CONVERTED, STATUS_DONE, STATUS_FAILED
+)
+from .logger import logger
+
+# 数值越小越先执行, 纯封装转换比重新编码快得多, 优先处理
+PRIORITY_REMUX = 0
+PRIORITY_ENCODE = 1
+
+
+class PostProcessQueue:
+    """
+    录制完成后的转码/分段任务队列, 以固定数量的工作线程执行
+
+    每个任务的输入、输出和状态都记录在JobJournal中, 处理函数只写入临时文件(.part),
+    成功后才重命名为正式文件并按需删除原文件. 启动时回滚中断任务残留的临时文件并重新执行,
+    已生成输出但未删除原文件的任务则直接完成收尾
+    """
+
+    def __init__(self, handlers: dict[str, Callable], journal_path: str) -> None:
+        self.handlers = handlers
+        self.journal = JobJournal(journal_path)
+        self.queue = queue.PriorityQueue()
+        self.running = 0
+        self.lock = threading.Lock()
+        self.started = False
+        self.recover()
+
+    def submit(self, kind: str, *args, inputs: list[str], outputs: list[str], delete_inputs: bool = False,
+               priority: int = PRIORITY_REMUX) -> int | None:
+        job_id = self.journal.add(kind, list(args), inputs, outputs, delete_inputs, priority)
+        if job_id is not None:
+            self.queue.put((priority, job_id))
+        return job_id
+
+    def qsize(self) -> int:
+        return self.journal.count()
+
+    def recover(self) -> None:
+        jobs = self.journal.unfinished()
+        if jobs:
+            logger.debug(f"恢复{len(jobs)}个未完成的后处理任务")
+        for job in jobs:
+            if job['kind'] not in self.handlers:
+                continue
+            if job['status'] == STATUS_CONVERTED:
+                self._finish(job)
+                continue
+            if job['status'] == STATUS_RUNNING:
+                removed = rollback_outputs(job['outputs'])
+                if removed:
+                    logger.debug(f"已清理中断任务的临时文件: {removed}")
+                self.journal.update(job['id'], STATUS_PENDING)
+            self.queue.put((job['priority'], job['id']))
+
+    def adopt(self, journal_path: str) -> None:
+        """
+        接管另一个任务日志中未完成的任务, 如减少多进程录制的工作进程数后不再有进程使用的日志;
+        任务转入本队列的日志后在原日志中标记为完成
+        """
+        other = JobJournal(journal_path)
+        try:
+            jobs = other.unfinished()
+            if jobs:
+                logger.debug(f"从{journal_path}接管{len(jobs)}个未完成的后处理任务")
+            for job in jobs:
+                if job['kind'] not in self.handlers:
+                    continue
+                if job['status'] == STATUS_RUNNING:
+                    rollback_outputs(job['outputs'])
+                job_id = self.journal.add(job['kind'], job['args'], job['inputs'], job['outputs'],
+                                          job['delete_inputs'], job['priority'])
+                if job_id is not None and job['status'] == STATUS_CONVERTED:
+                    self.journal.update(job_id, STATUS_CONVERTED, outputs=job['outputs'])
+                    self._finish(self.journal.get(job_id))
+                elif job_id is not None:
+                    self.queue.put((job['priority'], job_id))
+                other.update(job['id'], STATUS_DONE)
+        finally:
+            other.close()
+
+    def start(self, workers: int = 0) -> None:
+        if self.started:
+            return
+        self.started = True
+        # 默认按CPU核数的一半启动工作线程, 避免大量录制同时结束时并发编码拖垮CPU和磁盘
+        workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'postprocess_{i}', daemon=True).start()
+
+    def _finish(self, job: dict) -> None:
+        if job['delete_inputs']:
+            time.sleep(1)
+            for path in job['inputs']:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.journal.update(job['id'], STATUS_DONE)
+
+    def _worker(self) -> None:
+        while True:
+            _priority, job_id = self.queue.get()
+            job = self.journal.get(job_id)
+            if not job or job['status'] != STATUS_PENDING:
+                self.queue.task_done()
+                continue
+
+            with self.lock:
+                self.running += 1
+            try:
+                self.journal.update(job_id, STATUS_RUNNING)
+                self.handlers[job['kind']](*job['args'])
+                outputs = finalize_outputs(job['outputs'])
+                if not outputs:
+                    raise RuntimeError("no output file was produced")
+                self.journal.update(job_id, STATUS_CONVERTED, outputs=outputs)
+                self._finish(job)
+            except Exception as e:
+                rollback_outputs(job['outputs'])
+                self.journal.update(job_id, STATUS_FAILED, error=str(e))
+                logger.error(f"后处理任务执行失败: {job['kind']} {job['inputs']} 错误信息: {e}")
+            finally:
+                with self.lock:
+                    self.running -= 1
+                self.queue.task_done()
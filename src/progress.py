@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import IO
+
+PROGRESS_KEYS = {
+    'frame', 'fps', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms', 'out_time',
+    'dup_frames', 'drop_frames', 'speed', 'progress'
+}
+
+
+def progress_args() -> list[str]:
+    """
+    ffmpeg全局参数: 以key=value形式将进度输出到stdout, 并关闭stderr上的统计行
+    """
+    return ["-progress", "pipe:1", "-nostats"]
+
+
+@dataclass
+class RecordingStats:
+    frame: int = 0
+    fps: float = 0.0
+    bitrate_kbps: float = 0.0
+    total_size: int = 0
+    out_time: float = 0.0
+    dup_frames: int = 0
+    drop_frames: int = 0
+    speed: float = 0.0
+    ended: bool = False
+    started_at: float = field(default_factory=time.monotonic)
+    updated_at: float = field(default_factory=time.monotonic)
+    # 最近一次写入字节数或输出时长增长的时间, 用于判断录制是否停滞
+    advanced_at: float = field(default_factory=time.monotonic)
+    # 第一次写出数据的时间, 之后才开始计算停滞时间, 也用于统计录制启动延迟
+    first_output_at: float | None = None
+    # 已计入recorder_recorded_bytes_total的字节数
+    counted_size: int = 0
+
+    def add_bytes(self, size: int) -> None:
+        """
+        内置下载器没有ffmpeg进度输出, 按写入的字节数更新, 码率按开始输出以来的平均值计算
+        """
+        now = time.monotonic()
+        if size > 0:
+            self.total_size += size
+            self.advanced_at = now
+            if self.first_output_at is None:
+                self.first_output_at = now
+            elapsed = now - self.first_output_at
+            self.bitrate_kbps = self.total_size * 8 / 1000 / elapsed if elapsed > 0 else 0.0
+        self.updated_at = now
+
+    def stalled_for(self) -> float:
+        return time.monotonic() - self.advanced_at
+
+    def summary(self) -> str:
+        return (f"码率: {self.bitrate_kbps:.0f}kbps | 速度: {self.speed:.2f}x | "
+                f"已写入: {self.total_size / 1024 / 1024:.1f}MB | 丢帧: {self.drop_frames}")
+
+
+def _to_float(value: str) -> float | None:
+    value = value.strip().rstrip('x')
+    if value.endswith('kbits/s'):
+        value = value[:-len('kbits/s')]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ProgressReader:
+    """
+    在后台线程中读取ffmpeg -progress输出, 每收到一个完整的进度块就更新一次RecordingStats
+
+    ffmpeg的错误信息也会输出到同一管道中, 非进度行原样转发到控制台
+    """
+
+    def __init__(self, stream: IO[bytes], stats: RecordingStats | None = None) -> None:
+        self.stream = stream
+        self.stats = stats or RecordingStats()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.pending = {}
+
+    def start(self) -> 'ProgressReader':
+        self.thread.start()
+        return self
+
+    def _run(self) -> None:
+        for raw_line in iter(self.stream.readline, b''):
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            key, sep, value = line.partition('=')
+            if sep and key in PROGRESS_KEYS:
+                self.pending[key] = value
+                if key == 'progress':
+                    self._commit()
+            elif line:
+                sys.stdout.write(line + '\n')
+        self.stream.close()
+
+    def _commit(self) -> None:
+        values, self.pending = self.pending, {}
+        stats = self.stats
+        now = time.monotonic()
+
+        # out_time_ms实际上也是微秒, 旧版本ffmpeg只有这一项
+        out_time_us = _to_float(values.get('out_time_us') or values.get('out_time_ms') or '')
+        out_time = out_time_us / 1000000 if out_time_us is not None and out_time_us >= 0 else stats.out_time
+        total_size = int(_to_float(values.get('total_size', '')) or stats.total_size)
+        if out_time > stats.out_time or total_size > stats.total_size:
+            stats.advanced_at = now
+        # 分段录制时segment muxer自己写文件, 没有主输出文件, total_size为N/A; 有附加输出时total_size
+        # 是第一个输出的大小, 不一定是录制文件. 以输出时长开始增长为准, 没有输出时长时才看total_size
+        if stats.first_output_at is None and (out_time > 0 or (out_time_us is None and total_size > 0)):
+            stats.first_output_at = now
+
+        stats.out_time = out_time
+        stats.total_size = total_size
+        stats.frame = int(_to_float(values.get('frame', '')) or stats.frame)
+        stats.fps = _to_float(values.get('fps', '')) or 0.0
+        stats.bitrate_kbps = _to_float(values.get('bitrate', '')) or 0.0
+        stats.speed = _to_float(values.get('speed', '')) or 0.0
+        stats.dup_frames = int(_to_float(values.get('dup_frames', '')) or stats.dup_frames)
+        stats.drop_frames = int(_to_float(values.get('drop_frames', '')) or stats.drop_frames)
+        stats.ended = values.get('progress') == 'end'
+        stats.updated_at = now
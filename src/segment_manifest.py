@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os
+import time
+from .job_journal import temp_output_path
+from .logger import logger
+
+MANIFEST_VERSION = 1
+
+
+def manifest_base(save_file_path: str) -> str:
+    return save_file_path.replace('_%03d', '').rsplit('.', maxsplit=1)[0]
+
+
+def manifest_path(save_file_path: str) -> str:
+    return manifest_base(save_file_path) + '.segments.json'
+
+
+def segment_list_path(save_file_path: str) -> str:
+    return manifest_base(save_file_path) + '.segments.csv'
+
+
+def segment_list_args(list_path: str) -> list[str]:
+    """
+    让ffmpeg segment在每个分段结束时把文件名和起止时间追加到csv列表中
+    """
+    return ["-segment_list", list_path, "-segment_list_type", "csv"]
+
+
+def read_segment_list(list_path: str) -> dict[str, tuple[float, float]]:
+    entries = {}
+    if not os.path.exists(list_path):
+        return entries
+    with open(list_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            try:
+                entries[os.path.basename(row[0])] = (float(row[1]), float(row[2]))
+            except ValueError:
+                continue
+    return entries
+
+
+def write_manifest(save_file_path: str, segments: list[dict], keyframe_aligned: bool = True,
+                   output_path: str | None = None) -> dict:
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "pattern": os.path.basename(save_file_path),
+        "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "keyframe_aligned": keyframe_aligned,
+        "total_duration": round(sum(i['duration'] or 0 for i in segments), 3),
+        "total_size": sum(i['size'] for i in segments),
+        "segments": segments,
+    }
+    output_path = output_path or manifest_path(save_file_path)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def build_manifest(save_file_path: str, temp: bool = False, keyframe_aligned: bool = True) -> dict | None:
+    """
+    根据ffmpeg输出的分段列表生成清单文件, 记录每个分段的文件名、起止时间、时长和大小
+
+    按序号逐个检查分段文件, 进程被强制结束时列表中缺失的最后一个分段也会被收录, 时长记为None;
+    temp为True时分段和清单都以临时文件(.part)形式存在, 由后处理队列在任务成功后统一重命名
+    """
+    list_path = segment_list_path(save_file_path)
+    if temp:
+        list_path = temp_output_path(list_path)
+    entries = read_segment_list(list_path)
+
+    segments = []
+    index = 0
+    while True:
+        path = save_file_path.replace('%03d', f'{index:03d}')
+        real_path = temp_output_path(path) if temp else path
+        if not os.path.exists(real_path):
+            break
+        name = os.path.basename(real_path)
+        start, end = entries.get(name, (None, None))
+        segments.append({
+            "index": index,
+            "file": os.path.basename(path),
+            "start": start,
+            "end": end,
+            "duration": round(end - start, 3) if start is not None else None,
+            "size": os.path.getsize(real_path),
+            "first_keyframe_time": None,
+            "first_keyframe_position": None,
+        })
+        index += 1
+
+    if os.path.exists(list_path):
+        os.remove(list_path)
+    if not segments:
+        return None
+
+    output_path = manifest_path(save_file_path)
+    manifest = write_manifest(save_file_path, segments, keyframe_aligned,
+                              temp_output_path(output_path) if temp else output_path)
+    logger.debug(f"已生成分段清单: {output_path} 共{len(segments)}个分段")
+    return manifest
+
+
+def load_manifest(save_file_path: str) -> dict | None:
+    path = manifest_path(save_file_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"分段清单读取失败: {path} 错误信息: {e}")
+        return None
+
+
+def manifest_segment_paths(save_file_path: str, manifest: dict | None = None) -> list[str]:
+    manifest = manifest or load_manifest(save_file_path)
+    if not manifest:
+        return []
+    directory = os.path.dirname(save_file_path)
+    return [os.path.join(directory, i['file']) for i in manifest['segments']]
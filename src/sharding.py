@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+import bisect
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from . import metrics
+from .logger import logger
+from .status_renderer import StatusRenderer
+
+ENV_INDEX = 'DLR_SHARD_INDEX'
+ENV_COUNT = 'DLR_SHARD_COUNT'
+ENV_STATE = 'DLR_SHARD_STATE'
+ENV_METRICS_PORT = 'DLR_SHARD_METRICS_PORT'
+
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*})?\s+(\S+)$')
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+class HashRing:
+    """
+    一致性哈希环, 每个节点放置replicas个虚拟节点. 节点增减时只有落在该节点区间内的直播间会换节点
+    """
+
+    def __init__(self, nodes: list, replicas: int = 100) -> None:
+        self.nodes = list(nodes)
+        points = []
+        for node in self.nodes:
+            for i in range(replicas):
+                points.append((self.hash(f'{node}#{i}'), node))
+        points.sort()
+        self.keys = [i[0] for i in points]
+        self.points = [i[1] for i in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def owner(self, key: str):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.keys, self.hash(key)) % len(self.keys)
+        return self.points[index]
+
+
+class FileLock:
+    """
+    跨进程的文件锁, 同时持有进程内的线程锁. 多个工作进程共同修改URL_config.ini等文件时使用
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.thread_lock = threading.Lock()
+        self.fd = None
+
+    def __enter__(self) -> 'FileLock':
+        self.thread_lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            if os.name == 'nt':
+                while True:
+                    try:
+                        msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except BaseException:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *args) -> None:
+        try:
+            if os.name == 'nt':
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+            self.thread_lock.release()
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+class ShardMembership:
+    """
+    工作进程一侧的分片信息: 读取监督进程维护的状态文件, 按当前可用的工作进程计算直播间归属
+
+    本进程不在可用列表中时(刚启动或刚重启, 监督进程尚未确认就绪)不接管任何直播间;
+    正在交接的直播间(handover)在原进程停止录制前不属于任何进程. applied_version为本进程已按其
+    释放直播间的状态版本, 由录制脚本处理完一轮配置后更新, 通过/status报告给监督进程
+    """
+
+    def __init__(self, index: int, count: int, state_path: str, metrics_port: int = 0) -> None:
+        self.index = index
+        self.count = count
+        self.state_path = state_path
+        self.metrics_port = metrics_port
+        self.workers = []
+        self.ring = HashRing(self.workers)
+        self.handover: set[str] = set()
+        self.version = 0
+        self.applied_version = 0
+
+    def refresh(self) -> bool:
+        """
+        返回可用工作进程列表是否发生变化; 状态文件不存在或读取失败时保持上一次的结果
+        """
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            workers = sorted(int(i) for i in state['workers'])
+            handover = set(state.get('handover', []))
+            version = int(state.get('version', 0))
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.handover = handover
+        self.version = version
+        if workers == self.workers:
+            return False
+        self.workers = workers
+        self.ring = HashRing(workers)
+        return True
+
+    @property
+    def is_leader(self) -> bool:
+        # 删除重复行等不可重复执行的配置文件整理只由编号最小的可用进程负责
+        return bool(self.workers) and self.index == self.workers[0]
+
+    def owns(self, url: str) -> bool:
+        return url not in self.handover and self.ring.owner(url) == self.index
+
+
+def shard_from_env() -> ShardMembership | None:
+    if not os.environ.get(ENV_INDEX):
+        return None
+    return ShardMembership(int(os.environ[ENV_INDEX]), int(os.environ[ENV_COUNT]), os.environ[ENV_STATE],
+                           int(os.environ.get(ENV_METRICS_PORT) or 0))
+
+
+def merge_metrics(sources: list[tuple[str | None, str]]) -> str:
+    """
+    合并多个进程的Prometheus文本, 为每个样本加上worker标签, 同名指标的HELP/TYPE只保留一份
+    """
+    families = {}
+    for worker, text in sources:
+        family = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith('#'):
+                parts = line.split(maxsplit=3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    family = parts[2]
+                    headers = families.setdefault(family, ({}, []))[0]
+                    headers.setdefault(parts[1], line)
+                continue
+            match = SAMPLE_PATTERN.match(line)
+            if not match or family is None:
+                continue
+            name, labels, value = match.groups()
+            if worker is not None:
+                worker_label = f'worker="{worker}"'
+                labels = '{' + worker_label + (',' + labels[1:] if labels and labels != '{}' else '}')
+            families[family][1].append(f'{name}{labels or ""} {value}')
+
+    lines = []
+    for headers, samples in families.values():
+        lines += [headers[i] for i in ('HELP', 'TYPE') if i in headers]
+        lines += samples
+    return '\n'.join(lines) + '\n'
+
+
+class Worker:
+    def __init__(self, index: int, metrics_port: int) -> None:
+        self.index = index
+        self.metrics_port = metrics_port
+        self.process: subprocess.Popen | None = None
+        self.restarts = 0
+        self.backoff = 0
+        self.next_start = 0.0
+        self.started_at = 0.0
+        self.ready = False
+        self.status: dict | None = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def fetch(self, path: str, timeout: float = 2) -> bytes | None:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{self.metrics_port}{path}', timeout=timeout) as response:
+                return response.read()
+        except (OSError, ValueError):
+            return None
+
+
+class AggregatedRegistry:
+    """
+    供MetricsServer使用: 每次抓取时汇总各工作进程的/metrics, 再加上监督进程自身的指标
+    """
+
+    def __init__(self, supervisor: 'ShardSupervisor') -> None:
+        self.supervisor = supervisor
+
+    def render(self) -> str:
+        sources = [(None, metrics.registry.render())]
+        for worker in self.supervisor.workers:
+            body = worker.fetch('/metrics') if worker.alive else None
+            if body:
+                sources.append((str(worker.index), body.decode('utf-8', errors='ignore')))
+        return merge_metrics(sources)
+
+
+class ShardSupervisor:
+    """
+    多进程模式的监督进程: 启动count个工作进程运行同一个录制脚本, 按URL一致性哈希分配直播间
+
+    监督进程自身不录制, 只维护可用工作进程列表(状态文件), 工作进程在每轮读取配置时据此决定
+    接管或释放直播间. 工作进程崩溃后立即从列表中移除, 其直播间由其余进程接管, 随后按指数退避重启
+
+    列表变化时仍存活的原进程正在监测的直播间先进入交接状态, 等原进程确认已应用新的状态版本、
+    且/status中该直播间不再录制后才交给新进程, 避免重启的进程就绪后两个进程同时录制同一个直播间
+    """
+
+    def __init__(self, command: list[str], count: int, state_path: str, log_dir: str, metrics_port: int,
+                 version: str = '', startup_timeout: float = 60) -> None:
+        self.command = command
+        self.state_path = state_path
+        self.log_dir = log_dir
+        self.version = version
+        self.workers = [Worker(i, metrics_port + 1 + i) for i in range(count)]
+        self.state_version = 0
+        self.published: list[int] | None = None
+        self.handover: dict[str, tuple[int, int]] = {}
+        self.started_at = time.monotonic()
+        self.startup_timeout = startup_timeout
+        self.stopping = False
+        self.ready_gauge = metrics.registry.gauge(
+            'recorder_shard_workers_ready', 'Worker processes that are ready and own rooms')
+        self.restart_counter = metrics.registry.counter(
+            'recorder_shard_worker_restarts_total', 'Worker processes restarted after exiting', ('worker',))
+
+    def write_state(self) -> None:
+        self.state_version += 1
+        write_json_atomic(self.state_path, {'version': self.state_version, 'workers': self.published,
+                                            'handover': sorted(self.handover), 'updated_at': time.time()})
+
+    def publish(self) -> None:
+        workers = [i.index for i in self.workers if i.alive and i.ready]
+        if workers == self.published:
+            return
+        if (self.published is None and len(workers) < len(self.workers)
+                and time.monotonic() - self.started_at < self.startup_timeout):
+            # 首次分配等所有工作进程就绪后再发布, 避免先就绪的进程接管全部直播间后又逐个释放
+            return
+        previous, ring = HashRing(self.published or []), HashRing(workers)
+        version = self.state_version + 1
+        for worker in self.workers:
+            status = self.fetch_status(worker) if self.published else None
+            for room in (status or {}).get('rooms', []):
+                url = room['url']
+                if url not in self.handover and previous.owner(url) == worker.index != ring.owner(url):
+                    self.handover[url] = (worker.index, version)
+        for url, (index, _) in list(self.handover.items()):
+            if ring.owner(url) == index:
+                # 交接完成前又分回原进程, 直接取消交接
+                del self.handover[url]
+        self.published = workers
+        self.write_state()
+        self.ready_gauge.set(len(workers))
+
+    def release_handover(self) -> None:
+        """
+        原进程已退出, 或已应用发起交接的状态版本且不再录制该直播间时, 结束交接
+        """
+        if not self.handover:
+            return
+        statuses = {}
+        released = []
+        for url, (index, version) in self.handover.items():
+            worker = self.workers[index]
+            if index not in statuses:
+                statuses[index] = self.fetch_status(worker)
+            status = statuses[index]
+            if not worker.alive:
+                released.append(url)
+            elif status is not None and (status.get('shard_version') is None or status['shard_version'] >= version):
+                if not any(i['url'] == url and i.get('recording') for i in status.get('rooms', [])):
+                    released.append(url)
+        for url in released:
+            logger.debug(f"直播间交接完成: {url}")
+            del self.handover[url]
+        if released:
+            self.write_state()
+
+    @staticmethod
+    def fetch_status(worker: Worker) -> dict | None:
+        body = worker.fetch('/status') if worker.alive else None
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            return None
+
+    def spawn(self, worker: Worker) -> None:
+        env = dict(os.environ)
+        env.update({
+            ENV_INDEX: str(worker.index),
+            ENV_COUNT: str(len(self.workers)),
+            ENV_STATE: self.state_path,
+            ENV_METRICS_PORT: str(worker.metrics_port),
+        })
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(f'{self.log_dir}/worker_{worker.index}.log', 'ab') as log_file:
+            worker.process = subprocess.Popen(
+                self.command, env=env, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT)
+        worker.started_at = time.monotonic()
+        logger.debug(f"工作进程{worker.index}已启动, pid={worker.process.pid}")
+
+    def check_workers(self) -> None:
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process is not None and not worker.alive:
+                code = worker.process.returncode
+                worker.process = None
+                worker.ready = False
+                worker.status = None
+                # 运行超过10分钟后才退出的视为偶发崩溃, 退避时间从头计算
+                if now - worker.started_at > 600:
+                    worker.backoff = 0
+                delay = min(60, 2 ** worker.backoff)
+                worker.backoff += 1
+                worker.restarts += 1
+                worker.next_start = now + delay
+                self.restart_counter.inc(str(worker.index))
+                logger.error(f"工作进程{worker.index}已退出(返回码{code}), 其直播间转交其他进程, {delay}秒后重启")
+            if worker.process is None and now >= worker.next_start:
+                self.spawn(worker)
+            elif worker.alive and not worker.ready:
+                # 状态接口可以访问后才视为就绪, 重启的进程就绪前其直播间仍由其他进程录制
+                worker.ready = worker.fetch('/status', timeout=0.5) is not None
+        self.publish()
+        self.release_handover()
+
+    def poll_status(self) -> None:
+        for worker in self.workers:
+            worker.status = self.fetch_status(worker)
+
+    def status(self) -> dict:
+        workers, rooms = [], []
+        totals = {'monitoring': 0, 'recording': 0, 'postprocess_queue_depth': 0}
+        for worker in self.workers:
+            status = worker.status or {}
+            for key in totals:
+                totals[key] += status.get(key) or 0
+            for room in status.get('rooms', []):
+                rooms.append(dict(room, worker=worker.index))
+            workers.append({
+                'index': worker.index,
+                'pid': worker.process.pid if worker.alive else None,
+                'alive': worker.alive,
+                'restarts': worker.restarts,
+                'metrics_port': worker.metrics_port,
+                'monitoring': status.get('monitoring'),
+                'recording': status.get('recording'),
+                'max_request': status.get('max_request'),
+                'error_count': status.get('error_count'),
+            })
+        return {'version': self.version, 'mode': 'sharded', **totals, 'workers': workers, 'rooms': rooms}
+
+    def display(self) -> None:
+        renderer = StatusRenderer()
+        while not self.stopping:
+            time.sleep(5)
+            try:
+                self.poll_status()
+                if renderer.headless:
+                    continue
+                status = self.status()
+                lines = [f"多进程模式: {len(self.workers)}个工作进程 | 共监测{status['monitoring']}个直播中 | "
+                         f"正在录制{status['recording']}个 | 当前时间: {time.strftime('%H:%M:%S', time.localtime())}"]
+                for worker in status['workers']:
+                    state = (f"监测{worker['monitoring'] or 0}个 录制{worker['recording'] or 0}个"
+                             if worker['alive'] else "未运行")
+                    lines.append(f"工作进程{worker['index']}: {state} | 重启{worker['restarts']}次")
+                recording_rooms = [i for i in status['rooms'] if i.get('recording')]
+                if recording_rooms:
+                    lines.append("x" * 60)
+                    lines += [f"{i['record_name']} 正在录制中 [工作进程{i['worker']}]" for i in recording_rooms]
+                    lines.append("x" * 60)
+                renderer.render(lines)
+            except Exception as e:
+                logger.error(f"错误信息: {e} 发生错误的行数: {e.__traceback__.tb_lineno}")
+
+    def stop(self, timeout: float = 15) -> None:
+        self.stopping = True
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+
+    def run(self) -> None:
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        try:
+            self.check_workers()
+            threading.Thread(target=self.display, name='shard_display', daemon=True).start()
+            while True:
+                time.sleep(1)
+                self.check_workers()
+        finally:
+            self.stop()
+
+
+def worker_command() -> list[str]:
+    # 打包后的可执行文件直接重新运行自身, 否则用当前解释器运行入口脚本
+    if getattr(sys, 'frozen', False):
+        return [sys.executable]
+    return [sys.executable, os.path.realpath(sys.argv[0])]
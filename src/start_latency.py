@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from . import metrics
+
+LATENCY_BUCKETS = (0.5, 1, 2, 3, 5, 8, 10, 15, 20, 30, 60, 120, 300)
+
+start_latency_histogram = metrics.registry.histogram(
+    'recorder_start_latency_seconds',
+    'Time from detecting a room as live to the first recorded byte, reason is live or reconnect',
+    ('platform', 'reason'), buckets=LATENCY_BUCKETS
+)
+go_live_latency_histogram = metrics.registry.histogram(
+    'recorder_go_live_latency_seconds',
+    "Time from the platform's reported go-live time to the first recorded byte",
+    ('platform',), buckets=LATENCY_BUCKETS
+)
+
+
+class StartLatencyTracker:
+    """
+    记录每个直播间从检测到开播到录制文件写入第一个字节的耗时, 即每场直播开头丢失的时长
+
+    同一场直播中断流重新获取直播流后的录制记为reconnect; 平台返回了开播时间(live_start_time)时,
+    额外统计从平台开播到写入第一个字节的耗时, 程序启动时已经在直播的直播间不计入这一项
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.pending: dict[str, dict] = {}
+        self.recorded: set[str] = set()
+        self.seen_offline: set[str] = set()
+        self.last: dict[str, dict] = {}
+
+    def live_detected(self, record_url: str, platform: str, live_start_time: float | None = None) -> None:
+        with self.lock:
+            if record_url in self.pending:
+                return
+            self.pending[record_url] = {
+                'platform': platform,
+                'reason': 'reconnect' if record_url in self.recorded else 'live',
+                'detected_at': time.monotonic(),
+                'live_start_time': live_start_time if record_url in self.seen_offline else None,
+            }
+
+    def recording_ended(self, record_url: str, platform: str) -> None:
+        """
+        录制结束时直播间可能仍在直播, 从此刻开始计算到重新写入第一个字节的耗时
+        """
+        with self.lock:
+            if record_url in self.pending or record_url not in self.recorded:
+                return
+            self.pending[record_url] = {
+                'platform': platform, 'reason': 'reconnect', 'detected_at': time.monotonic(), 'live_start_time': None
+            }
+
+    def went_offline(self, record_url: str) -> None:
+        with self.lock:
+            self.pending.pop(record_url, None)
+            self.recorded.discard(record_url)
+            self.seen_offline.add(record_url)
+
+    def first_byte(self, record_url: str, at: float | None = None) -> dict | None:
+        """
+        at为写入第一个字节时的time.monotonic(), 每次检测到开播后只统计一次
+        """
+        at = at or time.monotonic()
+        with self.lock:
+            mark = self.pending.pop(record_url, None)
+            if not mark:
+                return None
+            self.recorded.add(record_url)
+            result = {
+                'platform': mark['platform'],
+                'reason': mark['reason'],
+                'detect_to_first_byte': round(max(at - mark['detected_at'], 0), 3),
+                'go_live_to_first_byte': None,
+                'time': time.time(),
+            }
+            if mark['live_start_time']:
+                go_live_latency = time.time() - (time.monotonic() - at) - mark['live_start_time']
+                if go_live_latency >= 0:
+                    result['go_live_to_first_byte'] = round(go_live_latency, 3)
+            self.last[record_url] = result
+
+        start_latency_histogram.observe(result['detect_to_first_byte'], result['platform'], result['reason'])
+        if result['go_live_to_first_byte'] is not None:
+            go_live_latency_histogram.observe(result['go_live_to_first_byte'], result['platform'])
+        return result
+
+    def snapshot(self) -> dict[str, dict]:
+        with self.lock:
+            return dict(self.last)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import threading
+from typing import TextIO
+
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+CLEAR_LINE = "\x1b[K"
+CLEAR_BELOW = "\x1b[J"
+
+
+class TrackedStream:
+    """
+    包装sys.stdout或sys.stderr, 记录两次刷新之间是否有其他线程输出内容;
+    两者写到同一个终端, 共用一个dirty标记
+    """
+
+    def __init__(self, stream: TextIO, dirty: threading.Event | None = None) -> None:
+        self.stream = stream
+        self.dirty = dirty or threading.Event()
+
+    def write(self, text: str) -> int:
+        if text:
+            self.dirty.set()
+        return self.stream.write(text)
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+class StatusRenderer:
+    """
+    状态面板渲染: 整帧拼接后一次write输出, 用ANSI光标定位只重绘变化的行, 不再调用系统clear命令
+
+    期间stdout或stderr(日志)有其他输出导致屏幕滚动时整屏重绘一次; stdout不是终端(如Docker日志)时不渲染
+    """
+
+    def __init__(self, stream: TextIO | None = None, headless: bool | None = None) -> None:
+        stream = stream or sys.stdout
+        if headless is None:
+            headless = stream is None or not hasattr(stream, 'isatty') or not stream.isatty()
+        self.headless = headless
+        if os.name == 'nt' and not headless:
+            # 让Windows控制台启用ANSI转义序列处理
+            os.system('')
+        self.lock = threading.Lock()
+        self.previous = []
+        if isinstance(stream, TrackedStream):
+            self.tracked = stream
+        elif not headless and stream is sys.stdout:
+            self.tracked = sys.stdout = TrackedStream(stream)
+            if sys.stderr is not None and not isinstance(sys.stderr, TrackedStream):
+                sys.stderr = TrackedStream(sys.stderr, self.tracked.dirty)
+        else:
+            self.tracked = None
+        self.output = self.tracked.stream if self.tracked else stream
+
+    def render(self, lines: list[str]) -> None:
+        if self.headless:
+            return
+        with self.lock:
+            full_redraw = not self.previous or (self.tracked is not None and self.tracked.dirty.is_set())
+            buffer = [CLEAR_SCREEN] if full_redraw else []
+            for row, line in enumerate(lines):
+                if full_redraw or row >= len(self.previous) or self.previous[row] != line:
+                    buffer.append(f"\x1b[{row + 1};1H{line}{CLEAR_LINE}")
+            if not full_redraw and len(lines) < len(self.previous):
+                buffer.append(f"\x1b[{len(lines) + 1};1H{CLEAR_BELOW}")
+            buffer.append(f"\x1b[{len(lines) + 1};1H")
+            self.output.write(''.join(buffer))
+            self.output.flush()
+            self.previous = list(lines)
+            if self.tracked is not None:
+                self.tracked.dirty.clear()
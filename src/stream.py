@@ -18,9 +18,6 @@ from operator import itemgetter
 import urllib.parse
 import urllib.request
 from .utils import trace_error_decorator
-from .spider import (
-    get_douyu_stream_data, get_bilibili_stream_data
-)
 from .http_clients.async_http import get_response_status
 
 QUALITY_MAPPING = {"OD": 0, "BD": 0, "UHD": 1, "HD": 2, "SD": 3, "LD": 4}
@@ -74,6 +71,8 @@ async def get_douyin_stream_url(json_data: dict, video_quality: str, proxy_addr:
             'm3u8_url': m3u8_url,
             'flv_url': flv_url,
             'record_url': m3u8_url or flv_url,
+            # 房间的创建时间即本场直播的开播时间(秒级时间戳)
+            'live_start_time': json_data.get('create_time'),
         }
     return result
 
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import datetime
+import math
+import time
+
+
+def format_srt_time(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    s, ms = divmod(milliseconds, 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+class SrtTimeline:
+    """
+    按秒生成录制时间字幕, 条目由单调时钟计算, 不受sleep抖动影响
+
+    文件保持打开并缓冲写入, 每flush_interval秒落盘一次; 录制结束时可根据起止时间整体重写
+    """
+
+    def __init__(self, file_path: str, encoding: str = 'utf-8-sig', flush_interval: float = 10,
+                 start_wall_time: datetime.datetime | None = None, media_offset: float = 0) -> None:
+        self.file_path = file_path
+        self.encoding = encoding
+        self.flush_interval = flush_interval
+        self.start_monotonic = time.monotonic()
+        self.start_wall_time = start_wall_time or datetime.datetime.now()
+        self.media_offset = media_offset
+        self.written = 0
+        self.last_flush = self.start_monotonic
+        self.file = open(file_path, 'w', encoding=encoding, buffering=64 * 1024)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_monotonic
+
+    def entry(self, index: int) -> str:
+        start = index + self.media_offset
+        wall_time = self.start_wall_time + datetime.timedelta(seconds=index)
+        return (f"{index + 1}\n{format_srt_time(max(start, 0))} --> {format_srt_time(max(start + 1, 0))}\n"
+                f"{wall_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+
+    def update(self) -> None:
+        now = time.monotonic()
+        target = int(now - self.start_monotonic) + 1
+        if target > self.written:
+            self.file.write(''.join(self.entry(i) for i in range(self.written, target)))
+            self.written = target
+        if now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+
+    def sleep_to_next_entry(self) -> None:
+        time.sleep(max(0.0, self.written - self.elapsed()))
+
+    def regenerate(self, stop_wall_time: datetime.datetime | None = None, media_duration: float | None = None) -> None:
+        """
+        按起止时间重写整个字幕文件; 已知实际媒体时长时, 以停止时间倒推媒体第0秒对应的时间, 使字幕与画面对齐
+        """
+        stop_wall_time = stop_wall_time or datetime.datetime.now()
+        if media_duration:
+            self.start_wall_time = stop_wall_time - datetime.timedelta(seconds=media_duration)
+            self.media_offset = 0
+            duration = media_duration
+        else:
+            duration = (stop_wall_time - self.start_wall_time).total_seconds()
+        total = max(1, math.ceil(duration))
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(''.join(self.entry(i) for i in range(total)))
+        self.written = total
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import queue
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable
+from . import metrics
+from .logger import logger
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+enabled = False
+stage_histogram = metrics.registry.histogram(
+    'recorder_stage_duration_seconds', 'Time spent in each instrumented stage of the probe pipeline', ('stage',),
+    buckets=STAGE_BUCKETS
+)
+current_span = contextvars.ContextVar('current_span', default=None)
+export_queue = None
+NULL_SPAN = contextlib.nullcontext()
+
+
+def enable(export_path: str | None = None) -> None:
+    """
+    开启耗时追踪; export_path不为空时把每个span以JSON Lines格式追加写入该文件
+    """
+    global enabled, export_queue
+    enabled = True
+    if export_path and export_queue is None:
+        export_queue = queue.Queue(maxsize=10000)
+        threading.Thread(target=_export_worker, args=(export_path,), name='trace_export', daemon=True).start()
+
+
+def _export_worker(export_path: str) -> None:
+    with open(export_path, 'a', encoding='utf-8') as f:
+        while True:
+            records = [export_queue.get()]
+            while not export_queue.empty() and len(records) < 1000:
+                records.append(export_queue.get_nowait())
+            f.write(''.join(json.dumps(i, ensure_ascii=False) + '\n' for i in records))
+            f.flush()
+
+
+def record(name: str, start: float, parent: str | None = None, **attrs: Any) -> None:
+    """
+    记录一个从start(time.monotonic())开始到现在的阶段耗时, 未开启追踪时直接返回
+    """
+    if not enabled:
+        return
+    duration = time.monotonic() - start
+    stage_histogram.observe(duration, name)
+    if export_queue is not None:
+        item = {
+            'name': name,
+            'start': time.time() - duration,
+            'duration_ms': round(duration * 1000, 3),
+            'thread': threading.current_thread().name,
+            'parent': parent if parent is not None else current_span.get(),
+        }
+        if attrs:
+            item['attrs'] = attrs
+        try:
+            export_queue.put_nowait(item)
+        except queue.Full:
+            pass
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'parent', 'token')
+
+    def __init__(self, name: str, attrs: dict) -> None:
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> 'Span':
+        self.parent = current_span.get()
+        self.token = current_span.set(self.name)
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        current_span.reset(self.token)
+        record(self.name, self.start, self.parent, **self.attrs)
+
+
+def span(name: str, **attrs: Any) -> Span | contextlib.nullcontext:
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, attrs)
+
+
+async def _await_traced(awaitable, name: str) -> Any:
+    with span(name):
+        return await awaitable
+
+
+def traced(func: Callable, name: str) -> Callable:
+    """
+    包装函数并记录耗时, 同时支持普通函数和返回协程的函数(包括被同步装饰器包装过的async函数)
+    """
+    if getattr(func, '__traced__', False):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        if inspect.iscoroutinefunction(func):
+            return _await_traced(func(*args, **kwargs), name)
+        parent = current_span.get()
+        token = current_span.set(name)
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            current_span.reset(token)
+        if inspect.isawaitable(result):
+            # 同步装饰器包装的async函数返回的是协程, 改为在await时计时
+            return _await_traced(result, name)
+        record(name, start, parent)
+        return result
+
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def instrument_module(module: ModuleType, prefix: str, names: list[str] | None = None) -> list[str]:
+    """
+    替换模块命名空间中的函数为带追踪的版本; names为空时包装该模块中定义的所有公开函数
+    """
+    instrumented = []
+    for attr in names or dir(module):
+        func = getattr(module, attr, None)
+        if not callable(func) or isinstance(func, type) or attr.startswith('_'):
+            continue
+        if names is None and getattr(func, '__module__', None) != module.__name__:
+            continue
+        setattr(module, attr, traced(func, f"{prefix}.{attr}"))
+        instrumented.append(attr)
+    logger.debug(f"已开启耗时追踪: {prefix} {len(instrumented)}个函数")
+    return instrumented
+
+
+class TimedLock:
+    """
+    包装Semaphore/Lock, 记录在with语句中等待获取的时间
+    """
+
+    def __init__(self, lock: Any, name: str) -> None:
+        self.lock = lock
+        self.name = name
+
+    def __enter__(self) -> Any:
+        start = time.monotonic()
+        result = self.lock.__enter__()
+        record(self.name, start)
+        return result
+
+    def __exit__(self, *exc_info) -> Any:
+        return self.lock.__exit__(*exc_info)
@@ -194,6 +194,15 @@ def replace_url(file_path: str | Path, old: str, new: str) -> None:
             f.write(content.replace(old, new))
 
 
+def get_input_pacing_args(pacing_mode: str) -> list[str]:
+    # native: 按原始帧率读取(-re); adaptive: 最多以1.5倍速追赶缓冲; unthrottled: 不限速, 网络恢复后立即追平
+    if pacing_mode == 'native':
+        return ["-re"]
+    elif pacing_mode == 'adaptive':
+        return ["-readrate", "1.5"]
+    return []
+
+
 def get_query_params(url: str, param_name: OptionalStr) -> dict | list[str]:
     parsed_url = urlparse(url)
     query_params = parse_qs(parsed_url.query)